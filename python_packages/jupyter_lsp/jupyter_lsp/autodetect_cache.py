@@ -0,0 +1,185 @@
+""" keep the language servers found by autodetection between server starts
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Text
+
+from jupyter_core.paths import jupyter_config_path
+
+from .constants import APP_CONFIG_D_SECTIONS
+
+#: bumped whenever the format of the cache, or what is detected, changes
+CACHE_VERSION = 3
+
+#: the spec finder for which the R libraries are fingerprinted
+R_ENTRY_POINT = "r-languageserver"
+
+
+def _mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _entry_point_versions(entry_points: Iterable[Any]) -> List[List[Any]]:
+    versions = []
+    for ep in entry_points:
+        dist = getattr(ep, "dist", None)
+        versions.append(
+            [
+                ep.name,
+                getattr(ep, "value", None),
+                getattr(dist, "name", None),
+                getattr(dist, "version", None),
+            ]
+        )
+    return sorted(versions)
+
+
+def _conf_d_mtimes() -> Dict[Text, Optional[int]]:
+    mtimes: Dict[Text, Optional[int]] = {}
+    for config_path in jupyter_config_path():
+        for app in APP_CONFIG_D_SECTIONS:
+            config = Path(config_path, f"jupyter{app}config.json")
+            config_d = Path(config_path, f"jupyter{app}config.d")
+            for path in [config, config_d, *sorted(config_d.glob("*.json"))]:
+                mtimes[str(path)] = _mtime(path)
+    return mtimes
+
+
+def _path_mtimes() -> Dict[Text, Optional[int]]:
+    """the directories on ``PATH``, which change when a command is installed"""
+    return {
+        path: _mtime(Path(path))
+        for path in os.environ.get("PATH", "").split(os.pathsep)
+        if path
+    }
+
+
+def _r_library_mtimes() -> Dict[Text, Optional[int]]:
+    """the R libraries, which change when a package is installed, as far as they
+    can be found without running R, which is slow to start
+    """
+    paths = [
+        Path(path)
+        for name in ["R_LIBS", "R_LIBS_USER", "R_LIBS_SITE"]
+        for path in os.environ.get(name, "").split(os.pathsep)
+        if path
+    ]
+
+    rscript = shutil.which("Rscript")
+    if rscript:
+        bin_dir = Path(os.path.realpath(rscript)).parent
+        prefix = bin_dir.parent
+        # R_HOME is where Rscript is (e.g. /usr/lib/R), or in its prefix (conda)
+        for r_home in [prefix, prefix / "lib" / "R", prefix / "lib64" / "R"]:
+            paths += [r_home / "library", r_home / "site-library"]
+        paths += [prefix / "local" / "lib" / "R" / "site-library"]
+
+    # the default user libraries, which install.packages may create
+    home = Path.home()
+    paths += [home / "R", *home.glob("R/*-library/*"), *home.glob("Library/R/*/*")]
+    local_app_data = os.environ.get("LOCALAPPDATA")
+    if local_app_data:
+        paths += [*Path(local_app_data).glob("R/win-library/*")]
+
+    return {str(path): _mtime(path) for path in paths}
+
+
+def _node_modules_mtimes(roots: Iterable[Any]) -> Dict[Text, Optional[int]]:
+    return {
+        str(Path(root, "node_modules")): _mtime(Path(root, "node_modules"))
+        for root in roots
+    }
+
+
+def fingerprint(entry_points: Iterable[Any], extra: Any = None) -> Text:
+    """hash what the language servers which can be found depend on
+
+    This is ``PATH``, and what is installed in it, the working directory, the
+    python environment (its prefix, and what is installed where it imports from),
+    the spec finder entry points, with the versions of the packages which provide
+    them, the R libraries, if R is among them, and the conf.d configuration
+    files. The ``node_modules`` used are checked separately, as finding them may
+    be slow.
+    """
+    entry_points = list(entry_points)
+    key = dict(
+        version=CACHE_VERSION,
+        path=_path_mtimes(),
+        prefix=sys.prefix,
+        executable=sys.executable,
+        cwd=os.getcwd(),
+        sys_path={path: _mtime(Path(path)) for path in sys.path if path},
+        entry_points=_entry_point_versions(entry_points),
+        conf_d=_conf_d_mtimes(),
+        r_libraries=(
+            _r_library_mtimes()
+            if any(ep.name == R_ENTRY_POINT for ep in entry_points)
+            else None
+        ),
+        extra=extra,
+    )
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def load(path: Path, key: Text) -> Optional[Dict[Text, Any]]:
+    """get the cached detection for a fingerprint, if its ``node_modules`` have
+    not changed since
+    """
+    try:
+        cached = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(cached, dict) or cached.get("key") != key:
+        return None
+
+    node_modules = cached.get("node_modules") or {}
+    if any(_mtime(Path(modules)) != mtime for modules, mtime in node_modules.items()):
+        return None
+
+    return cached
+
+
+def save(
+    path: Path,
+    key: Text,
+    node_roots: List[Any],
+    extra_node_roots: List[Any],
+    installed: Dict[Text, Any],
+    detected: Dict[Text, Any],
+) -> None:
+    """write a detection for a fingerprint, replacing any other
+
+    The ``node_roots`` are kept, as finding them may run ``npm``, and the
+    ``node_modules`` in them, and in ``extra_node_roots``, are checked on load.
+    """
+    node_roots = [str(root) for root in node_roots]
+    cached = dict(
+        key=key,
+        node_roots=node_roots,
+        node_modules=_node_modules_mtimes([*extra_node_roots, *node_roots]),
+        installed=installed,
+        detected=detected,
+    )
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(cached, f)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
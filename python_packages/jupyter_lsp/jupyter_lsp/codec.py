@@ -0,0 +1,121 @@
+""" encode and decode JSON-RPC messages, with the fastest library available
+"""
+
+import json
+import re
+from typing import Any, Dict, Optional, Text, Tuple, Type, Union
+
+Message = Union[Text, bytes]
+
+# the method of a JSON-RPC message, and where its params, result or error begin
+METHOD_PEEK = re.compile(r'"method"\s*:\s*"([^"\\]*)"')
+BODY_PEEK = re.compile(r'"(?:params|result|error)"\s*:')
+ID_PEEK = re.compile(r'"id"\s*:\s*(\d+)')
+METHOD_PEEK_BYTES = re.compile(METHOD_PEEK.pattern.encode())
+BODY_PEEK_BYTES = re.compile(BODY_PEEK.pattern.encode())
+ID_PEEK_BYTES = re.compile(ID_PEEK.pattern.encode())
+
+
+class JsonCodec:
+    """The standard library ``json``, which is always available"""
+
+    name = "json"
+
+    def loads(self, data: Union[Message, bytearray, memoryview]) -> Any:
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+
+class OrjsonCodec(JsonCodec):
+    """``orjson``, if installed"""
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.loads = orjson.loads  # type: ignore[method-assign]
+        self.dumps = orjson.dumps  # type: ignore[method-assign]
+
+
+class MsgspecCodec(JsonCodec):
+    """``msgspec``, if installed"""
+
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self._decode = msgspec.json.decode
+        self._decode_error = msgspec.DecodeError
+        self.dumps = msgspec.json.Encoder().encode  # type: ignore[method-assign]
+
+    def loads(self, data: Union[Message, bytearray, memoryview]) -> Any:
+        try:
+            return self._decode(data)
+        except self._decode_error as err:
+            # as raised by the other codecs
+            raise ValueError(str(err)) from err
+
+
+#: the codecs, in order of preference
+CODECS: Dict[Text, Type[JsonCodec]] = {
+    codec.name: codec for codec in [OrjsonCodec, MsgspecCodec, JsonCodec]
+}
+
+
+def get_codec(name: Text = "auto") -> JsonCodec:
+    """get a codec by name, or the most preferred which is installed for ``auto``
+
+    Raises ``ImportError`` if a named codec is not installed.
+    """
+    if name != "auto":
+        return CODECS[name]()
+
+    for codec_class in CODECS.values():
+        try:
+            return codec_class()
+        except ImportError:
+            continue
+
+    return JsonCodec()  # pragma: no cover
+
+
+def peek_method(message: Message) -> Tuple[bool, Optional[Text]]:
+    """find the method of a JSON-RPC message without parsing all of it
+
+    Returns whether the method could be found this way, and the method, which
+    is ``None`` for a response.
+    """
+    is_bytes = isinstance(message, bytes)
+    body = (BODY_PEEK_BYTES if is_bytes else BODY_PEEK).search(message)
+    head = message[: body.start()] if body else message
+    match = (METHOD_PEEK_BYTES if is_bytes else METHOD_PEEK).search(head)
+    if match is not None:
+        method = match.group(1)
+        return True, method.decode("utf-8") if is_bytes else method
+    if body is not None and (b'"method"' if is_bytes else '"method"') not in message:
+        return True, None
+    return False, None
+
+
+def peek_id(message: Message) -> Optional[Tuple[int, int, int]]:
+    """find where the integer id of a JSON-RPC message is, if it comes before
+    any params, result or error, without parsing all of it
+
+    Returns the start and end of the id, and the id.
+    """
+    is_bytes = isinstance(message, bytes)
+    body = (BODY_PEEK_BYTES if is_bytes else BODY_PEEK).search(message)
+    if body is None:
+        return None
+    match = (ID_PEEK_BYTES if is_bytes else ID_PEEK).search(message, 0, body.start())
+    if match is None:
+        return None
+    return match.start(1), match.end(1), int(match.group(1))
@@ -0,0 +1,155 @@
+""" backpressure between websocket clients and language servers
+"""
+
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from tornado.queues import Queue
+
+T = TypeVar("T")
+
+
+class FlowControl:
+    """Pause one side of a connection while the other side is above a high
+    watermark, and resume it once it has drained below a low watermark.
+
+    A ``high`` watermark of ``0`` disables flow control.
+    """
+
+    def __init__(
+        self,
+        high: int,
+        low: int,
+        on_pause: Optional[Callable[[], None]] = None,
+        on_resume: Optional[Callable[[], None]] = None,
+    ):
+        self.high = high
+        self.low = min(low, high)
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+        self.depth = 0
+        self.paused_seconds = 0.0
+        self._paused_at: Optional[float] = None
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+    @property
+    def paused(self) -> bool:
+        return self._paused_at is not None
+
+    def update(self, depth: int) -> None:
+        """record a new depth, pausing or resuming if a watermark was crossed"""
+        self.depth = depth
+
+        if self.high <= 0:
+            return
+
+        if not self.paused and depth >= self.high:
+            self._paused_at = time.monotonic()
+            self._resumed.clear()
+            if self.on_pause:
+                self.on_pause()
+        elif self.paused and depth <= self.low:
+            self.paused_seconds += time.monotonic() - self._paused_at
+            self._paused_at = None
+            self._resumed.set()
+            if self.on_resume:
+                self.on_resume()
+
+    async def wait(self) -> None:
+        """wait until not paused"""
+        await self._resumed.wait()
+
+    def to_json(self):
+        paused_seconds = self.paused_seconds
+        if self._paused_at is not None:
+            paused_seconds += time.monotonic() - self._paused_at
+        return dict(depth=self.depth, paused=self.paused, paused_seconds=paused_seconds)
+
+
+class FlowControlledQueue(Queue):
+    """A queue which reports its depth to a ``FlowControl`` as it changes"""
+
+    def __init__(self, flow: FlowControl, **kwargs):
+        super().__init__(**kwargs)
+        self.flow = flow
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        self.flow.update(self.qsize())
+
+    def get_nowait(self):
+        item = super().get_nowait()
+        self.flow.update(self.qsize())
+        return item
+
+
+class KeyedQueue:
+    """Run work for each key, e.g. the URI of a document, in the order it was
+    queued, while work for different keys runs concurrently.
+
+    How long each piece of work waited, from being queued until it started, is
+    recorded (the latest, most and mean wait, and the count) for the ``max_keys``
+    most recently used keys, forgetting the least recently used.
+    """
+
+    def __init__(self, max_keys: int = 256):
+        self.max_keys = max_keys
+        # key: done when the latest work queued for it is done
+        self._tails: Dict[Hashable, asyncio.Future] = {}
+        self._depth: Counter = Counter()
+        self._latency: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._tails
+
+    def __len__(self) -> int:
+        """the number of keys with work queued, or under way"""
+        return len(self._tails)
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        """run work once all the work queued before it for the same key is done"""
+        previous = self._tails.get(key)
+        current = self._tails[key] = asyncio.get_running_loop().create_future()
+        self._depth[key] += 1
+        queued_at = time.monotonic()
+
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            self._record(key, time.monotonic() - queued_at)
+            return await work()
+        finally:
+            current.set_result(None)
+            self._depth[key] -= 1
+            if self._depth[key] <= 0:
+                del self._depth[key]
+            if self._tails.get(key) is current:
+                del self._tails[key]
+
+    def _record(self, key: Hashable, seconds: float) -> None:
+        latency = self._latency.pop(key, None) or dict(
+            count=0, total_seconds=0.0, max_seconds=0.0
+        )
+        latency["count"] += 1
+        latency["total_seconds"] += seconds
+        latency["max_seconds"] = max(latency["max_seconds"], seconds)
+        latency["last_seconds"] = seconds
+        self._latency[key] = latency
+
+        while len(self._latency) > self.max_keys:
+            self._latency.popitem(last=False)
+
+    def to_json(self):
+        return {
+            str(key): dict(
+                depth=self._depth.get(key, 0),
+                count=latency["count"],
+                last_seconds=latency["last_seconds"],
+                mean_seconds=latency["total_seconds"] / latency["count"],
+                max_seconds=latency["max_seconds"],
+            )
+            for key, latency in self._latency.items()
+        }
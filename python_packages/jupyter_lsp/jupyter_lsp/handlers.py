@@ -23,9 +23,9 @@ try:
 except ImportError:
     from jupyter_server.base.zmqhandlers import WebSocketMixin
 
+from . import schema
 from .manager import LanguageServerManager
-from .schema import SERVERS_RESPONSE
-from .specs.utils import censored_spec
+from .specs.utils import censored_spec, with_config_schema
 
 AUTH_RESOURCE = "lsp"
 
@@ -85,7 +85,7 @@ class LanguageServerWebSocketHandler(  # type: ignore
             await res
 
     async def open(self, language_server):
-        await self.manager.ready()
+        await self.manager.ready(language_server)
         self.language_server = language_server
         self.manager.subscribe(self)
         self.log.debug("[{}] Opened a handler".format(self.language_server))
@@ -107,24 +107,35 @@ class LanguageServersHandler(BaseHandler):
     """
 
     auth_resource = AUTH_RESOURCE
-    validator = SERVERS_RESPONSE
+
+    @property
+    def validator(self):
+        return schema.SERVERS_RESPONSE
 
     @web.authenticated
     @authorized
     async def get(self):
-        """finish with the JSON representations of the sessions"""
-        await self.manager.ready()
+        """finish with the JSON representations of the sessions
+
+        With ``?partial=1``, finish at once, with the language servers detected
+        so far. The client configuration schemas shipped with known language
+        servers are only read when first asked for.
+        """
+        if self.get_argument("partial", "0") in ["0", "false"]:
+            await self.manager.ready()
 
         response = {
             "version": 2,
+            "ready": self.manager.is_ready,
             "sessions": {
                 language_server: session.to_json()
                 for language_server, session in self.manager.sessions.items()
             },
             "specs": {
-                key: censored_spec(spec)
+                key: with_config_schema(key, censored_spec(spec))
                 for key, spec in self.manager.all_language_servers.items()
             },
+            "shadow_queues": self.manager.shadow_queue.to_json(),
         }
 
         errors = list(self.validator.iter_errors(response))
@@ -3,9 +3,29 @@
 
 import asyncio
 import os
+import queue
+import subprocess
 import sys
+import threading
+import time
 import traceback
-from typing import Dict, Text, Tuple, cast
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from copy import deepcopy
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Text,
+    Tuple,
+    cast,
+)
 
 # See compatibility note on `group` keyword in
 # https://docs.python.org/3/library/importlib.metadata.html#entry-points
@@ -14,7 +34,7 @@ if sys.version_info < (3, 10):  # pragma: no cover
 else:  # pragma: no cover
     from importlib.metadata import entry_points
 
-from jupyter_core.paths import jupyter_config_path
+from jupyter_core.paths import jupyter_config_path, jupyter_data_dir
 from jupyter_server.services.config import ConfigManager
 
 try:
@@ -22,12 +42,17 @@ try:
 except ImportError:  # pragma: no cover
     from jupyter_server.transutils import _
 
+from tornado.ioloop import PeriodicCallback
 from traitlets import Bool
 from traitlets import Dict as Dict_
-from traitlets import Instance
+from traitlets import Enum, Float, Instance, Int
 from traitlets import List as List_
-from traitlets import Unicode, default
+from traitlets import Unicode
+from traitlets import Union as Union_
+from traitlets import default, observe
 
+from . import autodetect_cache, schema
+from .codec import CODECS, JsonCodec, get_codec
 from .constants import (
     APP_CONFIG_D_SECTIONS,
     EP_LISTENER_ALL_V1,
@@ -35,28 +60,67 @@ from .constants import (
     EP_LISTENER_SERVER_V1,
     EP_SPEC_V1,
 )
-from .schema import LANGUAGE_SERVER_SPEC_MAP
+from .flow_control import KeyedQueue
+from .routing import DID_CLOSE
 from .session import LanguageServerSession
 from .trait_types import LoadableCallable, Schema
 from .types import (
     KeyedLanguageServerSpecs,
     LanguageServerManagerAPI,
     MessageScope,
+    PrewarmStatus,
+    SessionStatus,
     SpecBase,
     SpecMaker,
 )
 
+#: called with the specs of a spec finder, as it finishes, and if they are installed
+DetectedCallback = Callable[[KeyedLanguageServerSpecs, bool], None]
+
+
+def _run_on_daemon_threads(
+    calls: List[Tuple[Any, ...]], workers: int, name: Text
+) -> List[Future]:
+    """run each of some ``(function, *args)`` on up to ``workers`` threads, which,
+    unlike those of a ``ThreadPoolExecutor``, are not waited for at exit, in case
+    one never returns
+    """
+    todo: "queue.SimpleQueue[Tuple[Future, Any, Tuple[Any, ...]]]" = queue.SimpleQueue()
+    futures: List[Future] = []
+    for function, *args in calls:
+        future: Future = Future()
+        todo.put((future, function, tuple(args)))
+        futures.append(future)
+
+    def work():
+        while True:
+            try:
+                future, function, args = todo.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():  # pragma: no cover
+                continue
+            try:
+                future.set_result(function(*args))
+            except BaseException as err:  # pragma: no cover
+                future.set_exception(err)
+
+    for i in range(min(workers, len(futures))):
+        threading.Thread(target=work, name=f"{name}_{i}", daemon=True).start()
+
+    return futures
+
 
 class LanguageServerManager(LanguageServerManagerAPI):
     """Manage language servers"""
 
     conf_d_language_servers = Schema(  # type:ignore[assignment]
-        validator=LANGUAGE_SERVER_SPEC_MAP,
+        validator="LANGUAGE_SERVER_SPEC_MAP",
         help=_("extra language server specs, keyed by implementation, from conf.d"),
     )  # type: KeyedLanguageServerSpecs
 
     language_servers = Schema(  # type:ignore[assignment]
-        validator=LANGUAGE_SERVER_SPEC_MAP,
+        validator="LANGUAGE_SERVER_SPEC_MAP",
         help=_("a dict of language server specs, keyed by implementation"),
     ).tag(
         config=True
@@ -66,6 +130,30 @@ class LanguageServerManager(LanguageServerManagerAPI):
         True, help=_("try to find known language servers in sys.prefix (and elsewhere)")
     ).tag(config=True)
 
+    autodetect_workers = Int(
+        8, help=_("threads on which known language servers are detected")
+    ).tag(config=True)
+
+    autodetect_timeout = Float(
+        2,
+        help=_(
+            "seconds after which detection of a known language server is given up,"
+            " and it is skipped"
+        ),
+    ).tag(config=True)
+
+    autodetect_cache: bool = Bool(  # type:ignore[assignment]
+        True,
+        help=_(
+            "reuse the language servers found by the last autodetection, unless"
+            " the environment they were found in has changed"
+        ),
+    ).tag(config=True)
+
+    autodetect_cache_path = Unicode(
+        help=_("the file in which autodetected language servers are kept")
+    ).tag(config=True)
+
     sessions: Dict[Tuple[Text], LanguageServerSession] = (
         Dict_(  # type:ignore[assignment]
             trait=Instance(LanguageServerSession),
@@ -83,6 +171,157 @@ class LanguageServerManager(LanguageServerManagerAPI):
         """
     ).tag(config=True)
 
+    shadow_backend = Enum(
+        ["disk", "tmpfs"],
+        default_value="disk",
+        help=_(
+            "where the shadow files of virtual documents are kept, for all language"
+            " servers which read them: `disk`, in `virtual_documents_dir`, or"
+            " `tmpfs`, in a directory in `/dev/shm` which `virtual_documents_dir`"
+            " links to, so that un-saved changes are not written to a (maybe"
+            " networked) disk"
+        ),
+    ).tag(config=True)
+
+    shadow_cache_documents = Int(
+        256,
+        help=_(
+            "the most virtual documents whose text is kept in memory, to apply"
+            " changes without reading their shadow files (0 for no limit)"
+        ),
+    ).tag(config=True)
+
+    shadow_cache_bytes = Int(
+        64 * 1024 * 1024,
+        help=_(
+            "the most characters of virtual documents kept in memory, beyond which"
+            " the least recently changed are forgotten (0 for no limit)"
+        ),
+    ).tag(config=True)
+
+    shadow_write_delay = Float(
+        0.1,
+        help=_(
+            "seconds for which changes to a virtual document are gathered, before"
+            " its shadow file is written, unless a request needs it sooner"
+            " (0 to write after every change)"
+        ),
+    ).tag(config=True)
+
+    shadow_workers = Int(
+        4,
+        help=_(
+            "threads which read, and write, shadow files: the changes to each are"
+            " still written in order"
+        ),
+    ).tag(config=True)
+
+    shadow_max_files = Int(
+        1000,
+        help=_(
+            "the most shadow files to keep, beyond which those of the least recently"
+            " closed documents are removed (0 for no limit)"
+        ),
+    ).tag(config=True)
+
+    shadow_max_disk_bytes = Int(
+        256 * 1024 * 1024,
+        help=_(
+            "the most bytes of shadow files to keep, beyond which those of the least"
+            " recently closed documents are removed (0 for no limit)"
+        ),
+    ).tag(config=True)
+
+    shadow_sweep_interval = Float(
+        300,
+        help=_(
+            "seconds between checks of the shadow files against `shadow_max_files`"
+            " and `shadow_max_disk_bytes`, as well as after each document is closed"
+            " (0 to only check then)"
+        ),
+    ).tag(config=True)
+
+    shadow_queue = Instance(
+        KeyedQueue,
+        help=_("updates of each shadow file, in order, and how long they waited"),
+    )
+
+    prewarm = Union_(
+        [Enum(["all"]), List_(trait=Unicode())],
+        default_value=[],
+        help=_(
+            "language servers to start, and initialize, as soon as the extension"
+            " has loaded, rather than when the first client connects: a list of"
+            " keys, or `all` installed language servers"
+        ),
+    ).tag(config=True)
+
+    prewarm_initialize_params = Dict_(
+        default_value={
+            "capabilities": {
+                "workspace": {"didChangeConfiguration": {}},
+                "textDocument": {},
+            },
+            "initializationOptions": None,
+            "processId": None,
+            "workspaceFolders": None,
+        },
+        help=_(
+            "the params of the initialize request sent to prewarmed language"
+            " servers, e.g. client capabilities; `rootUri` defaults to the"
+            " contents root. The first client to connect is answered with the"
+            " result, whatever its capabilities, which are used if the language"
+            " server is started again, but if it has another `rootUri`,"
+            " `workspaceFolders` or `initializationOptions`, the language server"
+            " is restarted for it"
+        ),
+    ).tag(config=True)
+
+    idle_timeout = Float(
+        0,
+        help=_(
+            "seconds without any messages after which a language server is"
+            " suspended or stopped, according to `idle_action` (0 to disable)"
+        ),
+    ).tag(config=True)
+
+    idle_action = Enum(
+        ["stop", "suspend"],
+        default_value="stop",
+        help=_(
+            "what to do with an idle language server: `stop` frees its memory,"
+            " while `suspend` pauses the process, where supported. Either way, it"
+            " is restarted, or resumed, on the next message"
+        ),
+    ).tag(config=True)
+
+    memory_budget = Int(
+        0,
+        help=_(
+            "bytes of resident memory all language servers may use, beyond which"
+            " the least recently used are stopped, until their next message"
+            " (0 to disable)"
+        ),
+    ).tag(config=True)
+
+    reap_interval = Float(
+        60,
+        help=_("seconds between checks for idle sessions, and of the memory budget"),
+    ).tag(config=True)
+
+    _reaper = Instance(PeriodicCallback, allow_none=True)
+
+    json_codec = Enum(
+        ["auto", *CODECS],
+        default_value="auto",
+        help=_(
+            "the library with which to parse, and write, messages: `auto` picks the"
+            " fastest installed of `orjson`, `msgspec` and the standard `json`"
+        ),
+    ).tag(config=True)
+
+    codec = Instance(JsonCodec, help=_("parses, and writes, messages"))
+
     _ready = Bool(
         help="""Whether the manager has been initialized""", default_value=False
     )
@@ -101,6 +340,30 @@ class LanguageServerManager(LanguageServerManagerAPI):
     def _default_language_servers(self):
         return {}
 
+    @default("shadow_queue")
+    def _default_shadow_queue(self):
+        return KeyedQueue(max_keys=self.shadow_cache_documents or 256)
+
+    @default("codec")
+    def _default_codec(self):
+        try:
+            return get_codec(self.json_codec)
+        except ImportError as err:
+            self.log.warning(
+                _("[lsp] json_codec %s is not available, using json: %s"),
+                self.json_codec,
+                err,
+            )
+            return JsonCodec()
+
+    @observe("json_codec")
+    def _on_json_codec(self, change):
+        self.codec = self._default_codec()
+
+    @default("autodetect_cache_path")
+    def _default_autodetect_cache_path(self):
+        return os.path.join(jupyter_data_dir(), "lsp", "autodetect_cache.json")
+
     @default("virtual_documents_dir")
     def _default_virtual_documents_dir(self):
         return os.getenv("JP_LSP_VIRTUAL_DIR", None) or ".virtual_documents"
@@ -124,39 +387,139 @@ class LanguageServerManager(LanguageServerManagerAPI):
         """Before starting, perform all necessary configuration"""
         self.all_language_servers: KeyedLanguageServerSpecs = {}
         self._language_servers_from_config: KeyedLanguageServerSpecs = {}
+        # language servers whose spec is resolved, and the events of their waiters
+        self._ready_servers: Set[Text] = set()
+        self._ready_events: Dict[Optional[Text], asyncio.Event] = {}
+        self._ready_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready_lock = threading.Lock()
+        # whether a language server needs some setup, and the setup, which it
+        # then waits for once its spec is resolved, and the setup once started
+        self._ready_holds: List[
+            Tuple[Callable[[Text], bool], Callable[[], Awaitable[Any]]]
+        ] = []
+        self._ready_after: Dict[int, asyncio.Future] = {}
         super().__init__(**kwargs)
 
     def initialize(self, *args, **kwargs):
-        self.init_language_servers()
         self.init_listeners()
+        self.init_language_servers()
         self.init_sessions()
-        self._ready = True
+        self._set_ready()
+
+    @property
+    def is_ready(self) -> bool:
+        """whether every language server has been detected, and set up"""
+        return bool(self._ready) and all(
+            hold in self._ready_after and self._ready_after[hold].done()
+            for hold in self._held(self.language_servers)
+        )
 
-    async def ready(self):
-        while not self._ready:  # pragma: no cover
-            await asyncio.sleep(0.1)
+    def hold_ready(
+        self, setup: Callable[[], Awaitable[Any]], needs: Callable[[Text], bool]
+    ) -> None:
+        """keep the language servers which ``need`` some setup from being ready
+        until it is done, e.g. those which read documents from disk, until the
+        shadow filesystem exists: it is started when first waited for
+        """
+        self._ready_holds.append((needs, setup))
+
+    def _held(self, language_servers: Iterable[Text]) -> List[int]:
+        """the setup which any of some language servers need"""
+        language_servers = list(language_servers)
+        return [
+            hold
+            for hold, (needs, setup) in enumerate(self._ready_holds)
+            if any(needs(language_server) for language_server in language_servers)
+        ]
+
+    async def ready(self, language_server: Optional[Text] = None) -> bool:
+        """wait until the spec of a language server is resolved or, without one
+        (or if it is never found), until every language server has been detected,
+        then for the setup they need
+        """
+        with self._ready_lock:
+            event = None
+            if not (self._ready or language_server in self._ready_servers):
+                self._ready_loop = asyncio.get_running_loop()
+                event = self._ready_events.get(language_server)
+                if event is None:
+                    event = self._ready_events[language_server] = asyncio.Event()
+        if event is not None:
+            await event.wait()
+
+        if language_server in self._ready_servers:
+            held = self._held([language_server])
+        else:
+            held = self._held(self.language_servers)
+        for hold in held:
+            setting_up = self._ready_after.get(hold)
+            if setting_up is None:
+                setup = self._ready_holds[hold][1]
+                setting_up = self._ready_after[hold] = asyncio.ensure_future(setup())
+            await asyncio.shield(setting_up)
         return True
 
+    def _set_ready(self, language_server: Optional[Text] = None) -> None:
+        """wake whoever waits for a language server, or, without one, everybody
+
+        This is called from the thread which initializes the manager.
+        """
+        with self._ready_lock:
+            if language_server is None:
+                self._ready = True
+                events = list(self._ready_events.values())
+                self._ready_events.clear()
+            else:
+                self._ready_servers.add(language_server)
+                event = self._ready_events.pop(language_server, None)
+                events = [] if event is None else [event]
+            loop = self._ready_loop
+
+        for event in events:
+            assert loop is not None
+            loop.call_soon_threadsafe(event.set)
+
     def init_language_servers(self) -> None:
         """determine the final language server configuration."""
         # copy the language servers before anybody monkeys with them
         self._language_servers_from_config = dict(self.language_servers)
-        self.language_servers = self._collect_language_servers(only_installed=True)
-        self.all_language_servers = self._collect_language_servers(only_installed=False)
+
+        # configured language servers need no detection
+        configured = self._collect_language_servers({})
+        self.all_language_servers = dict(configured)
+        self._add_sessions(configured)
+
+        installed, detected = (
+            self._cached_autodetect_language_servers(self._on_language_servers_detected)
+            if self.autodetect
+            else ({}, {})
+        )
+        self.language_servers = self._collect_language_servers(installed)
+        self.all_language_servers = self._collect_language_servers(detected)
+
+    def _on_language_servers_detected(
+        self, specs: KeyedLanguageServerSpecs, is_installed: bool
+    ) -> None:
+        """make the language servers of one spec finder available, before the
+        others have finished, unless they are configured
+        """
+        configured = {
+            **self._language_servers_from_config,
+            **self.conf_d_language_servers,
+        }
+        specs = {key: spec for key, spec in specs.items() if key not in configured}
+        self.all_language_servers = {**specs, **self.all_language_servers}
+        if is_installed:
+            self._add_sessions(specs)
 
     def _collect_language_servers(
-        self, only_installed: bool
+        self, detected: KeyedLanguageServerSpecs
     ) -> KeyedLanguageServerSpecs:
-        language_servers: KeyedLanguageServerSpecs = {}
+        language_servers: KeyedLanguageServerSpecs = dict(detected)
 
         language_servers_from_config = dict(self._language_servers_from_config)
         language_servers_from_config.update(self.conf_d_language_servers)
 
-        if self.autodetect:
-            language_servers.update(
-                self._autodetect_language_servers(only_installed=only_installed)
-            )
-
         # restore config
         language_servers.update(language_servers_from_config)
 
@@ -164,13 +527,39 @@ class LanguageServerManager(LanguageServerManagerAPI):
         return {key: spec for key, spec in language_servers.items() if spec.get("argv")}
 
     def init_sessions(self):
-        """create, but do not initialize all sessions"""
+        """create, but do not initialize all sessions, keeping those which were
+        made as their language servers were detected
+        """
         sessions = {}
         for language_server, spec in self.language_servers.items():
-            sessions[language_server] = LanguageServerSession(
+            session = self.sessions.get(language_server)
+            if session is None:
+                session = LanguageServerSession(
+                    language_server=language_server, spec=spec, parent=self
+                )
+            elif session.spec != spec:
+                # overridden by a spec finder which finished later
+                session.spec = spec
+            sessions[language_server] = session
+        self.sessions = sessions
+
+    def _add_sessions(self, specs: KeyedLanguageServerSpecs) -> None:
+        """create sessions for newly resolved language servers, and wake anybody
+        waiting for them
+        """
+        new_sessions = {
+            language_server: LanguageServerSession(
                 language_server=language_server, spec=spec, parent=self
             )
-        self.sessions = sessions
+            for language_server, spec in specs.items()
+            if spec.get("argv") and language_server not in self.sessions
+        }
+        if not new_sessions:
+            return
+        # replaced, rather than changed, as handlers may be reading it
+        self.sessions = {**self.sessions, **new_sessions}
+        for language_server in new_sessions:
+            self._set_ready(language_server)
 
     def init_listeners(self):
         """register traitlets-configured listeners"""
@@ -192,6 +581,102 @@ class LanguageServerManager(LanguageServerManagerAPI):
             for listener in listeners:
                 self.__class__.register_message_listener(scope=scope.value)(listener)
 
+    async def prewarm_sessions(self, root_uri: Optional[Text] = None):
+        """start and initialize the language servers configured for prewarming"""
+        keys = list(self.sessions) if self.prewarm == "all" else self.prewarm
+        sessions = []
+
+        for key in keys:
+            session = self.sessions.get(key)
+            if session is None:
+                self.log.warning("[lsp] cannot prewarm unknown language server %s", key)
+                continue
+            session.prewarm_status = PrewarmStatus.PENDING
+            sessions.append(session)
+
+        if not sessions:
+            return
+
+        params = dict(self.prewarm_initialize_params)
+        if root_uri:
+            params.setdefault("rootUri", root_uri)
+
+        await asyncio.gather(
+            *[session.prewarm(deepcopy(params)) for session in sessions]
+        )
+
+    def start_reaper(self):
+        """periodically stop idle sessions, and those over the memory budget"""
+        if self._reaper is not None:
+            return
+        if self.idle_timeout <= 0 and self.memory_budget <= 0:
+            return
+        self._reaper = PeriodicCallback(self.reap, self.reap_interval * 1000)
+        self._reaper.start()
+
+    def reap(self):
+        """suspend or stop idle sessions, then evict the least recently used
+        sessions until the memory budget is met
+        """
+        if self.idle_timeout > 0:
+            now = datetime.now(timezone.utc)
+            for key, session in self.sessions.items():
+                last_activity_at = session.last_activity_at
+                if session.status != SessionStatus.STARTED or last_activity_at is None:
+                    continue
+                idle = (now - last_activity_at).total_seconds()
+                if idle < self.idle_timeout:
+                    continue
+                self.log.info("[lsp] %s idle for %ds: %s", key, idle, self.idle_action)
+                if self.idle_action == "suspend" and session.can_suspend:
+                    session.suspend()
+                else:
+                    session.evict()
+
+        if self.memory_budget > 0:
+            self._enforce_memory_budget()
+
+    def _enforce_memory_budget(self):
+        usage = {}
+        for key, session in self.sessions.items():
+            if session.status not in [SessionStatus.STARTED, SessionStatus.SUSPENDED]:
+                continue
+            rss = session.rss()
+            if rss is not None:
+                usage[key] = rss
+
+        total = sum(usage.values())
+        if total <= self.memory_budget:
+            return
+
+        oldest = datetime.min.replace(tzinfo=timezone.utc)
+        by_last_activity = sorted(
+            usage, key=lambda key: self.sessions[key].last_activity_at or oldest
+        )
+
+        # the most recently used session is kept, even if over budget on its own
+        for key in by_last_activity[:-1]:
+            if total <= self.memory_budget:
+                break
+            self.log.info(
+                "[lsp] %s using %d bytes, %d over the memory budget: stopping",
+                key,
+                usage[key],
+                total - self.memory_budget,
+            )
+            self.sessions[key].evict()
+            total -= usage[key]
+
+    async def shutdown(self):
+        """shut down all running language servers, concurrently"""
+        await asyncio.gather(
+            *[
+                session.shutdown_soon()
+                for session in self.sessions.values()
+                if session.process
+            ]
+        )
+
     def subscribe(self, handler):
         """subscribe a handler to session, or sta"""
         session = self.sessions.get(handler.language_server)
@@ -207,7 +692,7 @@ class LanguageServerManager(LanguageServerManagerAPI):
         session.handlers = set([handler]) | session.handlers
 
     async def on_client_message(self, message, handler):
-        await self.wait_for_listeners(
+        parsed = await self.wait_for_listeners(
             MessageScope.CLIENT, message, handler.language_server
         )
         session = self.sessions.get(handler.language_server)
@@ -220,20 +705,39 @@ class LanguageServerManager(LanguageServerManagerAPI):
             )
             return
 
+        # a suspended or evicted language server must be running again before the
+        # message is routed, as restarting it starts a new handshake
+        await session.ensure_started()
+
+        if session.router.prewarmed:
+            if parsed is None:
+                try:
+                    parsed = self.codec.loads(message)
+                except ValueError:
+                    pass
+            if session.router.prewarmed_for_others(parsed):
+                session.unprewarm()
+
+        message = session.router.from_client(handler, message, parsed)
+
+        if message is None:
+            return
+
         session.write(message)
+        # wait for the language server to catch up, before reading more from the client
+        await session.writable()
 
     async def on_server_message(self, message, session):
-        language_servers = [
-            ls_key for ls_key, sess in self.sessions.items() if sess == session
-        ]
+        parsed = await self.wait_for_listeners(
+            MessageScope.SERVER, message, session.language_server
+        )
 
-        for language_servers in language_servers:
-            await self.wait_for_listeners(
-                MessageScope.SERVER, message, language_servers
-            )
+        handlers, message = session.router.from_server(
+            message, session.handlers, parsed
+        )
 
-        for handler in session.handlers:
-            handler.write_message(message)
+        for handler in handlers:
+            session.write_to_handler(handler, message)
 
     def unsubscribe(self, handler):
         session = self.sessions.get(handler.language_server)
@@ -247,60 +751,183 @@ class LanguageServerManager(LanguageServerManagerAPI):
             return
 
         session.handlers = [h for h in session.handlers if h != handler]
+        left_open = session.router.remove_handler(handler)
+
+        # as if the websocket had closed them, e.g. for the shadow filesystem
+        for uri in left_open:
+            message = {
+                "jsonrpc": "2.0",
+                "method": DID_CLOSE,
+                "params": {"textDocument": {"uri": uri}},
+            }
+            self._start_concurrent_listeners(
+                [
+                    self.wait_for_listeners(
+                        MessageScope.CLIENT,
+                        self.codec.dumps(message),
+                        handler.language_server,
+                        message,
+                    )
+                ]
+            )
 
-    def _autodetect_language_servers(self, only_installed: bool):
-        _entry_points = None
+    def _cached_autodetect_language_servers(
+        self, on_detected: Optional[DetectedCallback] = None
+    ) -> Tuple[KeyedLanguageServerSpecs, KeyedLanguageServerSpecs]:
+        """reuse the last autodetection, if nothing it depends on has changed, or
+        autodetect language servers, and keep them for next time
+        """
+        if not self.autodetect_cache:
+            return self._autodetect_language_servers(on_detected)
 
         try:
-            _entry_points = entry_points(group=EP_SPEC_V1)
+            key = autodetect_cache.fingerprint(
+                entry_points(group=EP_SPEC_V1), self._autodetect_config()
+            )
         except Exception:  # pragma: no cover
-            self.log.exception("Failed to load entry_points")
+            self.log.exception(_("[lsp] Failed to fingerprint the environment"))
+            return self._autodetect_language_servers(on_detected)
 
-        skipped_servers = []
+        path = Path(self.autodetect_cache_path)
+        cached = autodetect_cache.load(path, key)
 
-        for ep in _entry_points or []:
-            try:
-                spec_finder: SpecMaker = ep.load()
-            except Exception as err:  # pragma: no cover
-                self.log.warning(
-                    _("Failed to load language server spec finder `{}`: \n{}").format(
-                        ep.name, err
-                    )
-                )
-                continue
+        if cached is not None:
+            self.log.debug(_("[lsp] reusing autodetected servers from %s"), path)
+            if not self.trait_has_value("node_roots"):
+                self.node_roots = cached["node_roots"]
+            return cached["installed"], cached["detected"]
+
+        self._autodetect_timed_out = {}
+        installed, detected = self._autodetect_language_servers(on_detected)
 
+        # a slow spec finder may yet be found next time
+        if not self._autodetect_timed_out:
             try:
-                if only_installed:
-                    if hasattr(spec_finder, "is_installed"):
-                        spec_finder_from_base = cast(SpecBase, spec_finder)
-                        if not spec_finder_from_base.is_installed(self):
-                            skipped_servers.append(ep.name)
-                            continue
-                specs = spec_finder(self) or {}
-            except Exception as err:  # pragma: no cover
+                autodetect_cache.save(
+                    path,
+                    key,
+                    self.node_roots,
+                    self.extra_node_roots,
+                    installed,
+                    detected,
+                )
+            except Exception as err:
                 self.log.warning(
-                    _(
-                        "Failed to fetch commands from language server spec finder"
-                        " `{}`:\n{}"
-                    ).format(ep.name, err)
+                    _("[lsp] Failed to keep autodetected servers in %s: %s"),
+                    path,
+                    err,
                 )
-                traceback.print_exc()
 
-                continue
+        return installed, detected
 
-            errors = list(LANGUAGE_SERVER_SPEC_MAP.iter_errors(specs))
+    def _autodetect_config(self) -> Dict[Text, Any]:
+        """the configuration which spec finders may use"""
+        config: Dict[Text, Any] = dict(
+            extra_node_roots=[str(root) for root in self.extra_node_roots]
+        )
+        for name in ["nodejs", "node_roots"]:
+            if self.trait_has_value(name):
+                config[name] = getattr(self, name)
+        return config
+
+    def _autodetect_language_servers(
+        self, on_detected: Optional[DetectedCallback] = None
+    ) -> Tuple[KeyedLanguageServerSpecs, KeyedLanguageServerSpecs]:
+        """find the specs of those language servers which are installed, and of all
+        of them, at once, running the spec finders concurrently
+
+        A spec finder which takes longer than ``autodetect_timeout`` is skipped.
+        ``on_detected`` is called with the specs of each spec finder as it
+        finishes, and whether they are installed.
+        """
+        _entry_points = None
 
-            if errors:  # pragma: no cover
-                self.log.warning(
-                    _(
-                        "Failed to validate commands from language server spec finder"
-                        " `{}`:\n{}"
-                    ).format(ep.name, errors)
-                )
-                continue
+        try:
+            _entry_points = list(entry_points(group=EP_SPEC_V1))
+        except Exception:  # pragma: no cover
+            self.log.exception("Failed to load entry_points")
+
+        installed: KeyedLanguageServerSpecs = {}
+        detected: KeyedLanguageServerSpecs = {}
+
+        if not _entry_points:  # pragma: no cover
+            return installed, detected
+
+        # shared by many spec finders, so found once, before they run at once
+        self._find_node()
+
+        # entry point name: when its spec finder started
+        started: Dict[str, float] = {}
+        futures = {
+            future: ep.name
+            for future, ep in zip(
+                _run_on_daemon_threads(
+                    [
+                        (self._detect_language_server, ep, started)
+                        for ep in _entry_points
+                    ],
+                    workers=self.autodetect_workers,
+                    name="jupyter_lsp_detect",
+                ),
+                _entry_points,
+            )
+        }
+        # entry point name: the seconds after which it was given up
+        timed_out: Dict[str, float] = {}
+
+        pending = set(futures)
+        while pending:
+            deadlines = [
+                started[futures[future]] + self.autodetect_timeout
+                for future in pending
+                if futures[future] in started
+            ]
+            timeout = (
+                max(0, min(deadlines) - time.monotonic())
+                if deadlines
+                else self.autodetect_timeout
+            )
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is not None:
+                    # e.g. a command checking if it is installed, which timed out
+                    timed_out[futures[future]] = getattr(
+                        error, "timeout", self.autodetect_timeout
+                    )
+                elif on_detected is not None and future.result() is not None:
+                    on_detected(*future.result())
+            now = time.monotonic()
+            for future in list(pending):
+                name = futures[future]
+                if name in started and now - started[name] >= self.autodetect_timeout:
+                    # left to finish on its own, without holding up exit
+                    pending.discard(future)
+                    timed_out[name] = self.autodetect_timeout
+
+        self._autodetect_timed_out = timed_out
+
+        for name, seconds in timed_out.items():
+            self.log.warning(
+                _(
+                    "Skipped language server `{}`, not detected within {}s, until the"
+                    " next start: it may be found then, or with a longer"
+                    " `LanguageServerManager.autodetect_timeout`"
+                ).format(name, seconds)
+            )
 
-            for key, spec in specs.items():
-                yield key, spec
+        skipped_servers = []
+
+        # in the order of the entry points, as later ones may override earlier ones
+        for future, name in futures.items():
+            if name in timed_out or future.result() is None:
+                continue
+            specs, is_installed = future.result()
+            detected.update(specs)
+            if is_installed:
+                installed.update(specs)
+            else:
+                skipped_servers.append(name)
 
         if skipped_servers:
             self.log.info(
@@ -309,6 +936,69 @@ class LanguageServerManager(LanguageServerManagerAPI):
                 )
             )
 
+        return installed, detected
+
+    def _find_node(self) -> None:
+        """find ``nodejs`` and ``node_roots``, unless configured: reading each
+        trait for the first time computes its default, which may run ``npm``
+        """
+        for name in ["nodejs", "node_roots"]:
+            getattr(self, name)
+
+    def _detect_language_server(
+        self, ep, started: Dict[str, float]
+    ) -> Optional[Tuple[KeyedLanguageServerSpecs, bool]]:
+        """get the specs of one spec finder, and whether it is installed"""
+        started[ep.name] = time.monotonic()
+
+        try:
+            spec_finder: SpecMaker = ep.load()
+        except Exception as err:  # pragma: no cover
+            self.log.warning(
+                _("Failed to load language server spec finder `{}`: \n{}").format(
+                    ep.name, err
+                )
+            )
+            return None
+
+        try:
+            is_installed = True
+            if hasattr(spec_finder, "is_installed"):
+                spec_finder_from_base = cast(SpecBase, spec_finder)
+                is_installed = spec_finder_from_base.is_installed(self)
+            specs = spec_finder(self) or {}
+        except subprocess.TimeoutExpired:
+            raise
+        except Exception as err:  # pragma: no cover
+            self.log.warning(
+                _(
+                    "Failed to fetch commands from language server spec finder"
+                    " `{}`:\n{}"
+                ).format(ep.name, err)
+            )
+            traceback.print_exc()
+
+            return None
+        finally:
+            self.log.debug(
+                _("[lsp] detected `{}` in {:.3f}s").format(
+                    ep.name, time.monotonic() - started[ep.name]
+                )
+            )
+
+        errors = list(schema.LANGUAGE_SERVER_SPEC_MAP.iter_errors(specs))
+
+        if errors:  # pragma: no cover
+            self.log.warning(
+                _(
+                    "Failed to validate commands from language server spec finder"
+                    " `{}`:\n{}"
+                ).format(ep.name, errors)
+            )
+            return None
+
+        return specs, is_installed
+
 
 # the listener decorator
 lsp_message_listener = LanguageServerManager.register_message_listener  # noqa
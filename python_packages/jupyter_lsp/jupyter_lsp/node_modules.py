@@ -0,0 +1,108 @@
+""" an index of the packages in node_modules, shared by every spec which looks
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Set, Text
+
+#: a directory changed as recently as this (in nanoseconds) before it was scanned
+#: may change again within the resolution of its modification time, unnoticed
+RACY_NS = 2_000_000_000
+
+
+def _mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _package(path_frag: Iterable[Text]) -> Text:
+    """the name of the package a path in node_modules is in, e.g. ``@scope/name``"""
+    parts = "/".join(path_frag).replace("\\", "/").split("/")
+    return "/".join(parts[:2]) if parts[0].startswith("@") else parts[0]
+
+
+class _Entry:
+    """the packages in one node_modules, and the modification times of it, and
+    of its scopes, when they were listed
+    """
+
+    __slots__ = ("packages", "mtimes", "racy", "checked")
+
+    def __init__(self, node_modules: Path):
+        packages: Set[Text] = set()
+        self.mtimes: Dict[Text, Optional[int]] = {"": _mtime(node_modules)}
+
+        try:
+            with os.scandir(node_modules) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if not entry.name.startswith("@"):
+                        packages.add(entry.name)
+                        continue
+                    scope = Path(entry.path)
+                    self.mtimes[entry.name] = _mtime(scope)
+                    with os.scandir(scope) as scoped:
+                        packages.update(f"{entry.name}/{s.name}" for s in scoped)
+        except OSError:
+            pass
+
+        self.packages: FrozenSet[Text] = frozenset(packages)
+        recent = time.time_ns() - RACY_NS
+        self.racy = any(m is not None and m > recent for m in self.mtimes.values())
+        self.checked = time.monotonic()
+
+    def changed(self, node_modules: Path) -> bool:
+        return self.racy or any(
+            _mtime(node_modules / name if name else node_modules) != mtime
+            for name, mtime in self.mtimes.items()
+        )
+
+
+class NodeModulesIndex:
+    """The packages in the ``node_modules`` of each root, listed once, with
+    ``os.scandir``, rather than looking for every spec's script in every root.
+
+    A root is listed again when its ``node_modules``, or one of its scopes, has
+    changed, which is checked at most every ``max_age`` seconds, so that the
+    specs which are found at once share one listing.
+    """
+
+    def __init__(self, max_age: float = 1.0):
+        self.max_age = max_age
+        self._entries: Dict[Text, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def packages(self, root: Any) -> FrozenSet[Text]:
+        """the names of the packages in the ``node_modules`` of a root"""
+        node_modules = Path(root, "node_modules")
+        key = str(node_modules)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.checked < self.max_age:
+                return entry.packages
+            if entry is None or entry.changed(node_modules):
+                entry = self._entries[key] = _Entry(node_modules)
+            else:
+                entry.checked = time.monotonic()
+            return entry.packages
+
+    def find(self, roots: Iterable[Any], *path_frag: Text) -> Optional[Text]:
+        """the first of the roots with a path in its ``node_modules``, in a
+        package which was there when it was last listed
+        """
+        package = _package(path_frag)
+
+        for root in roots:
+            if package not in self.packages(root):
+                continue
+            candidate = Path(root, "node_modules", *path_frag)
+            if candidate.exists():
+                return str(candidate)
+
+        return None
@@ -0,0 +1,53 @@
+""" wait for language server processes without blocking the event loop
+"""
+
+import asyncio
+import os
+import subprocess
+from typing import Optional
+
+
+def pidfd_open(pid: int) -> Optional[int]:
+    """get a file descriptor which becomes readable when a process exits, where
+    supported (linux 5.3+)
+    """
+    if not hasattr(os, "pidfd_open"):  # pragma: no cover
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:  # pragma: no cover
+        return None
+
+
+async def wait_for_exit(process: subprocess.Popen) -> int:
+    """wait for a process to exit, and reap it, returning its exit code
+
+    On linux, this waits for the process' pidfd to become readable on the event
+    loop, like ``asyncio.PidfdChildWatcher``. Elsewhere, a thread waits instead.
+    """
+    if process.poll() is not None:
+        return process.returncode
+
+    loop = asyncio.get_running_loop()
+    pidfd = pidfd_open(process.pid)
+
+    if pidfd is not None:
+        try:
+            exited = loop.create_future()
+
+            def on_exit():
+                if not exited.done():
+                    exited.set_result(None)
+
+            loop.add_reader(pidfd, on_exit)
+        except NotImplementedError:  # pragma: no cover
+            os.close(pidfd)
+        else:
+            try:
+                await exited
+            finally:
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+            return process.wait()
+
+    return await loop.run_in_executor(None, process.wait)  # pragma: no cover
@@ -0,0 +1,174 @@
+""" the lines of a document, which can be edited in O(log n) per change
+"""
+
+import random
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+Position = Dict[str, int]
+
+
+class _Node:
+    """a line, and the (implicit) treap of the lines around it"""
+
+    __slots__ = ("line", "priority", "left", "right", "count", "length")
+
+    def __init__(self, line: str):
+        self.line = line
+        self.priority = random.random()
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+        # of the lines in this subtree, and of their characters
+        self.count = 1
+        self.length = len(line)
+
+
+def _count(node: Optional[_Node]) -> int:
+    return node.count if node is not None else 0
+
+
+def _update(node: _Node) -> _Node:
+    node.count = 1
+    node.length = len(node.line)
+    for child in (node.left, node.right):
+        if child is not None:
+            node.count += child.count
+            node.length += child.length
+    return node
+
+
+def _build(lines: Iterable[str]) -> Optional[_Node]:
+    """build a treap of lines, in O(n), as a cartesian tree of their priorities"""
+    stack: List[_Node] = []
+    for line in lines:
+        node = _Node(line)
+        last = None
+        while stack and stack[-1].priority < node.priority:
+            last = _update(stack.pop())
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+    root = stack[0] if stack else None
+    while stack:
+        _update(stack.pop())
+    return root
+
+
+def _split(
+    node: Optional[_Node], count: int
+) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """split a treap into its first ``count`` lines, and the rest"""
+    if node is None:
+        return None, None
+    left_count = _count(node.left)
+    if count <= left_count:
+        left, node.left = _split(node.left, count)
+        return left, _update(node)
+    node.right, right = _split(node.right, count - left_count - 1)
+    return _update(node), right
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _first(node: _Node) -> _Node:
+    while node.left is not None:
+        node = node.left
+    return node
+
+
+def _last(node: _Node) -> _Node:
+    while node.right is not None:
+        node = node.right
+    return node
+
+
+class Rope:
+    """The lines of a document, as a balanced tree, so that a change to a range
+    of it costs O(log n), plus the length of the new text, rather than copying
+    every line.
+
+    There is always at least one (maybe empty) line. Positions are LSP
+    ``Position``s: past the end of a line means its end, and past the last line
+    means the end of the document.
+    """
+
+    def __init__(self, lines: Iterable[str] = ("",)):
+        self._root = _build(lines) or _Node("")
+
+    def __len__(self) -> int:
+        """the number of lines"""
+        return self._root.count
+
+    def __iter__(self) -> Iterator[str]:
+        stack: List[_Node] = []
+        node: Optional[_Node] = self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.line
+            node = node.right
+
+    @property
+    def length(self) -> int:
+        """the number of characters, including line breaks"""
+        return self._root.length + self._root.count - 1
+
+    def line(self, index: int) -> str:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        node = self._root
+        while True:
+            left_count = _count(node.left)
+            if index == left_count:
+                return node.line
+            if index < left_count:
+                node = node.left  # type: ignore[assignment]
+            else:
+                index -= left_count + 1
+                node = node.right  # type: ignore[assignment]
+
+    def text(self) -> str:
+        return "\n".join(self)
+
+    def replace(self, start: Position, end: Position, text: str) -> None:
+        """replace the text in a range"""
+        start_line, start_character = self._clamp(start)
+        end_line, end_character = self._clamp(end)
+        if (end_line, end_character) < (start_line, start_character):
+            start_line, start_character, end_line, end_character = (
+                end_line,
+                end_character,
+                start_line,
+                start_character,
+            )
+
+        before, rest = _split(self._root, start_line)
+        replaced, after = _split(rest, end_line - start_line + 1)
+        assert replaced is not None
+        lines = (
+            _first(replaced).line[:start_character]
+            + text
+            + _last(replaced).line[end_character:]
+        ).split("\n")
+        root = _merge(_merge(before, _build(lines)), after)
+        assert root is not None
+        self._root = root
+
+    def _clamp(self, position: Position) -> Tuple[int, int]:
+        line = max(position["line"], 0)
+        if line >= len(self):
+            line = len(self) - 1
+            return line, len(self.line(line))
+        return line, min(max(position["character"], 0), len(self.line(line)))
@@ -0,0 +1,449 @@
+""" route JSON-RPC messages between one language server and many websockets
+"""
+
+import asyncio
+import logging
+from itertools import count
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Text,
+    Tuple,
+)
+
+from .codec import JsonCodec, Message, peek_id, peek_method
+from .rope import Rope
+from .types import LanguageServerMessage
+
+# notifications from the client which change which documents it has open
+DID_OPEN = "textDocument/didOpen"
+DID_CHANGE = "textDocument/didChange"
+DID_CLOSE = "textDocument/didClose"
+DID_CHANGE_CONFIGURATION = "workspace/didChangeConfiguration"
+CANCEL_REQUEST = "$/cancelRequest"
+# the handshake, which is only performed once per language server process
+INITIALIZE = "initialize"
+INITIALIZED = "initialized"
+# the error with which requests the language server will never answer are answered
+REQUEST_CANCELLED = -32800
+
+# initialize params which a prewarmed language server cannot be brought round to,
+# unlike the client's capabilities
+PREWARM_FIXED = ("rootUri", "rootPath", "workspaceFolders", "initializationOptions")
+
+
+def document_uri(message: LanguageServerMessage) -> Optional[Text]:
+    """find the URI of the document a message is about, if any"""
+    params = message.get("params")
+    if not isinstance(params, dict):
+        return None
+    uri = params.get("uri")
+    if uri is None:
+        text_document = params.get("textDocument")
+        if isinstance(text_document, dict):
+            uri = text_document.get("uri")
+    return uri if isinstance(uri, str) else None
+
+
+class MessageRouter:
+    """Deliver each message from a language server only to the websocket(s)
+    which need it.
+
+    Request ids from each websocket are rewritten to ids unique to the
+    language server, so that each response can be returned to the websocket
+    which asked for it, with its original id. Notifications about a document,
+    such as ``textDocument/publishDiagnostics``, only go to the websockets
+    which have opened it. Anything else is sent to every websocket.
+
+    Requests from the language server are sent to every websocket, but only
+    the first answer is forwarded. A response to a request nobody is waiting
+    for, e.g. from a websocket which has gone away, is dropped.
+
+    Only the first ``initialize`` request and ``initialized`` notification
+    reach the language server: the ``initialize`` result is kept, and later
+    websockets are answered from it directly.
+
+    The latest text of each open document, and the latest configuration, are
+    kept, so that a new language server process can be brought up to date.
+    """
+
+    #: send a message directly to a websocket
+    reply: Optional[Callable[[Hashable, Message], None]] = None
+
+    #: how messages are parsed, and rewritten
+    codec: JsonCodec = JsonCodec()
+
+    log: logging.Logger = logging.getLogger(__name__)
+
+    #: the params and result of the initialize request, once known
+    initialize_params: Optional[Dict[Text, Any]] = None
+    initialize_result: Optional[Dict[Text, Any]] = None
+    #: the params of the latest workspace/didChangeConfiguration
+    configuration: Any = None
+    #: whether the initialize result was negotiated by prewarming, with params
+    #: which were not a client's, and no client has been answered from it yet
+    prewarmed: bool = False
+
+    def __init__(self):
+        self._ids = count()
+        # proxy id of the initialize request in flight
+        self._initialize_id: Optional[int] = None
+        # (handler, original id) of initialize requests waiting for the result
+        self._initialize_waiters: List[Tuple[Hashable, Any]] = []
+        self._initialized = False
+        # proxy id: (handler, original id)
+        self._requests: Dict[int, Tuple[Hashable, Any]] = {}
+        # (handler, original id): proxy id
+        self._proxy_ids: Dict[Tuple[Hashable, Any], int] = {}
+        # ids of requests from the server which are yet to be answered
+        self._server_requests: Set[Any] = set()
+        # uri: the handlers which have it open
+        self._documents: Dict[Text, Set[Hashable]] = {}
+        # uri: the latest textDocument (uri, languageId, version), and its text
+        self._texts: Dict[Text, Tuple[Dict[Text, Any], Rope]] = {}
+
+    @property
+    def pending_requests(self) -> int:
+        return len(self._requests)
+
+    def open_documents(self) -> List[Dict[Text, Any]]:
+        """the ``textDocument`` of each open document, as it would be opened now"""
+        return [
+            dict(document, text=text.text()) for document, text in self._texts.values()
+        ]
+
+    def from_client(
+        self,
+        handler: Hashable,
+        message: Message,
+        parsed: Optional[LanguageServerMessage] = None,
+    ) -> Optional[Message]:
+        """prepare a message from a websocket for the language server, or return
+        ``None`` if it should not be forwarded
+
+        ``parsed`` is the message, if it has already been parsed, e.g. for
+        listeners.
+        """
+        if parsed is None:
+            parsed = self._parse(message)
+        if parsed is None:
+            return message
+
+        method = parsed.get("method")
+        has_id = "id" in parsed
+
+        if method is None:
+            if has_id and parsed["id"] in self._server_requests:
+                self._server_requests.discard(parsed["id"])
+                return message
+            # another websocket has already answered this request from the server
+            return None if has_id else message
+
+        if method == INITIALIZE and has_id:
+            if self.prewarmed:
+                # for when it is started again, e.g. after being idle
+                self.initialize_params = parsed.get("params")
+                self.prewarmed = False
+            if self.initialize_result is not None:
+                self._reply(handler, parsed["id"], result=self.initialize_result)
+                return None
+            if self._initialize_id is not None:
+                self._initialize_waiters.append((handler, parsed["id"]))
+                return None
+            self.initialize_params = parsed.get("params")
+
+        if method == INITIALIZED:
+            if self._initialized:
+                return None
+            self._initialized = True
+
+        if has_id:
+            proxy_id = next(self._ids)
+            self._requests[proxy_id] = (handler, parsed["id"])
+            self._proxy_ids[handler, parsed["id"]] = proxy_id
+            if method == INITIALIZE:
+                self._initialize_id = proxy_id
+            # a new message, as listeners may still be looking at this one
+            return self.codec.dumps({**parsed, "id": proxy_id})
+
+        if method == CANCEL_REQUEST:
+            params = parsed.get("params")
+            if not isinstance(params, dict):
+                return message
+            proxy_id = self._proxy_ids.get((handler, params.get("id")))
+            if proxy_id is None:
+                # the response has already been sent
+                return None
+            return self.codec.dumps({**parsed, "params": {**params, "id": proxy_id}})
+
+        if method in (DID_OPEN, DID_CLOSE):
+            uri = document_uri(parsed)
+            if uri is not None:
+                self._track_document(handler, uri, opened=method == DID_OPEN)
+                if method == DID_OPEN:
+                    self._track_text(parsed["params"].get("textDocument"))
+        elif method == DID_CHANGE:
+            self._track_change(parsed.get("params"))
+        elif method == DID_CHANGE_CONFIGURATION:
+            self.configuration = parsed.get("params")
+
+        return message
+
+    def from_server(
+        self,
+        message: Message,
+        handlers: Iterable[Hashable],
+        parsed: Optional[LanguageServerMessage] = None,
+    ) -> Tuple[List[Hashable], Message]:
+        """find which of the websockets should receive a message from the
+        language server, and what they should receive
+
+        A response to a websocket, which may be large, only has its id replaced,
+        without being parsed, where possible.
+        """
+        if parsed is None:
+            response = self._peek_response(message)
+            if response is not None:
+                return response
+            parsed = self._parse(message)
+        if parsed is None:
+            return list(handlers), message
+
+        method = parsed.get("method")
+        has_id = "id" in parsed
+
+        if method is None and has_id:
+            request = self._requests.pop(parsed["id"], None)
+            if request is None:
+                # its id is the proxy's, which may be another request's own id
+                self.log.debug("[lsp] dropped a response to %s", parsed["id"])
+                return [], message
+            handler, original_id = request
+            self._proxy_ids.pop(request, None)
+            if parsed["id"] == self._initialize_id:
+                self._on_initialize_response(parsed)
+            if handler is None:
+                # a request made by the proxy itself, maybe with nobody waiting
+                if original_id is not None and not original_id.done():
+                    original_id.set_result(parsed)
+                return [], message
+            return [handler], self.codec.dumps({**parsed, "id": original_id})
+
+        if has_id:
+            self._server_requests.add(parsed["id"])
+            return list(handlers), message
+
+        uri = document_uri(parsed)
+        if uri is not None:
+            interested = self._documents.get(uri, set())
+            return [handler for handler in handlers if handler in interested], message
+
+        return list(handlers), message
+
+    def request(
+        self, method: Text, params: Any = None
+    ) -> Tuple[bytes, "asyncio.Future[LanguageServerMessage]"]:
+        """make a request of the language server on behalf of the proxy itself
+
+        Returns the message to send, and a future for the response.
+        """
+        proxy_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._requests[proxy_id] = (None, future)
+        if method == INITIALIZE:
+            self.initialize_params = params
+            self._initialize_id = proxy_id
+        message = {"jsonrpc": "2.0", "id": proxy_id, "method": method}
+        if params is not None:
+            message["params"] = params
+        return self.codec.dumps(message), future
+
+    def notification(self, method: Text, params: Any = None) -> bytes:
+        """send a notification to the language server on behalf of the proxy"""
+        if method == INITIALIZED:
+            self._initialized = True
+        message = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        return self.codec.dumps(message)
+
+    def prewarmed_for_others(self, parsed: Optional[LanguageServerMessage]) -> bool:
+        """whether a client's initialize request is for another workspace, or has
+        other options, than the language server was prewarmed with, so should not
+        be answered with its result
+
+        Other capabilities do not matter: until the language server is next
+        started, with the client's, it may only use fewer features than it could.
+        """
+        if not (self.prewarmed and parsed and parsed.get("method") == INITIALIZE):
+            return False
+        params = parsed.get("params") or {}
+        prewarmed = self.initialize_params or {}
+        return any(params.get(key) != prewarmed.get(key) for key in PREWARM_FIXED)
+
+    def remove_handler(self, handler: Hashable) -> List[Text]:
+        """forget everything about a websocket that has gone away, returning the
+        URIs of the documents it left open, without closing them
+
+        An ``initialize`` request it made which is still in flight is kept, for
+        the next websocket waiting for it, or else the proxy itself, so that
+        its result is still kept.
+        """
+        self._initialize_waiters = [
+            waiter for waiter in self._initialize_waiters if waiter[0] != handler
+        ]
+        for proxy_id, request in list(self._requests.items()):
+            if request[0] != handler:
+                continue
+            self._requests.pop(proxy_id)
+            self._proxy_ids.pop(request, None)
+            if proxy_id == self._initialize_id:
+                waiter = (
+                    self._initialize_waiters.pop(0)
+                    if self._initialize_waiters
+                    else (None, None)
+                )
+                self._requests[proxy_id] = waiter
+                if waiter[0] is not None:
+                    self._proxy_ids[waiter] = proxy_id
+        left_open = [
+            uri for uri, handlers in self._documents.items() if handler in handlers
+        ]
+        for uri in left_open:
+            self._track_document(handler, uri, opened=False)
+        return left_open
+
+    def reset(self) -> None:
+        """forget the state of a language server process which has stopped
+
+        The ``initialize`` params, and which documents are open, are kept. Any
+        requests still waiting for the language server are answered with an
+        error, so that clients do not wait forever.
+        """
+        error = {"code": REQUEST_CANCELLED, "message": "the language server stopped"}
+        for handler, original_id in [
+            *self._requests.values(),
+            *self._initialize_waiters,
+        ]:
+            if handler is not None:
+                self._reply(handler, original_id, error=error)
+            elif original_id is not None:
+                original_id.cancel()
+        self._requests.clear()
+        self._proxy_ids.clear()
+        self._server_requests.clear()
+        self._initialize_id = None
+        self._initialize_waiters = []
+        self._initialized = False
+        self.initialize_result = None
+
+    def _on_initialize_response(self, response: LanguageServerMessage) -> None:
+        """keep a successful result, and answer anybody waiting for it"""
+        self._initialize_id = None
+        waiters, self._initialize_waiters = self._initialize_waiters, []
+
+        if "result" in response:
+            self.initialize_result = response["result"]
+            for handler, original_id in waiters:
+                self._reply(handler, original_id, result=self.initialize_result)
+        else:
+            for handler, original_id in waiters:
+                self._reply(handler, original_id, error=response.get("error"))
+
+    def _reply(self, handler: Hashable, id_: Any, **result_or_error) -> None:
+        if self.reply is not None:
+            self.reply(
+                handler,
+                self.codec.dumps({"jsonrpc": "2.0", "id": id_, **result_or_error}),
+            )
+
+    def _track_document(self, handler: Hashable, uri: Text, opened: bool) -> None:
+        handlers = self._documents.setdefault(uri, set())
+        if opened:
+            handlers.add(handler)
+        else:
+            handlers.discard(handler)
+            if not handlers:
+                self._documents.pop(uri)
+                self._texts.pop(uri, None)
+
+    def _track_text(self, document: Any) -> None:
+        if not isinstance(document, dict) or "uri" not in document:
+            return
+        if isinstance(document.get("text"), str):
+            self._texts[document["uri"]] = (
+                {
+                    key: document[key]
+                    for key in ("uri", "languageId", "version")
+                    if key in document
+                },
+                Rope(document["text"].split("\n")),
+            )
+
+    def _track_change(self, params: Any) -> None:
+        """apply the ``contentChanges`` of a ``textDocument/didChange``, in order,
+        each in O(log n) of the lines of the document, for a ranged change
+        """
+        uri = document_uri({"params": params})
+        tracked = self._texts.get(uri) if uri else None
+        if tracked is None or not isinstance(params.get("contentChanges"), list):
+            return
+        document, text = tracked
+        try:
+            for change in params["contentChanges"]:
+                change_range = change.get("range")
+                if change_range is None:
+                    text = Rope(change["text"].split("\n"))
+                else:
+                    text.replace(
+                        change_range["start"], change_range["end"], change["text"]
+                    )
+        except (AttributeError, KeyError, TypeError):
+            # we can no longer know what the language server would have
+            self._texts.pop(uri)
+            return
+        self._texts[uri] = (document, text)
+        version = params.get("textDocument", {}).get("version")
+        if isinstance(version, int):
+            document["version"] = version
+
+    def _peek_response(
+        self, message: Message
+    ) -> Optional[Tuple[List[Hashable], Message]]:
+        """route a response to a websocket's request, replacing its id in place"""
+        peeked, method = peek_method(message)
+        if not peeked or method is not None:
+            return None
+
+        found = peek_id(message)
+        if found is None:
+            return None
+
+        start, end, proxy_id = found
+        request = self._requests.get(proxy_id)
+        if request is None:
+            self.log.debug("[lsp] dropped a response to %s", proxy_id)
+            return [], message
+        if request[0] is None or proxy_id == self._initialize_id:
+            return None
+
+        self._requests.pop(proxy_id)
+        self._proxy_ids.pop(request, None)
+        handler, original_id = request
+        original = self.codec.dumps(original_id)
+        if isinstance(message, str):
+            original = original.decode("utf-8")
+        return [handler], message[:start] + original + message[end:]
+
+    def _parse(self, message: Message) -> Optional[LanguageServerMessage]:
+        try:
+            parsed = self.codec.loads(message)
+        except ValueError:
+            return None
+        return parsed if isinstance(parsed, dict) else None
@@ -1,23 +1,32 @@
 import json
 import pathlib
-
-import jsonschema
+from functools import lru_cache
 
 HERE = pathlib.Path(__file__).parent
 SCHEMA_FILE = HERE / "schema.json"
 SCHEMA = json.loads(SCHEMA_FILE.read_text(encoding="utf-8"))
 SPEC_VERSION = SCHEMA["definitions"]["current-version"]["enum"][0]
 
+#: the definitions checked by the validators of this module, made on first use
+VALIDATORS = {
+    "SERVERS_RESPONSE": "servers-response",
+    "LANGUAGE_SERVER_SPEC": "language-server-spec",
+    "LANGUAGE_SERVER_SPEC_MAP": "language-server-specs-implementation-map",
+}
+
 
+@lru_cache(maxsize=None)
 def make_validator(key):
     """make a JSON Schema (Draft 7) validator"""
+    import jsonschema
+
     schema = {"$ref": "#/definitions/{}".format(key)}
     schema.update(SCHEMA)
     return jsonschema.validators.Draft7Validator(schema)
 
 
-SERVERS_RESPONSE = make_validator("servers-response")
-
-LANGUAGE_SERVER_SPEC = make_validator("language-server-spec")
-
-LANGUAGE_SERVER_SPEC_MAP = make_validator("language-server-specs-implementation-map")
+def __getattr__(name):
+    """get a validator, only importing ``jsonschema`` when one is first needed"""
+    if name in VALIDATORS:
+        return make_validator(VALIDATORS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
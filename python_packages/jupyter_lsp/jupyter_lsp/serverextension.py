@@ -12,21 +12,45 @@ from .manager import LanguageServerManager
 from .paths import normalized_uri
 
 
-async def initialize(nbapp, virtual_documents_uri):  # pragma: no cover
+async def initialize(nbapp, virtual_documents_uri, root_uri=None):
     """Perform lazy initialization."""
     import concurrent.futures
 
-    from .virtual_documents_shadow import setup_shadow_filesystem
+    from .virtual_documents_shadow import (
+        requires_documents_on_disk,
+        setup_shadow_filesystem,
+    )
 
     manager: LanguageServerManager = nbapp.language_server_manager
 
+    # listen for documents before any language server is found: those which
+    # read them from disk wait only until the shadow filesystem exists
+    shadow = setup_shadow_filesystem(
+        virtual_documents_uri=virtual_documents_uri,
+        max_documents=manager.shadow_cache_documents,
+        max_bytes=manager.shadow_cache_bytes,
+        write_delay=manager.shadow_write_delay,
+        workers=manager.shadow_workers,
+        queue=manager.shadow_queue,
+        backend=manager.shadow_backend,
+        max_files=manager.shadow_max_files,
+        max_disk_bytes=manager.shadow_max_disk_bytes,
+        sweep_interval=manager.shadow_sweep_interval,
+    )
+    manager.hold_ready(
+        lambda: shadow.initialize(manager),
+        needs=lambda language_server: requires_documents_on_disk(
+            manager, language_server
+        ),
+    )
+
     with concurrent.futures.ThreadPoolExecutor() as pool:
         await nbapp.io_loop.run_in_executor(pool, manager.initialize)
 
     servers_requiring_disk_access = [
         server_id
-        for server_id, server in manager.language_servers.items()
-        if server.get("requires_documents_on_disk", True)
+        for server_id in manager.language_servers
+        if requires_documents_on_disk(manager, server_id)
     ]
 
     if any(servers_requiring_disk_access):
@@ -34,11 +58,10 @@ async def initialize(nbapp, virtual_documents_uri):  # pragma: no cover
             "[lsp] Servers that requested virtual documents on disk: %s",
             servers_requiring_disk_access,
         )
-        setup_shadow_filesystem(virtual_documents_uri=virtual_documents_uri)
     else:
         nbapp.log.debug(
             "[lsp] None of the installed servers require virtual documents"
-            " disabling shadow filesystem."
+            " on disk, the shadow filesystem will not be created."
         )
 
     nbapp.log.debug(
@@ -47,6 +70,14 @@ async def initialize(nbapp, virtual_documents_uri):  # pragma: no cover
         )
     )
 
+    # set up the shadow filesystem now, if needed, rather than when first used
+    await manager.ready()
+
+    if manager.prewarm:
+        nbapp.io_loop.add_callback(manager.prewarm_sessions, root_uri)
+
+    manager.start_reaper()
+
 
 def load_jupyter_server_extension(nbapp):
     """create a LanguageServerManager and add handlers"""
@@ -87,4 +118,26 @@ def load_jupyter_server_extension(nbapp):
         # handle jupyter_server 1.x
         io_loop = ioloop.IOLoop.current()
 
-    io_loop.call_later(0, initialize, nbapp, virtual_documents_uri)
+    io_loop.call_later(0, initialize, nbapp, virtual_documents_uri, root_uri)
+
+    add_shutdown_hook(nbapp, manager)
+
+
+def add_shutdown_hook(nbapp, manager: LanguageServerManager):
+    """shut down the language servers gracefully when the server stops, before
+    its extensions are cleaned up: stopping them at exit is only a fallback
+    """
+    cleanup_extensions = getattr(nbapp, "cleanup_extensions", None)
+
+    if cleanup_extensions is None:  # pragma: no cover
+        # jupyter_server 1.x, without shutdown hooks
+        return
+
+    async def shutdown_and_cleanup_extensions():
+        try:
+            await manager.shutdown()
+        except Exception as err:  # pragma: no cover
+            nbapp.log.warning("[lsp] failed to shut down language servers: %s", err)
+        await cleanup_extensions()
+
+    nbapp.cleanup_extensions = shutdown_and_cleanup_extensions
@@ -4,57 +4,145 @@
 import asyncio
 import atexit
 import os
+import signal
 import string
 import subprocess
+import time
 from datetime import datetime, timezone
+from functools import partial
 
 from tornado.ioloop import IOLoop
-from tornado.queues import Queue
 from tornado.websocket import WebSocketHandler
-from traitlets import Bunch, Instance, Set, Unicode, UseEnum, observe
+from traitlets import Bunch, Float, Instance, Int, Set, Unicode, UseEnum, observe
 from traitlets.config import LoggingConfigurable
 
 from . import stdio
-from .schema import LANGUAGE_SERVER_SPEC
+from .flow_control import FlowControl, FlowControlledQueue
+from .process import wait_for_exit
+from .routing import MessageRouter
 from .specs.utils import censored_spec
 from .trait_types import Schema
-from .types import SessionStatus
+from .types import PrewarmStatus, SessionStatus
+
+try:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):  # pragma: no cover
+    PAGE_SIZE = 4096
 
 
 class LanguageServerSession(LoggingConfigurable):
     """Manage a session for a connection to a language server"""
 
     language_server = Unicode(help="the language server implementation name")
-    spec = Schema(LANGUAGE_SERVER_SPEC)
+    spec = Schema("LANGUAGE_SERVER_SPEC")
 
     # run-time specifics
     process = Instance(
         subprocess.Popen, help="the language server subprocess", allow_none=True
     )
-    writer = Instance(stdio.LspStdIoWriter, help="the JSON-RPC writer", allow_none=True)
-    reader = Instance(stdio.LspStdIoReader, help="the JSON-RPC reader", allow_none=True)
+    writer = Instance(stdio.LspStdIoBase, help="the JSON-RPC writer", allow_none=True)
+    reader = Instance(stdio.LspStdIoBase, help="the JSON-RPC reader", allow_none=True)
     from_lsp = Instance(
-        Queue, help="a queue for string messages from the server", allow_none=True
+        FlowControlledQueue,
+        help="a queue for string messages from the server",
+        allow_none=True,
     )
     to_lsp = Instance(
-        Queue, help="a queue for string message to the server", allow_none=True
+        FlowControlledQueue,
+        help="a queue for string message to the server",
+        allow_none=True,
     )
     handlers = Set(
         trait=Instance(WebSocketHandler),
         default_value=[],
         help="the currently subscribed websockets",
     )
+    router = Instance(
+        MessageRouter,
+        args=(),
+        help="delivers messages from the server to the websockets that need them",
+    )
     status = UseEnum(SessionStatus, default_value=SessionStatus.NOT_STARTED)
+    prewarm_status = UseEnum(PrewarmStatus, default_value=None, allow_none=True)
     last_handler_message_at = Instance(datetime, allow_none=True)
     last_server_message_at = Instance(datetime, allow_none=True)
+    restarts = Int(0, help="how many times the language server has been restarted")
+
+    queue_high_watermark = Int(
+        1024,
+        help=(
+            "pause reading from the other side when a queue holds this many"
+            " messages (0 to disable)"
+        ),
+    ).tag(config=True)
+    queue_low_watermark = Int(
+        256, help="resume reading when a paused queue holds this many messages"
+    ).tag(config=True)
+    handler_high_watermark = Int(
+        256,
+        help=(
+            "pause reading from the language server when a websocket has this many"
+            " messages waiting to be sent (0 to disable)"
+        ),
+    ).tag(config=True)
+    handler_low_watermark = Int(
+        64,
+        help="resume reading when every websocket has this many messages waiting",
+    ).tag(config=True)
+
+    initialize_timeout = Float(
+        60,
+        help=(
+            "seconds to wait for the initialize handshake when prewarming, or"
+            " restarting an evicted language server"
+        ),
+    ).tag(config=True)
+
+    shutdown_timeout = Float(
+        5,
+        help=(
+            "seconds to wait for the language server to exit after each of the"
+            " shutdown request and exit notification, SIGTERM and SIGKILL"
+        ),
+    ).tag(config=True)
+
+    restart_delay = Float(
+        0.5,
+        help=(
+            "seconds to wait before restarting a language server which exited"
+            " unexpectedly, doubling after each consecutive crash"
+        ),
+    ).tag(config=True)
+    restart_max_delay = Float(
+        30,
+        help=(
+            "the longest to wait before restarting a crashed language server: one"
+            " which ran for longer than this is no longer considered to be crashing"
+        ),
+    ).tag(config=True)
+    restart_attempts = Int(
+        5,
+        help="consecutive crashes after which a language server is left stopped",
+    ).tag(config=True)
 
     _tasks = None
+    _started_at = None  # type: float
+    _crashes = 0
+    _restarting = None  # type: asyncio.Future
+    _stopping = None  # type: asyncio.Future
+    _handler_flow = None  # type: FlowControl
+    _pending_writes = None  # type: dict
 
     _skip_serialize = ["argv", "debug_argv"]
 
     def __init__(self, *args, **kwargs):
         """set up the required traitlets and exit behavior for a session"""
         super().__init__(*args, **kwargs)
+        self.router.reply = self.write_to_handler
+        self.router.log = self.log
+        codec = getattr(self.parent, "codec", None)
+        if codec is not None:
+            self.router.codec = codec
         atexit.register(self.stop)
 
     def __repr__(self):  # pragma: no cover
@@ -66,6 +154,9 @@ class LanguageServerSession(LoggingConfigurable):
         return dict(
             handler_count=len(self.handlers),
             status=self.status.value,
+            prewarm=self.prewarm_status.value if self.prewarm_status else None,
+            rss=self.rss(),
+            restarts=self.restarts,
             last_server_message_at=(
                 self.last_server_message_at.isoformat()
                 if self.last_server_message_at
@@ -77,12 +168,24 @@ class LanguageServerSession(LoggingConfigurable):
                 else None
             ),
             spec=censored_spec(self.spec),
+            **(
+                dict(
+                    queues=dict(
+                        from_lsp=self.from_lsp.flow.to_json(),
+                        to_lsp=self.to_lsp.flow.to_json(),
+                        handlers=self._handler_flow.to_json(),
+                    )
+                )
+                if self._handler_flow
+                else {}
+            ),
         )
 
     def initialize(self):
         """(re)initialize a language server session"""
         self.stop()
         self.status = SessionStatus.STARTING
+        self.router.reset()
         self.init_queues()
         self.init_process()
         self.init_writer()
@@ -92,16 +195,22 @@ class LanguageServerSession(LoggingConfigurable):
         self._tasks = [
             loop.create_task(coro())
             for coro in [self._read_lsp, self._write_lsp, self._broadcast_from_lsp]
-        ]
+        ] + [loop.create_task(self._watch_process(self.process))]
+        self._started_at = time.monotonic()
 
         self.status = SessionStatus.STARTED
 
     def stop(self):
-        """clean up all of the state of the session"""
+        """clean up all of the state of the session, without waiting for the
+        language server to exit: see ``shutdown``
+        """
+        suspended = self.status == SessionStatus.SUSPENDED
 
         self.status = SessionStatus.STOPPING
 
         if self.process:
+            if suspended:
+                self.process.send_signal(signal.SIGCONT)
             self.process.terminate()
             self.process = None
         if self.reader:
@@ -116,19 +225,306 @@ class LanguageServerSession(LoggingConfigurable):
 
         self.status = SessionStatus.STOPPED
 
+    async def shutdown(self, status=SessionStatus.STOPPED):
+        """ask the language server to shut down, and wait for it to exit, before
+        cleaning up: if it takes too long, it is sent SIGTERM, then SIGKILL
+        """
+        process = self.process
+
+        if process is not None:
+            self.resume()
+            self.status = SessionStatus.STOPPING
+
+            try:
+                if process.poll() is None:
+                    await asyncio.wait_for(
+                        self.request("shutdown"), self.shutdown_timeout
+                    )
+                    self.notify("exit")
+            except Exception as err:
+                self.log.debug(
+                    "[%s] no response to shutdown: %s",
+                    self.language_server,
+                    err or type(err),
+                )
+
+            for escalate in [None, process.terminate, process.kill]:
+                if escalate is not None:
+                    self.log.warning(
+                        "[%s] did not exit, sending %s",
+                        self.language_server,
+                        escalate.__name__,
+                    )
+                    escalate()
+                try:
+                    await asyncio.wait_for(
+                        wait_for_exit(process), self.shutdown_timeout
+                    )
+                    break
+                except asyncio.TimeoutError:
+                    continue
+
+            self.process = None
+
+        self.stop()
+        # nobody is left to restart an evicted language server for
+        if status == SessionStatus.EVICTED and not self.handlers:
+            status = SessionStatus.STOPPED
+        self.status = status
+
+    def shutdown_soon(self, status=SessionStatus.STOPPED):
+        """start shutting down, unless already doing so"""
+        if self._stopping is None:
+            self._stopping = asyncio.ensure_future(self.shutdown(status))
+            self._stopping.add_done_callback(self._on_stopped)
+        return self._stopping
+
+    def _on_stopped(self, future):
+        self._stopping = None
+        if not future.cancelled() and future.exception():
+            self.log.error(
+                "[%s] failed to shut down: %s",
+                self.language_server,
+                future.exception(),
+            )
+
+    async def stopped(self):
+        """wait for any shutdown in progress to finish"""
+        if self._stopping is not None:
+            await asyncio.shield(self._stopping)
+
+    @property
+    def can_suspend(self):
+        return hasattr(signal, "SIGSTOP")
+
+    def suspend(self):
+        """pause the language server process until the next message for it"""
+        if self.process and self.status == SessionStatus.STARTED:
+            self.process.send_signal(signal.SIGSTOP)
+            self.status = SessionStatus.SUSPENDED
+
+    def resume(self):
+        """continue a suspended language server process"""
+        if self.process and self.status == SessionStatus.SUSPENDED:
+            self.process.send_signal(signal.SIGCONT)
+            self.status = SessionStatus.STARTED
+
+    def evict(self):
+        """stop the language server process, but keep the websockets: it will be
+        restarted on the next message from any of them
+        """
+        return self.shutdown_soon(SessionStatus.EVICTED)
+
+    async def ensure_started(self):
+        """resume a suspended language server, or restart an evicted or stopping
+        one, before sending it a message
+        """
+        if self._stopping is not None:
+            await self.stopped()
+            if self.handlers and self.status == SessionStatus.STOPPED:
+                self.initialize()
+
+        if self.status == SessionStatus.SUSPENDED:
+            self.resume()
+        elif self.status == SessionStatus.EVICTED and self._restarting is None:
+            self._restarting = asyncio.ensure_future(self._restart())
+
+        # a restart may be replaced by another, if the language server crashes
+        while self._restarting is not None:
+            await asyncio.wait([self._restarting])
+
+    async def _restart(self, delay=0):
+        """start a new language server process, and bring it to the state the
+        websockets expect: initialized, configured and with their documents open
+        """
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            self.log.info("[%s] restarting", self.language_server)
+            self.restarts += 1
+            self.initialize()
+            params = self.router.initialize_params
+            if params is None:
+                return
+            response = await asyncio.wait_for(
+                self.request("initialize", params), self.initialize_timeout
+            )
+            if "result" not in response:
+                raise ValueError(response.get("error"))
+            self.notify("initialized", {})
+            if self.router.configuration is not None:
+                self.notify(
+                    "workspace/didChangeConfiguration", self.router.configuration
+                )
+            for document in self.router.open_documents():
+                self.notify("textDocument/didOpen", {"textDocument": document})
+        except (Exception, asyncio.CancelledError) as err:
+            # a restart is cancelled if the new process crashes in turn
+            self.log.warning(
+                "[%s] failed to restart: %s", self.language_server, err or type(err)
+            )
+        finally:
+            if self._restarting is asyncio.current_task():
+                self._restarting = None
+
+    async def _watch_process(self, process):
+        """notice if the language server exits, other than by being stopped"""
+        returncode = await wait_for_exit(process)
+
+        if process is not self.process or self._stopping is not None:
+            return
+
+        self.log.warning(
+            "[%s] exited unexpectedly with %s", self.language_server, returncode
+        )
+
+        if time.monotonic() - self._started_at > self.restart_max_delay:
+            self._crashes = 0
+
+        # this task is cancelled by stopping, but has nothing left to wait for
+        self.stop()
+
+        if not (self.handlers or self.prewarm_status == PrewarmStatus.WARM):
+            return
+
+        if self._crashes >= self.restart_attempts:
+            self.log.error(
+                "[%s] crashed %s times in a row: not restarting",
+                self.language_server,
+                self._crashes,
+            )
+            return
+
+        delay = min(self.restart_delay * 2**self._crashes, self.restart_max_delay)
+        self._crashes += 1
+        self.log.info("[%s] restarting in %ss", self.language_server, delay)
+        self.status = SessionStatus.RESTARTING
+
+        if self._restarting is not None:
+            self._restarting.cancel()
+        self._restarting = asyncio.ensure_future(self._restart(delay))
+
+    @property
+    def last_activity_at(self):
+        """when a message was last sent to, or received from, the language server"""
+        times = [self.last_handler_message_at, self.last_server_message_at]
+        return max([time for time in times if time is not None], default=None)
+
+    def rss(self):
+        """the resident memory of the language server process in bytes, if known"""
+        if self.process is None:
+            return None
+        try:
+            with open(f"/proc/{self.process.pid}/statm", "rb") as fp:
+                return int(fp.read().split()[1]) * PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            return None
+
     @observe("handlers")
     def _on_handlers(self, change: Bunch):
         """re-initialize if someone starts listening, or stop if nobody is"""
         if change["new"] and not self.process:
-            self.initialize()
+            # an evicted language server is restarted with the next message
+            if self.status != SessionStatus.EVICTED:
+                self.initialize()
         elif not change["new"] and self.process:
-            self.stop()
+            self.shutdown_soon()
+        elif not change["new"] and self.status in [
+            SessionStatus.EVICTED,
+            SessionStatus.RESTARTING,
+        ]:
+            if self._restarting is not None:
+                self._restarting.cancel()
+            self.status = SessionStatus.STOPPED
 
     def write(self, message):
         """wrapper around the write queue to keep it mostly internal"""
         self.last_handler_message_at = self.now()
         IOLoop.current().add_callback(self.to_lsp.put_nowait, message)
 
+    async def prewarm(self, params):
+        """start the language server, and complete the initialize handshake,
+        before any client has connected
+        """
+        if self.router.initialize_result is not None:
+            return
+
+        self.prewarm_status = PrewarmStatus.WARMING
+
+        try:
+            if not self.process:
+                self.initialize()
+            response = await asyncio.wait_for(
+                self.request("initialize", params), self.initialize_timeout
+            )
+            if "result" not in response:
+                raise ValueError(response.get("error"))
+            self.notify("initialized", {})
+            self.router.prewarmed = True
+        except Exception as err:
+            self.log.warning(
+                "[%s] failed to prewarm: %s", self.language_server, err or type(err)
+            )
+            self.prewarm_status = PrewarmStatus.FAILED
+        else:
+            self.log.info("[%s] prewarmed", self.language_server)
+            self.prewarm_status = PrewarmStatus.WARM
+
+    def unprewarm(self):
+        """start a new language server process for the first client, as it was
+        prewarmed for another workspace, or with other options, than the client's
+        """
+        self.log.info(
+            "[%s] restarting for a client with another workspace, or other"
+            " options, than it was prewarmed with",
+            self.language_server,
+        )
+        self.router.prewarmed = False
+        self.router.initialize_params = None
+        self.initialize()
+
+    async def request(self, method, params=None):
+        """make a request of the language server on behalf of the proxy, and
+        wait for the response
+        """
+        message, future = self.router.request(method, params)
+        self._send(message)
+        return await future
+
+    def notify(self, method, params=None):
+        """send a notification to the language server on behalf of the proxy"""
+        self._send(self.router.notification(method, params))
+
+    def _send(self, message):
+        IOLoop.current().add_callback(self.to_lsp.put_nowait, message)
+
+    async def writable(self):
+        """wait until the queue to the language server is below its watermarks"""
+        if self.to_lsp is not None:
+            await self.to_lsp.flow.wait()
+
+    def write_to_handler(self, handler, message):
+        """send a message to a websocket, tracking how many are waiting to be sent"""
+        future = handler.write_message(message)
+
+        if future is None or self._handler_flow is None:
+            return
+
+        self._pending_writes[handler] = self._pending_writes.get(handler, 0) + 1
+        self._handler_flow.update(max(self._pending_writes.values()))
+        future.add_done_callback(partial(self._on_handler_write_done, handler))
+
+    def _on_handler_write_done(self, handler, future):
+        if not future.cancelled():
+            # a closed websocket will be cleaned up by unsubscribing
+            future.exception()
+
+        pending = self._pending_writes.pop(handler, 1) - 1
+        if pending:
+            self._pending_writes[handler] = pending
+
+        self._handler_flow.update(max(self._pending_writes.values(), default=0))
+
     def now(self):
         return datetime.now(timezone.utc)
 
@@ -143,19 +539,57 @@ class LanguageServerSession(LoggingConfigurable):
         )
 
     def init_queues(self):
-        """create the queues"""
-        self.from_lsp = Queue()
-        self.to_lsp = Queue()
+        """create the queues, which apply backpressure to the other side when full"""
+        self.from_lsp = FlowControlledQueue(
+            FlowControl(
+                self.queue_high_watermark,
+                self.queue_low_watermark,
+                on_pause=self._pause_reader,
+                on_resume=self._resume_reader,
+            )
+        )
+        self.to_lsp = FlowControlledQueue(
+            FlowControl(self.queue_high_watermark, self.queue_low_watermark)
+        )
+        self._handler_flow = FlowControl(
+            self.handler_high_watermark, self.handler_low_watermark
+        )
+        self._pending_writes = {}
+
+    def _pause_reader(self):
+        if self.reader is not None:
+            self.log.debug("%s pausing reads from the language server", self)
+            self.reader.pause()
+
+    def _resume_reader(self):
+        if self.reader is not None:
+            self.log.debug("%s resuming reads from the language server", self)
+            self.reader.resume()
+
+    @property
+    def stdio_transport(self):
+        """how to talk to the stdio of the language server process"""
+        return self.spec.get("stdio_transport", stdio.DEFAULT_STDIO_TRANSPORT)
 
     def init_reader(self):
         """create the stdout reader (from the language server)"""
-        self.reader = stdio.LspStdIoReader(
+        reader_class = (
+            stdio.LspStdIoPipeReader
+            if self.stdio_transport == "pipe"
+            else stdio.LspStdIoReader
+        )
+        self.reader = reader_class(
             stream=self.process.stdout, queue=self.from_lsp, parent=self
         )
 
     def init_writer(self):
         """create the stdin writer (to the language server)"""
-        self.writer = stdio.LspStdIoWriter(
+        writer_class = (
+            stdio.LspStdIoPipeWriter
+            if self.stdio_transport == "pipe"
+            else stdio.LspStdIoWriter
+        )
+        self.writer = writer_class(
             stream=self.process.stdin, queue=self.to_lsp, parent=self
         )
 
@@ -181,3 +615,5 @@ class LanguageServerSession(LoggingConfigurable):
             self.last_server_message_at = self.now()
             await self.parent.on_server_message(message, self)
             self.from_lsp.task_done()
+            # don't take more from the language server than the websockets can take
+            await self._handler_flow.wait()
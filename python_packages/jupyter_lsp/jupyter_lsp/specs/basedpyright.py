@@ -1,4 +1,3 @@
-from .config import load_config_schema
 from .utils import ShellSpec
 
 
@@ -18,6 +17,5 @@ class BasedPyrightLanguageServer(ShellSpec):
             pip="pip install basedpyright",
             conda="conda install -c conda-forge basedpyright",
         ),
-        config_schema=load_config_schema(key),
         requires_documents_on_disk=False,
     )
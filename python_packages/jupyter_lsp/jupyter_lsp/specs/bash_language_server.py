@@ -1,5 +1,4 @@
 from ..types import LanguageServerManagerAPI
-from .config import load_config_schema
 from .utils import NodeModuleSpec
 
 
@@ -21,7 +20,6 @@ class BashLanguageServer(NodeModuleSpec):
             yarn="yarn add --dev {}".format(key),
             jlpm="jlpm add --dev {}".format(key),
         ),
-        config_schema=load_config_schema(key),
     )
 
     def solve(self, mgr: LanguageServerManagerAPI):
@@ -1,11 +1,21 @@
 import json
 import pathlib
+from functools import lru_cache
+from typing import Any, Dict, Optional
 
 CONFIGS = pathlib.Path(__file__).parent
 
 
+@lru_cache(maxsize=None)
 def load_config_schema(key):
-    """load a keyed filename"""
+    """load a keyed filename, once: the result is shared, so must not be changed"""
     return json.loads(
         (CONFIGS / "{}.schema.json".format(key)).read_text(encoding="utf-8")
     )
+
+
+def bundled_config_schema(key) -> Optional[Dict[str, Any]]:
+    """the client configuration schema shipped for a language server, if any"""
+    if not (CONFIGS / "{}.schema.json".format(key)).exists():
+        return None
+    return load_config_schema(key)
@@ -1,4 +1,3 @@
-from .config import load_config_schema
 from .utils import ShellSpec
 
 
@@ -24,5 +23,4 @@ class JuliaLanguageServer(ShellSpec):
             issues="https://github.com/julia-vscode/LanguageServer.jl/issues",
         ),
         install=dict(julia='using Pkg; Pkg.add("LanguageServer")'),
-        config_schema=load_config_schema(key),
     )
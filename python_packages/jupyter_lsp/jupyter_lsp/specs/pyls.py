@@ -1,4 +1,3 @@
-from .config import load_config_schema
 from .utils import PythonModuleSpec
 
 
@@ -31,6 +30,5 @@ class PalantirPythonLanguageServer(PythonModuleSpec):
             ),
             dict(display_name="pyls-isort", install=dict(pip="pip install pyls-isort")),
         ],
-        config_schema=load_config_schema(key),
         env=dict(PYTHONUNBUFFERED="1"),
     )
@@ -1,4 +1,3 @@
-from .config import load_config_schema
 from .utils import PythonModuleSpec
 
 
@@ -44,6 +43,5 @@ class PythonLSPServer(PythonModuleSpec):
                 ),
             ),
         ],
-        config_schema=load_config_schema(key),
         env=dict(PYTHONUNBUFFERED="1"),
     )
@@ -1,4 +1,3 @@
-from .config import load_config_schema
 from .utils import ShellSpec
 
 TROUBLESHOOT = """\
@@ -43,6 +42,5 @@ class RLanguageServer(ShellSpec):
             cran=f'install.packages("{package}")',
             conda="conda install -c conda-forge r-languageserver",
         ),
-        config_schema=load_config_schema(key),
         troubleshoot=TROUBLESHOOT,
     )
@@ -1,4 +1,3 @@
-from .config import load_config_schema
 from .utils import ShellSpec
 
 TROUBLESHOOT = """\
@@ -26,7 +25,6 @@ class Texlab(ShellSpec):
             issues="https://github.com/latex-lsp/texlab/issues",
         ),
         install=dict(conda="conda install -c conda-forge texlab chktex"),
-        config_schema=load_config_schema(key),
         env=dict(RUST_BACKTRACE="1"),
         troubleshoot=TROUBLESHOOT,
     )
@@ -1,4 +1,3 @@
-from .config import load_config_schema
 from .utils import NodeModuleSpec
 
 
@@ -37,5 +36,4 @@ class TypescriptLanguageServer(NodeModuleSpec):
             yarn="yarn add --dev {}".format(key),
             jlpm="jlpm add --dev {}".format(key),
         ),
-        config_schema=load_config_schema(key),
     )
@@ -3,7 +3,7 @@ import shutil
 import sys
 from pathlib import Path
 from subprocess import check_output
-from typing import List, Text, Union
+from typing import List, Optional, Text, Union, cast
 
 from ..schema import SPEC_VERSION
 from ..types import (
@@ -13,6 +13,7 @@ from ..types import (
     SpecBase,
     Token,
 )
+from .config import bundled_config_schema
 
 # helper scripts for known tricky language servers
 HELPERS = Path(__file__).parent / "helpers"
@@ -33,6 +34,10 @@ class ShellSpec(SpecBase):  # pragma: no cover
     # is installed, or nothing if it is missing and user action is required.
     is_installed_args: List[Token] = []
 
+    # seconds after which running `cmd` with `is_installed_args` is given up, if
+    # not the `autodetect_timeout` of the manager
+    is_installed_timeout: Optional[float] = None
+
     def is_installed(self, mgr: LanguageServerManagerAPI) -> bool:
         cmd = self.solve()
 
@@ -42,9 +47,12 @@ class ShellSpec(SpecBase):  # pragma: no cover
         if not self.is_installed_args:
             return bool(cmd)
         else:
-            check_result = check_output([cmd, *self.is_installed_args]).decode(
-                encoding="utf-8"
+            timeout = self.is_installed_timeout or getattr(
+                mgr, "autodetect_timeout", 10
             )
+            check_result = check_output(
+                [cmd, *self.is_installed_args], timeout=timeout
+            ).decode(encoding="utf-8")
             return check_result != ""
 
     def solve(self) -> Union[str, None]:
@@ -141,7 +149,7 @@ class NodeModuleSpec(SpecBase):
             troubleshooting.append(spec["troubleshoot"])
         spec["troubleshoot"] = "\n\n".join(troubleshooting)
 
-        is_installed = self.is_installed(mgr)
+        is_installed = bool(node_module)
 
         return {
             self.key: {
@@ -160,3 +168,15 @@ SKIP_JSON_SPEC = {"argv": [""], "debug_argv": [""], "env": {}}
 
 def censored_spec(spec: LanguageServerSpec) -> LanguageServerSpec:
     return {k: SKIP_JSON_SPEC.get(k, v) for k, v in spec.items()}
+
+
+def with_config_schema(key: Text, spec: LanguageServerSpec) -> LanguageServerSpec:
+    """add the client configuration schema shipped for a language server, unless
+    it has one
+    """
+    if "config_schema" in spec:
+        return spec
+    config_schema = bundled_config_schema(key)
+    if config_schema is None:
+        return spec
+    return cast(LanguageServerSpec, {**spec, "config_schema": config_schema})
@@ -13,18 +13,141 @@ import asyncio
 import io
 import os
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Optional, Text
+from typing import Callable, Iterator, List, Optional, Text, Tuple, Union
 
 from tornado.concurrent import run_on_executor
 from tornado.gen import convert_yielded
-from tornado.httputil import HTTPHeaders
 from tornado.ioloop import IOLoop
 from tornado.queues import Queue
-from traitlets import Float, Instance, default
+from traitlets import Any, Bool, Float, Instance, Int, default
 from traitlets.config import LoggingConfigurable
 
 from .non_blocking import make_non_blocking
 
+#: how a session talks to the stdio of its language server, unless the spec says
+#: otherwise: the pipe transport relies on the event loop watching the pipes,
+#: which is not available for anonymous pipes on windows
+DEFAULT_STDIO_TRANSPORT = "polling" if os.name == "nt" else "pipe"
+
+#: the most bytes to take from the pipe at once
+READ_CHUNK_SIZE = 2**16
+
+# vectored writes are not available everywhere, and are limited in length
+HAS_WRITEV = hasattr(os, "writev")
+IOV_MAX = (
+    os.sysconf("SC_IOV_MAX")
+    if "SC_IOV_MAX" in getattr(os, "sysconf_names", {})
+    else 1024
+)
+
+# bytes that may (incorrectly, but harmlessly) appear between messages
+INTERSTITIAL = b" \t\r\n"
+
+
+class LspMessageFramer:
+    """Incrementally split a byte stream into Language Server Protocol messages
+
+    Data is appended to a single, reused ``bytearray``: headers are found in
+    place, and message bodies are handed out as ``memoryview`` slices, which
+    are only guaranteed to be valid until the next call to ``feed``.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # where the unconsumed part of the buffer starts
+        self._start = 0
+        # (body start, content length) of a message whose body is incomplete
+        self._pending: Optional[Tuple[int, int]] = None
+
+    def feed(self, data: bytes) -> None:
+        """add more data from the stream"""
+        if self._start:
+            try:
+                del self.buffer[: self._start]
+            except BufferError:
+                # a consumer still holds a view: leave the old buffer to them
+                self.buffer = self.buffer[self._start :]
+            if self._pending:
+                body_start, length = self._pending
+                self._pending = (body_start - self._start, length)
+            self._start = 0
+        self.buffer += data
+
+    def __iter__(self) -> Iterator[memoryview]:
+        """yield all of the complete messages that have been fed"""
+        while True:
+            body = self._next_body()
+            if body is None:
+                return
+            yield body
+
+    def messages(self, data: bytes) -> List[bytes]:
+        """add more data from the stream, and copy out the messages it completes
+
+        No view of the buffer outlives this call, so the next can reuse it.
+        """
+        self.feed(data)
+        return [bytes(body) for body in self]
+
+    def _next_body(self) -> Optional[memoryview]:
+        buffer = self.buffer
+
+        if self._pending is None:
+            start = self._start
+            size = len(buffer)
+
+            while start < size and buffer[start] in INTERSTITIAL:
+                start += 1
+            self._start = start
+
+            header_end = self._find_header_end(start)
+            if header_end is None:
+                return None
+
+            header_end, body_start = header_end
+            length = self._content_length(buffer[start:header_end])
+            if not length:
+                # nothing usable in this header block: skip it
+                self._start = body_start
+                return self._next_body()
+
+            self._pending = (body_start, length)
+
+        body_start, length = self._pending
+
+        if len(buffer) - body_start < length:
+            return None
+
+        self._pending = None
+        self._start = body_start + length
+        return memoryview(buffer)[body_start : self._start]
+
+    def _find_header_end(self, start: int) -> Optional[Tuple[int, int]]:
+        """find where the headers end, and where the body starts
+
+        Strictly, headers end with ``\\r\\n\\r\\n``, but bare newlines are
+        also accepted.
+        """
+        crlf = self.buffer.find(b"\r\n\r\n", start)
+        lf = self.buffer.find(b"\n\n", start, None if crlf == -1 else crlf)
+
+        if lf != -1:
+            return lf, lf + 2
+        if crlf != -1:
+            return crlf, crlf + 4
+        return None
+
+    @staticmethod
+    def _content_length(headers: bytes) -> int:
+        for line in headers.splitlines():
+            name, colon, value = line.partition(b":")
+            if colon and name.strip().lower() == b"content-length":
+                try:
+                    return int(value)
+                except ValueError:  # pragma: no cover
+                    return 0
+        return 0
+
 
 class LspStdIoBase(LoggingConfigurable):
     """Non-blocking, queued base for communicating with stdio Language Servers"""
@@ -49,6 +172,24 @@ class LspStdIoBase(LoggingConfigurable):
         self.log.debug("%s closed", self)
 
 
+class LspStdIoPipeBase(LspStdIoBase):
+    """Event-driven base for communicating with stdio Language Servers, using
+    the event loop's pipe transports instead of a thread and polling
+    """
+
+    transport = Any(help="the asyncio pipe transport, once connected")
+
+    def close(self):
+        if self.transport is not None:
+            try:
+                self.transport.close()
+            except RuntimeError:
+                # the event loop has already closed, e.g. at exit
+                pass
+            self.transport = None
+        super().close()
+
+
 class LspStdIoReader(LspStdIoBase):
     """Language Server stdio Reader
 
@@ -60,6 +201,9 @@ class LspStdIoReader(LspStdIoBase):
     min_wait = Float(0.05, help="minimum time to wait on idle stream").tag(config=True)
     next_wait = Float(0.05, help="next time to wait on idle stream").tag(config=True)
 
+    framer = Instance(LspMessageFramer, args=())
+    paused = Bool(False, help="whether reading is paused, e.g. for backpressure")
+
     @default("max_wait")
     def _default_max_wait(self):
         return 0.1 if os.name == "nt" else self.min_wait * 2
@@ -78,6 +222,13 @@ class LspStdIoReader(LspStdIoBase):
         """Reset the wait time"""
         self.wait = self.min_wait
 
+    def pause(self):
+        """Stop taking data from the stream until resumed"""
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
     async def read(self) -> None:
         """Read from a Language Server until it is closed"""
         make_non_blocking(self.stream)
@@ -85,119 +236,212 @@ class LspStdIoReader(LspStdIoBase):
         while not self.stream.closed:
             message = None
             try:
-                message = await self.read_one()
+                if self.paused:
+                    await self.sleep()
+                    continue
+
+                chunk = self._read_chunk()
 
-                if not message:
+                if chunk == b"":
+                    # the language server has closed its stdout, e.g. by exiting
+                    break
+                elif not chunk:
                     await self.sleep()
                     continue
                 else:
                     self.wake()
 
-                IOLoop.current().add_callback(self.queue.put_nowait, message)
+                for message in self.framer.messages(chunk):
+                    IOLoop.current().add_callback(self.queue.put_nowait, message)
             except Exception as e:  # pragma: no cover
                 self.log.exception(
                     "%s couldn't enqueue message: %s (%s)", self, message, e
                 )
                 await self.sleep()
 
-    async def _read_content(
-        self, length: int, max_parts=1000, max_empties=200
-    ) -> Optional[bytes]:
-        """Read the full length of the message unless exceeding max_parts or
-           max_empties empty reads occur.
+    def _read_chunk(self) -> Optional[bytes]:
+        """Read whatever is available (or immediately return None)"""
+        try:
+            return self.stream.read(READ_CHUNK_SIZE)
+        except OSError:  # pragma: no cover
+            return None
 
-        See https://github.com/jupyter-lsp/jupyterlab-lsp/issues/450
 
-        Crucial docs or read():
-            "If the argument is positive, and the underlying raw
-             stream is not interactive, multiple raw reads may be issued
-             to satisfy the byte count (unless EOF is reached first)"
+class LspStdIoWriterBase(LspStdIoBase):
+    """Shared batching and framing for Language Server stdio Writers
 
-        Args:
-           - length: the content length
-           - max_parts: prevent absurdly long messages (1000 parts is several MBs):
-             1 part is usually sufficient but not enough for some long
-             messages 2 or 3 parts are often needed.
-        """
-        raw = None
-        raw_parts: List[bytes] = []
-        received_size = 0
-        while received_size < length and len(raw_parts) < max_parts and max_empties > 0:
-            part = None
+    Everything waiting in the queue is framed and written together, with each
+    body encoded only once.
+    """
+
+    messages_written = Int(0, help="how many messages have been written")
+    batches_written = Int(0, help="how many batches of messages have been written")
+    bytes_written = Int(0, help="how many bytes, including headers, were written")
+    last_batch_size = Int(0, help="how many messages were in the last batch")
+    max_batch_size = Int(0, help="the most messages that were in one batch")
+
+    async def next_batch(self) -> List[Union[Text, bytes]]:
+        """wait for a message, then take any others that are already queued"""
+        batch = [await self.queue.get()]
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    def frame(self, batch: List[Union[Text, bytes]]) -> List[bytes]:
+        """get the headers and bodies of a batch of messages, ready to write"""
+        parts = []
+        for message in batch:
+            body = message.encode("utf-8") if isinstance(message, str) else message
+            parts += [b"Content-Length: %d\r\n\r\n" % len(body), body]
+        return parts
+
+    def batch_done(self, batch: List[Union[Text, bytes]], parts: List[bytes]):
+        """update the counters, and mark the messages as done in the queue"""
+        size = len(batch)
+        self.messages_written += size
+        self.batches_written += 1
+        self.bytes_written += sum(map(len, parts))
+        self.last_batch_size = size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.queue_done(batch)
+
+    def queue_done(self, batch: List[Union[Text, bytes]]):
+        for _ in batch:
+            self.queue.task_done()
+
+
+class LspStdIoWriter(LspStdIoWriterBase):
+    """Language Server stdio Writer"""
+
+    async def write(self) -> None:
+        """Write to a Language Server until it closes"""
+        while not self.stream.closed:
+            batch = await self.next_batch()
             try:
-                part = self.stream.read(length - received_size)
-            except OSError:  # pragma: no cover
-                pass
-            if part is None:
-                max_empties -= 1
-                await self.sleep()
-                continue
-            received_size += len(part)
-            raw_parts.append(part)
-
-        if raw_parts:
-            raw = b"".join(raw_parts)
-            if len(raw) != length:  # pragma: no cover
-                self.log.warning(
-                    f"Readout and content-length mismatch: {len(raw)} vs {length};"
-                    f"remaining empties: {max_empties}; remaining parts: {max_parts}"
-                )
+                parts = self.frame(batch)
+                await convert_yielded(self._write_parts(parts))
+                self.batch_done(batch, parts)
+            except Exception:  # pragma: no cover
+                self.log.exception("%s couldn't write messages: %s", self, batch)
+                self.queue_done(batch)
 
-        return raw
+    @run_on_executor
+    def _write_parts(self, parts: List[bytes]) -> None:
+        if not HAS_WRITEV:  # pragma: no cover
+            self.stream.write(b"".join(parts))
+            self.stream.flush()
+            return
 
-    async def read_one(self) -> Text:
-        """Read a single message"""
-        message = ""
-        headers = HTTPHeaders()
+        fileno = self.stream.fileno()
+        views = [memoryview(part) for part in parts]
 
-        line = await convert_yielded(self._readline())
+        while views:
+            written = os.writev(fileno, views[:IOV_MAX])
+            # drop whatever was fully written, and trim a partially-written part
+            while views and written >= len(views[0]):
+                written -= len(views.pop(0))
+            if written:
+                views[0] = views[0][written:]
 
-        if line:
-            while line and line.strip():
-                headers.parse_line(line)
-                line = await convert_yielded(self._readline())
 
-            content_length = int(headers.get("content-length", "0"))
+class LspPipeReadProtocol(asyncio.Protocol):
+    """Frames messages as soon as the event loop reports data on the pipe"""
 
-            if content_length:
-                raw = await self._read_content(length=content_length)
-                if raw is not None:
-                    message = raw.decode("utf-8").strip()
-                else:  # pragma: no cover
-                    self.log.warning(
-                        "%s failed to read message of length %s",
-                        self,
-                        content_length,
-                    )
+    def __init__(self, on_message: Callable[[bytes], None]):
+        self.on_message = on_message
+        self.framer = LspMessageFramer()
+        self.closed = asyncio.get_running_loop().create_future()
 
-        return message
+    def data_received(self, data: bytes):
+        for message in self.framer.messages(data):
+            self.on_message(message)
 
-    @run_on_executor
-    def _readline(self) -> Text:
-        """Read a line (or immediately return None)"""
+    def eof_received(self):
+        # let the transport close itself
+        return False
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+class LspStdIoPipeReader(LspStdIoPipeBase):
+    """Language Server stdio Reader, woken by the event loop when data arrives"""
+
+    paused = Bool(False, help="whether reading is paused, e.g. for backpressure")
+
+    async def read(self) -> None:
+        """Read from a Language Server until it is closed"""
+        loop = asyncio.get_running_loop()
+        self.transport, protocol = await loop.connect_read_pipe(
+            lambda: LspPipeReadProtocol(self.on_message), self.stream
+        )
+        if self.paused:
+            self.transport.pause_reading()
+        await protocol.closed
+
+    def pause(self):
+        """Stop the event loop from watching the pipe until resumed"""
+        self.paused = True
+        if self.transport is not None:
+            self.transport.pause_reading()
+
+    def resume(self):
+        self.paused = False
+        if self.transport is not None:
+            self.transport.resume_reading()
+
+    def on_message(self, message: bytes) -> None:
         try:
-            return self.stream.readline().decode("utf-8").strip()
-        except OSError:  # pragma: no cover
-            return ""
+            self.queue.put_nowait(message)
+        except Exception as e:  # pragma: no cover
+            self.log.exception("%s couldn't enqueue message: %s (%s)", self, message, e)
 
 
-class LspStdIoWriter(LspStdIoBase):
-    """Language Server stdio Writer"""
+class LspPipeWriteProtocol(asyncio.Protocol):
+    """Tracks whether the pipe can accept more data, as reported by the transport"""
+
+    def __init__(self):
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def pause_writing(self):
+        self._writable.clear()
+
+    def resume_writing(self):
+        self._writable.set()
+
+    def connection_lost(self, exc):
+        # don't leave anyone waiting on a pipe that is gone
+        self._writable.set()
+
+    async def drain(self):
+        """wait until the transport buffer is below its high-water mark"""
+        await self._writable.wait()
+
+
+class LspStdIoPipeWriter(LspStdIoWriterBase, LspStdIoPipeBase):
+    """Language Server stdio Writer, which hands messages to the event loop's
+    pipe transport rather than a thread
+    """
+
+    protocol = Instance(asyncio.BaseProtocol, allow_none=True)
 
     async def write(self) -> None:
         """Write to a Language Server until it closes"""
-        while not self.stream.closed:
-            message = await self.queue.get()
+        loop = asyncio.get_running_loop()
+        transport, self.protocol = await loop.connect_write_pipe(
+            LspPipeWriteProtocol, self.stream
+        )
+        self.transport = transport
+
+        while not transport.is_closing():
+            batch = await self.next_batch()
             try:
-                body = message.encode("utf-8")
-                response = "Content-Length: {}\r\n\r\n{}".format(len(body), message)
-                await convert_yielded(self._write_one(response.encode("utf-8")))
+                parts = self.frame(batch)
+                transport.writelines(parts)
+                self.batch_done(batch, parts)
+                await self.protocol.drain()
             except Exception:  # pragma: no cover
-                self.log.exception("%s couldn't write message: %s", self, response)
-            finally:
-                self.queue.task_done()
-
-    @run_on_executor
-    def _write_one(self, message) -> None:
-        self.stream.write(message)
-        self.stream.flush()
+                self.log.exception("%s couldn't write messages: %s", self, batch)
+                self.queue_done(batch)
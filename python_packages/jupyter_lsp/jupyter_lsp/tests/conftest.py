@@ -50,6 +50,14 @@ def extra_node_roots():
     return dict(extra_node_roots=[str(root)] if root else [])
 
 
+@fixture(autouse=True)
+def jupyter_data_dir(tmp_path_factory, monkeypatch) -> pathlib.Path:
+    """keep anything written to the jupyter data dir, e.g. autodetection, apart"""
+    data_dir = tmp_path_factory.mktemp("data")
+    monkeypatch.setenv("JUPYTER_DATA_DIR", f"{data_dir}")
+    return data_dir
+
+
 @fixture
 def manager() -> LanguageServerManager:
     return LanguageServerManager(**extra_node_roots())
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from ..codec import CODECS, JsonCodec, get_codec, peek_id
+from ..manager import LanguageServerManager
+
+MESSAGE = {"jsonrpc": "2.0", "id": 1, "result": {"contents": "ünïcode"}}
+
+
+def available_codecs():
+    for name in CODECS:
+        try:
+            yield get_codec(name)
+        except ImportError:
+            continue
+
+
+@pytest.mark.parametrize("codec", list(available_codecs()), ids=lambda c: c.name)
+def test_round_trip(codec):
+    dumped = codec.dumps(MESSAGE)
+    assert isinstance(dumped, bytes)
+    assert json.loads(dumped) == MESSAGE
+    assert codec.loads(dumped) == MESSAGE
+    assert codec.loads(dumped.decode("utf-8")) == MESSAGE
+    assert codec.loads(bytearray(dumped)) == MESSAGE
+
+    with pytest.raises(ValueError):
+        codec.loads(b"{not json")
+
+
+def test_auto_codec():
+    assert get_codec("json").name == "json"
+    assert get_codec().name == next(iter(available_codecs())).name
+
+
+def test_unavailable_codec(monkeypatch):
+    monkeypatch.setitem(CODECS, "json", type("Broken", (JsonCodec,), {}))
+
+    def unavailable(self):
+        raise ImportError("not installed")
+
+    monkeypatch.setattr(CODECS["json"], "__init__", unavailable)
+
+    manager = LanguageServerManager(json_codec="json")
+    assert type(manager.codec) is JsonCodec
+
+    manager.json_codec = "auto"
+    assert manager.codec.name == get_codec().name
+
+
+@pytest.mark.parametrize(
+    "message,expected",
+    [
+        [b'{"jsonrpc":"2.0","id":12,"result":null}', (22, 24, 12)],
+        ['{"id": 3, "result": {"id": 4}}', (7, 8, 3)],
+        # an id after the result would have to be parsed to be found
+        ['{"result": {"id": 4}, "id": 3}', None],
+        ['{"id": "a", "result": null}', None],
+    ],
+)
+def test_peek_id(message, expected):
+    assert peek_id(message) == expected
@@ -1,5 +1,18 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from jupyter_lsp import LanguageServerManager, autodetect_cache
+from jupyter_lsp import manager as manager_module
+from jupyter_lsp.schema import SERVERS_RESPONSE
 from jupyter_lsp.specs.r_languageserver import RLanguageServer
-from jupyter_lsp.specs.utils import PythonModuleSpec
+from jupyter_lsp.specs.utils import PythonModuleSpec, ShellSpec
 
 
 def test_no_detect(manager):
@@ -39,3 +52,289 @@ def test_missing_python_module_spec():
 
     # we ant the spec even when not installed
     assert "languages" in not_installed_server(mgr=None)["a_module"]
+
+
+class FakeEntryPoint:
+    def __init__(self, name, spec_finder):
+        self.name = name
+        self.spec_finder = spec_finder
+
+    def load(self):
+        return self.spec_finder
+
+
+def make_spec_finder(key, delay=0.0, installed=True, argv=None, **spec):
+    def spec_finder(mgr):
+        time.sleep(delay)
+        return {
+            key: {"argv": argv or [key], "languages": ["python"], "version": 2, **spec}
+        }
+
+    spec_finder.is_installed = lambda mgr: installed  # type: ignore[attr-defined]
+    return spec_finder
+
+
+def test_detect_concurrently(manager, monkeypatch, caplog):
+    """are spec finders run at once, in one pass, and slow ones skipped?"""
+    eps = [
+        FakeEntryPoint("slow", make_spec_finder("slow", delay=2)),
+        *[
+            FakeEntryPoint(f"a{i}", make_spec_finder(f"a{i}", delay=0.2))
+            for i in range(4)
+        ],
+        FakeEntryPoint("missing", make_spec_finder("missing", installed=False)),
+    ]
+    monkeypatch.setattr(manager_module, "entry_points", lambda group: eps)
+    manager.autodetect_timeout = 0.5
+
+    started = time.monotonic()
+    with caplog.at_level(logging.INFO):
+        manager.initialize()
+    assert time.monotonic() - started < 1
+
+    assert sorted(manager.language_servers) == ["a0", "a1", "a2", "a3"]
+    assert sorted(manager.all_language_servers) == ["a0", "a1", "a2", "a3", "missing"]
+    assert "`slow`, not detected within 0.5s" in caplog.text
+    assert "Skipped non-installed server(s): missing" in caplog.text
+    # the slow one is still running, but would not hold up exit
+    detecting = [t for t in threading.enumerate() if t.name.startswith("jupyter_lsp")]
+    assert detecting and all(t.daemon for t in detecting)
+
+
+def test_detect_command_timeout(manager, monkeypatch, caplog, jupyter_data_dir):
+    """is a spec whose installation check times out skipped, and detected again
+    on the next start, rather than kept as not installed?
+    """
+
+    class SlowCommand(ShellSpec):
+        key = cmd = "sleep"
+        is_installed_args = ["1"]
+        is_installed_timeout = 0.2
+        languages = ["python"]
+        spec = dict(version=2)
+
+    eps = [FakeEntryPoint("slow", SlowCommand())]
+    monkeypatch.setattr(manager_module, "entry_points", lambda group: eps)
+    manager.autodetect_timeout = 5
+
+    with caplog.at_level(logging.WARNING):
+        manager.init_language_servers()
+    assert "sleep" not in manager.all_language_servers
+    assert "`slow`, not detected within 0.2s" in caplog.text
+    assert not Path(manager.autodetect_cache_path).exists()
+
+
+def counting_eps(calls):
+    def spec_finder(mgr):
+        calls.append("a")
+        return {"a": {"argv": ["a"], "languages": ["python"], "version": 2}}
+
+    return [FakeEntryPoint("a", spec_finder)]
+
+
+def test_autodetect_cache(monkeypatch, jupyter_data_dir):
+    """is autodetection reused until the environment changes, unless bypassed?"""
+    calls = []
+    eps = counting_eps(calls)
+    monkeypatch.setattr(manager_module, "entry_points", lambda group: eps)
+
+    def detect(**kwargs):
+        manager = LanguageServerManager(**kwargs)
+        manager.init_language_servers()
+        assert sorted(manager.language_servers) == ["a"]
+        return manager
+
+    cold = detect()
+    assert (jupyter_data_dir / "lsp" / "autodetect_cache.json").exists()
+
+    # a warm start runs no spec finders, nor looks for node_modules
+    warm = detect()
+    assert calls == ["a"]
+    assert warm.node_roots == [str(root) for root in cold.node_roots]
+
+    monkeypatch.setenv("PATH", os.pathsep.join([os.environ["PATH"], "/nowhere"]))
+    detect()
+    assert calls == ["a", "a"]
+
+    detect(extra_node_roots=["/somewhere/else"])
+    assert len(calls) == 3
+
+    detect(autodetect_cache=False)
+    detect(autodetect_cache=False)
+    assert len(calls) == 5
+
+
+@pytest.mark.parametrize("entry_point", ["a", autodetect_cache.R_ENTRY_POINT])
+def test_autodetect_cache_installed(monkeypatch, tmp_path, entry_point):
+    """is autodetection forgotten when a command is installed on ``PATH``, or
+    (for R) a package in an R library?
+    """
+    calls = []
+    eps = counting_eps(calls)
+    eps[0].name = entry_point
+    monkeypatch.setattr(manager_module, "entry_points", lambda group: eps)
+    bin_dir, r_library = tmp_path / "bin", tmp_path / "library"
+    bin_dir.mkdir()
+    r_library.mkdir()
+    monkeypatch.setenv("PATH", os.pathsep.join([os.environ["PATH"], str(bin_dir)]))
+    monkeypatch.setenv("R_LIBS", str(r_library))
+    cache_path = tmp_path / "cache.json"
+
+    def detect():
+        LanguageServerManager(
+            autodetect_cache_path=f"{cache_path}"
+        ).init_language_servers()
+
+    def install(path):
+        os.utime(path, (time.time() + 10, time.time() + 10))
+
+    detect()
+    detect()
+    assert len(calls) == 1
+
+    install(bin_dir)
+    detect()
+    detect()
+    assert len(calls) == 2
+
+    install(r_library)
+    detect()
+    assert len(calls) == (3 if entry_point == autodetect_cache.R_ENTRY_POINT else 2)
+
+
+def test_autodetect_cache_node_modules(monkeypatch, tmp_path):
+    """is autodetection forgotten when node modules are installed, or removed?"""
+    calls = []
+    eps = counting_eps(calls)
+    monkeypatch.setattr(manager_module, "entry_points", lambda group: eps)
+    cache_path = tmp_path / "cache.json"
+
+    def detect():
+        LanguageServerManager(
+            node_roots=[],
+            extra_node_roots=[str(tmp_path)],
+            autodetect_cache_path=f"{cache_path}",
+        ).init_language_servers()
+
+    detect()
+    detect()
+    assert len(calls) == 1
+
+    (tmp_path / "node_modules").mkdir()
+    detect()
+    detect()
+    assert len(calls) == 2
+
+    # an unreadable cache is detected again
+    cache_path.write_text("{not json")
+    detect()
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_ready_per_server(handlers, monkeypatch):
+    """is each language server ready as soon as it is detected?"""
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.autodetect_cache = False
+    eps = [
+        FakeEntryPoint("fast", make_spec_finder("fast", argv=["echo", "fast"])),
+        FakeEntryPoint("slow", make_spec_finder("slow", delay=1)),
+    ]
+    monkeypatch.setattr(manager_module, "entry_points", lambda group: eps)
+
+    loop = asyncio.get_running_loop()
+    initialized = loop.run_in_executor(None, manager.initialize)
+    unknown = asyncio.ensure_future(manager.ready("unknown"))
+
+    await asyncio.wait_for(ws_handler.open("fast"), 0.5)
+    assert not manager.is_ready
+    assert manager.sessions["fast"].handlers == {ws_handler}
+
+    handler.request.arguments["partial"] = [b"1"]
+    await asyncio.wait_for(handler.get(), 0.5)
+    payload = handler._payload
+    assert not list(SERVERS_RESPONSE.iter_errors(payload))
+    assert payload["ready"] is False
+    assert sorted(payload["sessions"]) == ["fast"]
+    assert not unknown.done()
+
+    await asyncio.wait_for(manager.ready("slow"), 2)
+    await initialized
+    await asyncio.wait_for(unknown, 0.1)
+    assert manager.is_ready
+    assert sorted(manager.sessions) == ["fast", "slow"]
+    assert manager.sessions["fast"].handlers == {ws_handler}
+    ws_handler.on_close()
+
+
+@pytest.mark.asyncio
+async def test_ready_after_setup(manager, monkeypatch):
+    """is a language server which needs, e.g., the shadow filesystem not ready
+    before it is set up, while the others are?
+    """
+    eps = [FakeEntryPoint(key, make_spec_finder(key)) for key in ["fast", "held"]]
+    monkeypatch.setattr(manager_module, "entry_points", lambda group: eps)
+    set_up = asyncio.get_running_loop().create_future()
+    setups = []
+
+    def setup():
+        setups.append(set_up)
+        return set_up
+
+    manager.hold_ready(setup, needs=lambda language_server: language_server == "held")
+    manager.initialize()
+
+    await asyncio.wait_for(manager.ready("fast"), 0.5)
+    assert not setups
+
+    waiting = [asyncio.ensure_future(manager.ready(key)) for key in ["held", None]]
+    await asyncio.sleep(0.05)
+    assert not any(waiter.done() for waiter in waiting)
+    assert not manager.is_ready
+
+    set_up.set_result(None)
+    assert await asyncio.wait_for(asyncio.gather(*waiting), 0.5) == [True, True]
+    assert manager.is_ready
+    # the setup is only started once
+    assert len(setups) == 1
+
+
+@pytest.mark.asyncio
+async def test_ready_with_shadow_filesystem(manager, monkeypatch, tmp_path):
+    """does the server extension make each language server ready as soon as it
+    is detected and, for those which read documents from disk, the virtual
+    documents directory exists?
+    """
+    from tornado.ioloop import IOLoop
+
+    from jupyter_lsp import serverextension
+
+    manager.autodetect_cache = False
+    eps = [
+        FakeEntryPoint(
+            "memory", make_spec_finder("memory", requires_documents_on_disk=False)
+        ),
+        FakeEntryPoint("disk", make_spec_finder("disk")),
+        FakeEntryPoint("slow", make_spec_finder("slow", delay=1)),
+    ]
+    monkeypatch.setattr(manager_module, "entry_points", lambda group: eps)
+    virtual_documents = tmp_path / ".virtual_documents"
+    nbapp = SimpleNamespace(
+        language_server_manager=manager, io_loop=IOLoop.current(), log=manager.log
+    )
+
+    initialized = asyncio.ensure_future(
+        serverextension.initialize(nbapp, virtual_documents.as_uri())
+    )
+
+    await asyncio.wait_for(manager.ready("memory"), 0.5)
+    assert not virtual_documents.exists()
+
+    await asyncio.wait_for(manager.ready("disk"), 0.5)
+    assert virtual_documents.is_dir()
+    assert not manager.is_ready
+
+    await asyncio.wait_for(initialized, 2)
+    assert manager.is_ready
+    assert sorted(manager.sessions) == ["disk", "memory", "slow"]
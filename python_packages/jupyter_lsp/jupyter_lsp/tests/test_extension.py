@@ -1,3 +1,4 @@
+import asyncio
 import os
 
 import pytest
@@ -25,6 +26,28 @@ def test_serverextension(app):
     assert found_lsp, "apparently didn't install the /lsp/ route"
 
 
+@pytest.mark.asyncio
+async def test_shutdown_with_server(app, monkeypatch):
+    """are language servers shut down before the server's extensions are?"""
+    app.initialize(
+        ["--ServerApp.jpserver_extensions={'jupyter_lsp.serverextension': True}"]
+    )
+    called = []
+
+    async def shutdown():
+        called.append("shutdown")
+
+    monkeypatch.setattr(app.language_server_manager, "shutdown", shutdown)
+    monkeypatch.setattr(
+        app.extension_manager,
+        "stop_all_extensions",
+        lambda: called.append("extensions") or asyncio.sleep(0),
+    )
+
+    await app.cleanup_extensions()
+    assert called == ["shutdown", "extensions"]
+
+
 def test_default_virtual_documents_dir(app):
     app.initialize(
         ["--ServerApp.jpserver_extensions={'jupyter_lsp.serverextension': True}"]
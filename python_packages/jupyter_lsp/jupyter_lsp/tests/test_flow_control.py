@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from ..flow_control import FlowControl, FlowControlledQueue, KeyedQueue
+
+
+@pytest.mark.asyncio
+async def test_watermarks():
+    events = []
+    flow = FlowControl(
+        3,
+        1,
+        on_pause=lambda: events.append("pause"),
+        on_resume=lambda: events.append("resume"),
+    )
+    queue = FlowControlledQueue(flow)
+
+    for i in range(5):
+        queue.put_nowait(i)
+
+    assert flow.paused
+    assert events == ["pause"]
+
+    waiter = asyncio.ensure_future(flow.wait())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    # still above the low watermark
+    queue.get_nowait()
+    queue.get_nowait()
+    queue.get_nowait()
+    assert flow.paused
+
+    queue.get_nowait()
+    assert not flow.paused
+    assert events == ["pause", "resume"]
+    await asyncio.wait_for(waiter, 1)
+
+    stats = flow.to_json()
+    assert stats["depth"] == 1
+    assert stats["paused"] is False
+    assert stats["paused_seconds"] > 0
+
+
+@pytest.mark.asyncio
+async def test_disabled():
+    flow = FlowControl(0, 0)
+    queue = FlowControlledQueue(flow)
+
+    for i in range(1000):
+        queue.put_nowait(i)
+
+    assert not flow.paused
+    await asyncio.wait_for(flow.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_keyed_queue():
+    queue = KeyedQueue(max_keys=2)
+    events = []
+    gates = {key: asyncio.Event() for key in "ab"}
+
+    async def work(key, i):
+        events.append(f"{key}{i} start")
+        await gates[key].wait()
+        events.append(f"{key}{i} end")
+        return i
+
+    tasks = [
+        asyncio.ensure_future(queue.run(key, lambda key=key, i=i: work(key, i)))
+        for i in range(2)
+        for key in "ab"
+    ]
+    await asyncio.sleep(0.05)
+    # different keys run concurrently, the same key in order
+    assert events == ["a0 start", "b0 start"]
+    assert "a" in queue and len(queue) == 2
+    assert queue.to_json()["a"]["depth"] == 2
+
+    gates["b"].set()
+    await asyncio.sleep(0)
+    gates["a"].set()
+    assert await asyncio.gather(*tasks) == [0, 0, 1, 1]
+    assert events.index("a0 end") < events.index("a1 start")
+    assert events.index("b0 end") < events.index("b1 start")
+    assert not len(queue)
+
+    stats = queue.to_json()
+    assert stats["a"]["count"] == 2
+    assert stats["a"]["depth"] == 0
+    # the second waited for the first, which did not wait
+    assert stats["a"]["last_seconds"] == stats["a"]["max_seconds"] >= 0.05
+    assert stats["a"]["mean_seconds"] == pytest.approx(
+        stats["a"]["max_seconds"] / 2, abs=0.01
+    )
+
+    # only the most recently used keys are kept
+    await queue.run("c", lambda: work("a", 2))
+    assert list(queue.to_json()) == ["a", "c"]
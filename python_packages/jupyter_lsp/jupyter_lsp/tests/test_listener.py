@@ -6,6 +6,8 @@ import traitlets
 from tornado.queues import Queue
 
 from jupyter_lsp import lsp_message_listener
+from jupyter_lsp.codec import peek_method
+from jupyter_lsp.types import ListenerRegistry, MessageScope
 
 
 @pytest.mark.parametrize("bad_string", ["not-a-function", "jupyter_lsp.__version__"])
@@ -116,3 +118,92 @@ async def test_listeners(known_server, handlers, jsonrpc_init_msg):
     assert not manager._listeners["server"]
     assert not manager._listeners["client"]
     assert len(manager._listeners["all"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_listener(handlers):
+    """is a message forwarded before a concurrent listener has finished?"""
+    handler, ws_handler = handlers
+    manager = handler.manager
+
+    observed = asyncio.Event()
+    finish = asyncio.Event()
+
+    @lsp_message_listener("client", method="textDocument/didChange", mode="concurrent")
+    async def slow_listener(scope, message, language_server, manager):
+        observed.set()
+        await finish.wait()
+
+    try:
+        message = '{"jsonrpc": "2.0", "method": "textDocument/didChange"}'
+        await asyncio.wait_for(
+            manager.wait_for_listeners(MessageScope.CLIENT, message, "pylsp"), 1
+        )
+        # it has started, but not finished
+        assert observed.is_set()
+        assert len(manager._listener_tasks) == 1
+        finish.set()
+        await asyncio.sleep(0.01)
+        assert not manager._listener_tasks
+    finally:
+        manager.unregister_message_listener(slow_listener)
+
+
+@pytest.mark.parametrize(
+    "message,expected",
+    [
+        ['{"jsonrpc": "2.0", "method": "initialized"}', (True, "initialized")],
+        ['{"id": 1, "method": "a/b", "params": {"method": "c"}}', (True, "a/b")],
+        ['{"id": 1, "result": null}', (True, None)],
+        # these have to be parsed to be sure
+        ['{"id": 1, "result": {"method": "a"}}', (False, None)],
+        ['{"params": {}, "method": "a"}', (False, None)],
+    ],
+)
+def test_peek_method(message, expected):
+    assert peek_method(message) == expected
+
+
+@pytest.mark.asyncio
+async def test_listener_index(handlers, monkeypatch):
+    """are messages only parsed when some listener wants them?"""
+    handler, ws_handler = handlers
+    manager = handler.manager
+
+    registry = ListenerRegistry({str(scope.value): [] for scope in MessageScope})
+    monkeypatch.setattr(manager.__class__, "_listeners", registry)
+
+    parsed = []
+    loads = manager.codec.loads
+    monkeypatch.setattr(
+        manager.codec, "loads", lambda message: parsed.append(message) or loads(message)
+    )
+
+    heard = []
+
+    for i in range(12):
+
+        @lsp_message_listener("client", method=f"custom/method{i}$")
+        async def listener(scope, message, language_server, manager):
+            heard.append(message)
+
+    async def send(message):
+        return await manager.wait_for_listeners(MessageScope.CLIENT, message, "pylsp")
+
+    for _ in range(3):
+        assert (
+            await send('{"jsonrpc": "2.0", "method": "textDocument/didChange"}') is None
+        )
+    assert not parsed
+    assert not heard
+    assert list(registry.index) == [("client", "pylsp", "textDocument/didChange")]
+
+    message = await send('{"jsonrpc": "2.0", "method": "custom/method11"}')
+    assert heard == [message] == [{"jsonrpc": "2.0", "method": "custom/method11"}]
+    assert len(parsed) == 1
+
+    # the index is rebuilt when listeners change
+    manager.unregister_message_listener(listener)
+    assert not registry.index
+    await send('{"jsonrpc": "2.0", "method": "custom/method11"}')
+    assert len(heard) == 1
@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+from .. import node_modules as node_modules_module
+from ..node_modules import NodeModulesIndex
+from ..specs.utils import NodeModuleSpec
+
+
+def install(root, package, *script):
+    path = root.joinpath("node_modules", package, *script)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("")
+    return path
+
+
+def backdate(root):
+    """make a node_modules look like it was last changed long ago"""
+    past = time.time() - 3600
+    for path in [root / "node_modules", *(root / "node_modules").glob("@*")]:
+        os.utime(path, (past, past))
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    listed = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        listed.append(str(path))
+        return scandir(path)
+
+    monkeypatch.setattr(node_modules_module.os, "scandir", counting_scandir)
+    return listed
+
+
+def test_find(tmp_path, scans):
+    first, second, empty = [tmp_path / name for name in "abc"]
+    install(first, "pyright", "langserver.index.js")
+    script = install(second, "bash-language-server", "out", "cli.js")
+    scoped = install(second, "@scope/server", "cli.js")
+    for root in [first, second]:
+        backdate(root)
+    scans.clear()
+
+    index = NodeModulesIndex(max_age=0)
+    roots = [empty, first, second]
+
+    assert index.find(roots, "bash-language-server", "out", "cli.js") == str(script)
+    assert index.find(roots, "@scope/server", "cli.js") == str(scoped)
+    assert index.find(roots, "@scope", "server", "cli.js") == str(scoped)
+    assert index.find(roots, "pyright", "missing.js") is None
+    assert index.find(roots, "missing", "cli.js") is None
+    assert index.packages(second) == {"bash-language-server", "@scope/server"}
+
+    # listed once (with the scope), unless changed, even if missing
+    assert len(scans) == 4
+    index.find(roots, "pyright", "langserver.index.js")
+    assert len(scans) == 4
+
+    added = install(first, "bash-language-server", "out", "cli.js")
+    assert index.find(roots, "bash-language-server", "out", "cli.js") == str(added)
+    install(second, "@scope/other", "cli.js")
+    assert "@scope/other" in index.packages(second)
+
+    # a node_modules which appears later is found
+    install(empty, "pyright", "langserver.index.js")
+    assert index.packages(empty) == {"pyright"}
+
+
+def test_max_age(tmp_path, scans):
+    root = tmp_path
+    install(root, "pyright", "langserver.index.js")
+    index = NodeModulesIndex(max_age=60)
+
+    assert index.packages(root) == {"pyright"}
+    install(root, "yaml-language-server", "bin", "yaml-language-server")
+    assert index.packages(root) == {"pyright"}
+    assert len(scans) == 1
+
+    index.max_age = 0
+    assert "yaml-language-server" in index.packages(root)
+
+
+class FakeSpec(NodeModuleSpec):
+    node_module = key = "fake-language-server"
+    script = ["cli.js"]
+    languages = ["python"]
+
+
+def test_spec_resolves_once(manager, tmp_path, scans, monkeypatch):
+    """do all the specs looking in the same roots share one listing of each?"""
+    install(tmp_path, "fake-language-server", "cli.js")
+    backdate(tmp_path)
+    scans.clear()
+    manager.node_roots = [tmp_path / "a", tmp_path / "b"]
+    manager.extra_node_roots = [tmp_path]
+    manager.nodejs = "node"
+
+    solved = []
+    solve = FakeSpec.solve
+    monkeypatch.setattr(
+        FakeSpec, "solve", lambda self, mgr: solved.append(1) or solve(self, mgr)
+    )
+
+    spec = FakeSpec()(manager)["fake-language-server"]
+    assert spec["argv"] == [
+        "node",
+        str(tmp_path / "node_modules/fake-language-server/cli.js"),
+    ]
+    assert len(solved) == 1
+
+    for _ in range(10):
+        FakeSpec()(manager)
+    assert len(scans) == 1
@@ -0,0 +1,161 @@
+import math
+import random
+import time
+
+import pytest
+
+from .. import rope as rope_module
+from ..rope import Rope
+
+
+def position(line, character):
+    return {"line": line, "character": character}
+
+
+def position_offset(text, position):
+    """the offset in ``text`` of an LSP ``Position``, by scanning its lines"""
+    start = 0
+    for _ in range(position["line"]):
+        newline = text.find("\n", start)
+        if newline == -1:
+            return len(text)
+        start = newline + 1
+    end = text.find("\n", start)
+    line_length = (len(text) if end == -1 else end) - start
+    return start + min(position["character"], line_length)
+
+
+def apply_content_changes(text, changes):
+    """apply ``contentChanges`` to the whole text, as a reference for ropes"""
+    for change in changes:
+        change_range = change.get("range")
+        if change_range is None:
+            text = change["text"]
+            continue
+        start = position_offset(text, change_range["start"])
+        end = position_offset(text, change_range["end"])
+        text = text[:start] + change["text"] + text[end:]
+    return text
+
+
+def test_rope():
+    rope = Rope(["import os", "os.getcwd()"])
+    assert len(rope) == 2
+    assert rope.length == 21
+    assert rope.line(1) == "os.getcwd()"
+    with pytest.raises(IndexError):
+        rope.line(2)
+
+    rope.replace(position(1, 3), position(1, 9), "path")
+    assert rope.text() == "import os\nos.path()"
+
+    # across lines, adding lines
+    rope.replace(position(0, 6), position(1, 2), "\nx = 1\ny = os")
+    assert list(rope) == ["import", "x = 1", "y = os.path()"]
+    assert rope.length == len(rope.text())
+
+    # past the end of a line, or of the document
+    rope.replace(position(0, 100), position(100, 0), "")
+    assert list(rope) == ["import"]
+
+    rope.replace(position(0, 0), position(0, 6), "")
+    assert list(rope) == [""]
+    assert rope.length == 0
+
+
+def random_change(text, rng):
+    lines = text.split("\n")
+    start_line = rng.randrange(len(lines))
+    end_line = rng.randrange(start_line, min(start_line + 3, len(lines)))
+    start = position(start_line, rng.randrange(len(lines[start_line]) + 2))
+    end = position(end_line, rng.randrange(len(lines[end_line]) + 2))
+    if end_line == start_line and end["character"] < start["character"]:
+        start, end = end, start
+    new_text = rng.choice(["", "x", "\n", "ab\ncd", "\n\n", "def f():\n    pass"])
+    return {"range": {"start": start, "end": end}, "text": new_text}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rope_edits(seed):
+    """does a rope agree with editing the text, for many changes?"""
+    rng = random.Random(seed)
+    text = "\n".join(f"line {i}" for i in range(50))
+    rope = Rope(text.split("\n"))
+
+    for _ in range(500):
+        change = random_change(text, rng)
+        text = apply_content_changes(text, [change])
+        rope.replace(change["range"]["start"], change["range"]["end"], change["text"])
+
+    assert rope.text() == text
+    assert rope.length == len(text)
+    assert len(rope) == text.count("\n") + 1
+
+
+def replace_lines(lines, start, end, text):
+    """replace a range of a list of lines, as shadow files were edited before,
+    returning the new lines, and how many lines were copied to make them
+    """
+    first = lines[start["line"]][: start["character"]]
+    last = lines[end["line"]][end["character"] :]
+    before, after = lines[: start["line"]], lines[end["line"] + 1 :]
+    replaced = before + (first + text + last).split("\n") + after
+    # sliced, then concatenated
+    return replaced, len(before) + len(after) + len(replaced)
+
+
+@pytest.fixture
+def updates(monkeypatch):
+    """count the nodes of ropes which are visited to rebalance them, with the
+    same priorities on every run
+    """
+    counted = []
+    update = rope_module._update
+
+    def counting_update(node):
+        counted.append(1)
+        return update(node)
+
+    monkeypatch.setattr(rope_module, "_update", counting_update)
+    monkeypatch.setattr(rope_module, "random", random.Random(0))
+    return counted
+
+
+def changes(lines, edits, seed=0):
+    rng = random.Random(seed)
+    for _ in range(edits):
+        line = rng.randrange(len(lines) - 1)
+        yield position(line, 2), position(line + 1, 0), "y\nz = "
+
+
+@pytest.mark.parametrize("size", [1_000, 100_000])
+def test_rope_benchmark(size, updates, record_property):
+    """does editing a rope visit O(log n) nodes, rather than copy every line, as
+    editing a list of lines did?
+    """
+    lines = [f"x_{i} = {i}" for i in range(size)]
+    edits = list(changes(lines, 200))
+    rope = Rope(lines)
+    updates.clear()
+
+    started = time.perf_counter()
+    for start, end, text in edits:
+        rope.replace(start, end, text)
+    record_property("rope_seconds", time.perf_counter() - started)
+
+    copied = 0
+    started = time.perf_counter()
+    for start, end, text in edits:
+        lines, copies = replace_lines(lines, start, end, text)
+        copied += copies
+    record_property("list_seconds", time.perf_counter() - started)
+
+    record_property("rope_visited_per_edit", len(updates) / len(edits))
+    record_property("list_copied_per_edit", copied / len(edits))
+
+    assert list(rope) == lines
+    # a few splits and merges, each as deep as the treap, of ~3 * log2(n)
+    assert len(updates) / len(edits) < 20 * math.log2(size)
+    # where a list copies (all but the two replaced) lines twice
+    assert copied >= 2 * (size - 1) * len(edits)
+    assert len(updates) * (size // 100) < copied
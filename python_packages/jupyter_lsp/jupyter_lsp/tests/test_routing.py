@@ -0,0 +1,319 @@
+import json
+
+from ..routing import MessageRouter
+
+
+def request(id_, method="textDocument/hover", **params):
+    return json.dumps({"jsonrpc": "2.0", "id": id_, "method": method, "params": params})
+
+
+def response(id_, result=None):
+    return json.dumps({"jsonrpc": "2.0", "id": id_, "result": result})
+
+
+def notification(method, **params):
+    return json.dumps({"jsonrpc": "2.0", "method": method, "params": params})
+
+
+def test_responses_go_to_the_requester():
+    router = MessageRouter()
+    handlers = ["a", "b"]
+
+    to_server_a = json.loads(router.from_client("a", request(1)))
+    to_server_b = json.loads(router.from_client("b", request(1)))
+    assert to_server_a["id"] != to_server_b["id"]
+    assert router.pending_requests == 2
+
+    targets, message = router.from_server(response(to_server_b["id"], "b"), handlers)
+    assert targets == ["b"]
+    assert json.loads(message) == json.loads(response(1, "b"))
+
+    targets, message = router.from_server(response(to_server_a["id"], "a"), handlers)
+    assert targets == ["a"]
+    assert json.loads(message)["result"] == "a"
+    assert not router.pending_requests
+
+
+def test_cancel_request():
+    router = MessageRouter()
+    proxy_id = json.loads(router.from_client("a", request("x")))["id"]
+
+    cancel = json.loads(
+        router.from_client("a", notification("$/cancelRequest", id="x"))
+    )
+    assert cancel["params"]["id"] == proxy_id
+
+    # not a request this handler made
+    assert router.from_client("b", notification("$/cancelRequest", id="x")) is None
+
+
+def test_document_notifications():
+    router = MessageRouter()
+    handlers = ["a", "b", "c"]
+    uri = "file:///a.py"
+
+    router.from_client(
+        "a", notification("textDocument/didOpen", textDocument={"uri": uri})
+    )
+    router.from_client(
+        "b", notification("textDocument/didOpen", textDocument={"uri": uri})
+    )
+
+    diagnostics = notification("textDocument/publishDiagnostics", uri=uri)
+    assert router.from_server(diagnostics, handlers)[0] == ["a", "b"]
+
+    router.from_client(
+        "b", notification("textDocument/didClose", textDocument={"uri": uri})
+    )
+    assert router.from_server(diagnostics, handlers)[0] == ["a"]
+
+    router.remove_handler("a")
+    assert router.from_server(diagnostics, handlers)[0] == []
+
+    # anything else goes to everyone
+    log = notification("window/logMessage", message="hi")
+    assert router.from_server(log, handlers) == (handlers, log)
+
+
+def test_server_requests_answered_once():
+    router = MessageRouter()
+    handlers = ["a", "b"]
+    server_request = request(7, "workspace/configuration")
+
+    assert router.from_server(server_request, handlers) == (handlers, server_request)
+    assert router.from_client("b", response(7)) == response(7)
+    assert router.from_client("a", response(7)) is None
+
+
+def test_response_id_replaced_in_place():
+    router = MessageRouter()
+    proxy_id = json.loads(router.from_client("a", request("original")))["id"]
+
+    # responses from a language server are bytes, and are not reparsed
+    big = b'{"jsonrpc":"2.0","id":%d,"result":{"data":[%s]}}' % (
+        proxy_id,
+        b",".join(b"%d" % i for i in range(10_000)),
+    )
+    router._parse = None
+
+    targets, message = router.from_server(big, ["a"])
+    assert targets == ["a"]
+    assert message == big.replace(b'"id":%d' % proxy_id, b'"id":"original"')
+    assert not router.pending_requests
+
+
+def test_shared_initialize():
+    router = MessageRouter()
+    replies = []
+    router.reply = lambda handler, message: replies.append(
+        (handler, json.loads(message))
+    )
+    handlers = ["a", "b", "c"]
+
+    to_server = json.loads(router.from_client("a", request(0, "initialize", a=1)))
+    assert router.initialize_params == {"a": 1}
+
+    # a second client while the first is in flight waits for the result
+    assert router.from_client("b", request(5, "initialize", b=1)) is None
+
+    targets, message = router.from_server(
+        response(to_server["id"], {"capabilities": {}}), handlers
+    )
+    assert targets == ["a"]
+    assert json.loads(message)["id"] == 0
+    assert replies == [("b", json.loads(response(5, {"capabilities": {}})))]
+
+    # a later client never reaches the server
+    assert router.from_client("c", request(9, "initialize")) is None
+    assert replies[-1] == ("c", json.loads(response(9, {"capabilities": {}})))
+
+    initialized = notification("initialized")
+    assert router.from_client("a", initialized) == initialized
+    assert router.from_client("b", initialized) is None
+
+    # a new process needs a new handshake, with the same params
+    router.reset()
+    assert router.initialize_result is None
+    assert router.initialize_params == {"a": 1}
+    assert router.from_client("c", request(10, "initialize")) is not None
+
+
+def test_open_documents():
+    router = MessageRouter()
+    uri = "file:///a.py"
+
+    router.from_client(
+        "a",
+        notification(
+            "textDocument/didOpen",
+            textDocument={"uri": uri, "languageId": "python", "version": 1, "text": ""},
+        ),
+    )
+    router.from_client(
+        "a",
+        notification(
+            "textDocument/didChange",
+            textDocument={"uri": uri, "version": 2},
+            contentChanges=[
+                {"text": "import os\nos.getcwd()\n"},
+                {
+                    "range": {
+                        "start": {"line": 1, "character": 3},
+                        "end": {"line": 1, "character": 9},
+                    },
+                    "text": "path",
+                },
+                {
+                    "range": {
+                        "start": {"line": 2, "character": 0},
+                        "end": {"line": 2, "character": 0},
+                    },
+                    "text": "x = 1",
+                },
+            ],
+        ),
+    )
+    assert router.open_documents() == [
+        {
+            "uri": uri,
+            "languageId": "python",
+            "version": 2,
+            "text": "import os\nos.path()\nx = 1",
+        }
+    ]
+
+    # kept for a new language server process
+    router.reset()
+    assert len(router.open_documents()) == 1
+
+    router.from_client(
+        "a", notification("textDocument/didClose", textDocument={"uri": uri})
+    )
+    assert router.open_documents() == []
+
+
+def test_unmatched_response_dropped():
+    router = MessageRouter()
+    handlers = ["a", "b"]
+    proxy_id = json.loads(router.from_client("a", request(1)))["id"]
+    router.remove_handler("a")
+
+    # b's own request may have the same id as a's proxy id
+    router.from_client("b", request(proxy_id))
+    assert router.from_server(response(proxy_id, "for a"), handlers)[0] == []
+    router._parse = None
+    assert router.from_server(response(proxy_id, "for a").encode(), handlers)[0] == []
+
+
+def test_initialize_requester_leaves():
+    """is the initialize result kept, when whoever asked for it has gone away?"""
+    router = MessageRouter()
+    replies = []
+    router.reply = lambda handler, message: replies.append(
+        (handler, json.loads(message))
+    )
+    result = {"capabilities": {}}
+
+    to_server = json.loads(router.from_client("a", request(0, "initialize")))
+    assert router.from_client("b", request(5, "initialize")) is None
+    assert router.from_client("c", request(6, "initialize")) is None
+
+    # the next websocket waiting takes over the request
+    router.remove_handler("a")
+    targets, message = router.from_server(response(to_server["id"], result), "bc")
+    assert targets == ["b"]
+    assert json.loads(message) == json.loads(response(5, result))
+    assert replies == [("c", json.loads(response(6, result)))]
+    assert router.initialize_result == result
+
+    # ...or else the proxy itself
+    router.reset()
+    to_server = json.loads(router.from_client("a", request(1, "initialize")))
+    router.remove_handler("a")
+    assert router.from_server(response(to_server["id"], result), "b")[0] == []
+    assert router.initialize_result == result
+    assert router.from_client("b", request(7, "initialize")) is None
+    assert replies[-1] == ("b", json.loads(response(7, result)))
+
+
+def test_prewarmed_for_others():
+    router = MessageRouter()
+    router.initialize_params = {"capabilities": {}, "rootUri": "file:///a"}
+    router.initialize_result = {"capabilities": {}}
+    router.prewarmed = True
+
+    def initialize(**params):
+        return json.loads(request(0, "initialize", rootUri="file:///a", **params))
+
+    richer = initialize(capabilities={"textDocument": {"hover": {}}})
+    assert not router.prewarmed_for_others(richer)
+    assert not router.prewarmed_for_others(json.loads(request(0)))
+    assert router.prewarmed_for_others(initialize(workspaceFolders=[]))
+    assert router.prewarmed_for_others(initialize(initializationOptions={"a": 1}))
+    assert router.prewarmed_for_others(
+        json.loads(request(0, "initialize", rootUri="file:///b"))
+    )
+
+    # the first client is answered, and its params used for a restart
+    router.from_client("a", json.dumps(richer))
+    assert not router.prewarmed
+    assert router.initialize_params == richer["params"]
+    assert not router.prewarmed_for_others(initialize(workspaceFolders=[]))
+
+
+def test_reset_answers_pending_requests():
+    """are requests in flight when a language server stops answered?"""
+    router = MessageRouter()
+    replies = []
+    router.reply = lambda handler, message: replies.append(
+        (handler, json.loads(message))
+    )
+    router.from_client("a", request(0, "initialize"))
+    router.from_client("b", request(1, "initialize"))
+    router.from_client("a", request("x"))
+
+    router.reset()
+    assert [(handler, reply["id"]) for handler, reply in replies] == [
+        ("a", 0),
+        ("a", "x"),
+        ("b", 1),
+    ]
+    assert {reply["error"]["code"] for _, reply in replies} == {-32800}
+    assert not router.pending_requests
+
+    router.reset()
+    assert len(replies) == 3
+
+
+def test_parsed_messages_unchanged():
+    """are messages which listeners may share left as they were?"""
+    router = MessageRouter()
+    parsed = json.loads(request("x"))
+    proxy_id = json.loads(router.from_client("a", request("x"), parsed))["id"]
+    assert parsed["id"] == "x"
+
+    cancel = json.loads(notification("$/cancelRequest", id="x"))
+    assert (
+        json.loads(router.from_client("a", json.dumps(cancel), cancel))["params"]["id"]
+        == proxy_id
+    )
+    assert cancel["params"]["id"] == "x"
+
+    parsed = json.loads(response(proxy_id))
+    router.from_server(response(proxy_id), ["a"], parsed)
+    assert parsed["id"] == proxy_id
+
+
+def test_remove_handler_left_open():
+    """are the documents a websocket left open, and only those, returned?"""
+    router = MessageRouter()
+    for handler, uri in [("a", "file:///a.py"), ("a", "file:///b.py"), ("b", "c")]:
+        router.from_client(
+            handler,
+            notification("textDocument/didOpen", textDocument={"uri": uri}),
+        )
+    router.from_client(
+        "a", notification("textDocument/didClose", textDocument={"uri": "file:///b.py"})
+    )
+    assert router.remove_handler("a") == ["file:///a.py"]
+    assert router.remove_handler("a") == []
@@ -0,0 +1,157 @@
+import json
+import subprocess
+import sys
+import time
+
+import pytest
+import traitlets
+
+from .. import schema
+from ..specs.config import CONFIGS, load_config_schema
+from ..trait_types import Schema
+
+FIRST_ACCESS = """
+import json
+import jupyter_lsp.specs
+from jupyter_lsp import schema
+from jupyter_lsp.specs.config import load_config_schema
+
+def cached():
+    return [
+        [info.hits, info.misses, info.currsize]
+        for info in [make_validator.cache_info(), load_config_schema.cache_info()]
+    ]
+
+make_validator = schema.make_validator
+imported = cached()
+for _ in range(2):
+    schema.LANGUAGE_SERVER_SPEC
+    load_config_schema("pylsp")
+print(json.dumps(dict(imported=imported, accessed=cached())))
+"""
+
+
+def test_loaded_on_first_access():
+    """are validators, and config schemas, left until they are first needed, in
+    a fresh process, which has the caches of its own?
+    """
+    cached = json.loads(subprocess.check_output([sys.executable, "-c", FIRST_ACCESS]))
+
+    # [hits, misses, currsize] of the validators, and of the config schemas
+    assert cached["imported"] == [[0, 0, 0], [0, 0, 0]]
+    assert cached["accessed"] == [[1, 1, 1], [1, 1, 1]]
+
+
+IMPORT = """
+import json
+import sys
+import jupyter_lsp
+import jupyter_lsp.specs
+
+print(json.dumps(["jsonschema" in sys.modules, "jupyter_lsp.schema" in sys.modules]))
+"""
+
+
+def test_not_loaded_on_import():
+    """is ``jsonschema`` left unimported by importing ``jupyter_lsp``, and its
+    spec finders, in a fresh process?
+    """
+    jsonschema_imported, schema_imported = json.loads(
+        subprocess.check_output([sys.executable, "-c", IMPORT])
+    )
+    # the module of the validators is imported, but makes none
+    assert schema_imported
+    assert not jsonschema_imported
+
+
+class CountingValidator:
+    def __init__(self):
+        self.validated = []
+
+    def iter_errors(self, value):
+        self.validated.append(value)
+        return iter(schema.LANGUAGE_SERVER_SPEC_MAP.iter_errors(value))
+
+
+class HasSpecs(traitlets.HasTraits):
+    specs = Schema(CountingValidator())
+
+
+def test_schema_validated_once():
+    """are equal values validated only once?"""
+    specs = {"a": {"argv": ["a"], "languages": ["python"], "version": 2}}
+    has_specs = HasSpecs()
+    validator = HasSpecs.specs.validator
+
+    has_specs.specs = specs
+    has_specs.specs = json.loads(json.dumps(specs))
+    assert len(validator.validated) == 1
+
+    specs["a"]["argv"] = ["b"]
+    has_specs.specs = specs
+    assert len(validator.validated) == 2
+
+    with pytest.raises(traitlets.TraitError):
+        has_specs.specs = {"a": {"argv": "not a list"}}
+    with pytest.raises(traitlets.TraitError):
+        has_specs.specs = {"a": {"argv": "not a list"}}
+    assert len(validator.validated) == 4
+
+
+def test_schema_digest_pays_off(record_property):
+    """is finding whether a large spec map was already validated much cheaper
+    than validating it again?
+    """
+    keys = [path.name.split(".")[0] for path in CONFIGS.glob("*.schema.json")]
+    specs = {
+        f"{key}-{i}": {
+            "argv": [key],
+            "languages": ["python"],
+            "version": 2,
+            "config_schema": load_config_schema(key),
+        }
+        for key in keys
+        for i in range(10)
+    }
+    trait = HasSpecs.specs
+
+    started = time.perf_counter()
+    for _ in range(5):
+        trait._digest(specs)
+    digest_seconds = (time.perf_counter() - started) / 5
+
+    started = time.perf_counter()
+    list(schema.LANGUAGE_SERVER_SPEC_MAP.iter_errors(specs))
+    validate_seconds = time.perf_counter() - started
+
+    record_property("digest_seconds", digest_seconds)
+    record_property("validate_seconds", validate_seconds)
+    assert digest_seconds * 2 < validate_seconds
+
+
+def test_lazy_validator():
+    class HasSpec(traitlets.HasTraits):
+        spec = Schema("LANGUAGE_SERVER_SPEC")
+
+    assert HasSpec.spec.validator is schema.LANGUAGE_SERVER_SPEC
+    with pytest.raises(AttributeError):
+        schema.NOT_A_VALIDATOR
+
+
+@pytest.mark.asyncio
+async def test_config_schema_served(handlers):
+    """is the config schema of a known language server only read for the status?"""
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.language_servers = {
+        "pylsp": {"argv": ["echo"], "languages": ["python"], "version": 2},
+        "custom": {"argv": ["echo"], "languages": ["python"], "version": 2},
+    }
+    manager.autodetect = False
+    manager.initialize()
+    assert "config_schema" not in manager.language_servers["pylsp"]
+
+    await handler.get()
+    specs = handler._payload["specs"]
+    assert specs["pylsp"]["config_schema"] is load_config_schema("pylsp")
+    assert "config_schema" not in specs["custom"]
@@ -1,9 +1,17 @@
 import asyncio
+import json
 import os
+import pathlib
+import signal
+import sys
+from datetime import timedelta
 
 import pytest
 
+from ..process import wait_for_exit
 from ..schema import SERVERS_RESPONSE
+from ..session import LanguageServerSession
+from .conftest import MockWebsocketHandler
 
 
 async def assert_status_set(handler, expected_statuses, language_server=None):
@@ -49,6 +57,7 @@ async def test_start_known(known_server, handlers, jsonrpc_init_msg):
         ws_handler.on_close()
 
     assert not session.handlers
+    await session.stopped()
     assert not session.process
 
     await assert_status_set(handler, {"stopped"}, known_server)
@@ -123,3 +132,398 @@ async def test_substitute_env(handlers):
     assert "test-variable" not in os.environ
 
     ws_handler.on_close()
+
+
+@pytest.mark.asyncio
+async def test_shared_initialize(handlers, jsonrpc_init_msg):
+    """does a second client get the initialize result without asking the server?"""
+    a_server = "pylsp"
+
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.initialize()
+
+    other_ws_handler = MockWebsocketHandler()
+    other_ws_handler.initialize(manager)
+
+    await ws_handler.open(a_server)
+    await other_ws_handler.open(a_server)
+    session = manager.sessions[a_server]
+
+    try:
+        await ws_handler.on_message(jsonrpc_init_msg)
+        first = json.loads(await asyncio.wait_for(ws_handler._messages_wrote.get(), 20))
+        await other_ws_handler.on_message(jsonrpc_init_msg)
+        second = json.loads(
+            await asyncio.wait_for(other_ws_handler._messages_wrote.get(), 1)
+        )
+    finally:
+        ws_handler.on_close()
+        other_ws_handler.on_close()
+
+    assert first["result"] == second["result"] == session.router.initialize_result
+    assert first["id"] == second["id"] == json.loads(jsonrpc_init_msg)["id"]
+
+
+@pytest.mark.asyncio
+async def test_prewarm(handlers, jsonrpc_init_msg):
+    """is a prewarmed server initialized before the first client connects?"""
+    a_server = "pylsp"
+
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.prewarm = [a_server, "not-a-language-server"]
+    manager.initialize()
+
+    await assert_status_set(handler, {"not_started"})
+
+    await asyncio.wait_for(manager.prewarm_sessions(), 20)
+    session = manager.sessions[a_server]
+
+    await assert_status_set(handler, {"started"}, a_server)
+    assert handler._payload["sessions"][a_server]["prewarm"] == "warm"
+
+    await ws_handler.open(a_server)
+
+    try:
+        await ws_handler.on_message(jsonrpc_init_msg)
+        response = json.loads(
+            await asyncio.wait_for(ws_handler._messages_wrote.get(), 1)
+        )
+    finally:
+        ws_handler.on_close()
+
+    assert response["result"] == session.router.initialize_result
+
+
+# roughly what the frontend asks for, which is never the prewarm defaults
+FRONTEND_CAPABILITIES = {
+    "textDocument": {
+        "synchronization": {"dynamicRegistration": True, "didSave": True},
+        "completion": {
+            "completionItem": {"snippetSupport": False, "documentationFormat": []},
+            "contextSupport": False,
+        },
+        "hover": {"contentFormat": ["markdown", "plaintext"]},
+        "signatureHelp": {"signatureInformation": {"documentationFormat": []}},
+        "definition": {"linkSupport": True},
+        "references": {},
+        "documentSymbol": {"hierarchicalDocumentSymbolSupport": True},
+        "publishDiagnostics": {"tagSupport": {"valueSet": [1, 2]}},
+        "rename": {"prepareSupport": False},
+    },
+    "workspace": {"didChangeConfiguration": {"dynamicRegistration": True}},
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "params,restarted",
+    [
+        ({"capabilities": FRONTEND_CAPABILITIES}, False),
+        ({"rootUri": pathlib.Path(__file__).parent.parent.as_uri()}, True),
+    ],
+)
+async def test_prewarm_first_client(handlers, jsonrpc_init_msg, params, restarted):
+    """is a prewarmed server kept for the frontend, unless for another workspace?"""
+    a_server = "pylsp"
+
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.prewarm = [a_server]
+    manager.initialize()
+
+    init_msg = json.loads(jsonrpc_init_msg)
+    await asyncio.wait_for(manager.prewarm_sessions(init_msg["params"]["rootUri"]), 20)
+    session = manager.sessions[a_server]
+    prewarmed_process = session.process
+
+    init_msg["params"].update(params)
+    await ws_handler.open(a_server)
+
+    try:
+        await ws_handler.on_message(json.dumps(init_msg))
+        response = await wait_for_response(ws_handler, init_msg["id"])
+    finally:
+        ws_handler.on_close()
+
+    assert (session.process is not prewarmed_process) == restarted
+    assert "result" in response
+    assert session.router.initialize_params == init_msg["params"]
+
+
+async def wait_for_response(ws_handler, id_, timeout=20):
+    """skip notifications, and anything else, until the response to a request"""
+    while True:
+        message = json.loads(
+            await asyncio.wait_for(ws_handler._messages_wrote.get(), timeout)
+        )
+        if message.get("id") == id_ and "method" not in message:
+            return message
+
+
+def go_idle(session, seconds=3600):
+    ago = session.now() - timedelta(seconds=seconds)
+    session.last_handler_message_at = session.last_server_message_at = ago
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("idle_action", ["stop", "suspend"])
+async def test_idle_reaper(handlers, jsonrpc_init_msg, idle_action, tmp_path):
+    """is an idle server stopped (or suspended), and restarted transparently?"""
+    a_server = "pylsp"
+
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.idle_timeout = 60
+    manager.idle_action = idle_action
+    manager.initialize()
+
+    uri = (tmp_path / "example.py").as_uri()
+    did_open = {
+        "jsonrpc": "2.0",
+        "method": "textDocument/didOpen",
+        "params": {
+            "textDocument": {
+                "uri": uri,
+                "languageId": "python",
+                "version": 1,
+                "text": "import os\nos.",
+            }
+        },
+    }
+    hover = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "textDocument/hover",
+        "params": {
+            "textDocument": {"uri": uri},
+            "position": {"line": 0, "character": 8},
+        },
+    }
+
+    await ws_handler.open(a_server)
+    session = manager.sessions[a_server]
+
+    try:
+        await ws_handler.on_message(jsonrpc_init_msg)
+        await wait_for_response(ws_handler, 0)
+        await ws_handler.on_message(
+            json.dumps({"jsonrpc": "2.0", "method": "initialized", "params": {}})
+        )
+        await ws_handler.on_message(json.dumps(did_open))
+
+        # not idle for long enough
+        manager.reap()
+        assert session.status.value == "started"
+
+        go_idle(session)
+        manager.reap()
+        await session.stopped()
+        expected = "evicted" if idle_action == "stop" else "suspended"
+        await assert_status_set(handler, {expected}, a_server)
+        assert bool(session.process) == (idle_action == "suspend")
+
+        await ws_handler.on_message(json.dumps(hover))
+        response = await wait_for_response(ws_handler, 1)
+    finally:
+        ws_handler.on_close()
+        await session.stopped()
+
+    assert "os" in json.dumps(response["result"])
+    await assert_status_set(handler, {"stopped"}, a_server)
+
+
+@pytest.mark.asyncio
+async def test_memory_budget(handlers):
+    """are the least recently used servers stopped to meet the memory budget?"""
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.initialize()
+
+    spec = manager.sessions["pylsp"].spec
+    sessions = {
+        key: LanguageServerSession(language_server=key, spec=spec, parent=manager)
+        for key in ["oldest", "older", "newest"]
+    }
+    manager.sessions = sessions
+
+    for age, session in enumerate(reversed(sessions.values())):
+        session.initialize()
+        go_idle(session, age)
+
+    try:
+        rss = None
+        while not rss:
+            await asyncio.sleep(0.1)
+            rss = [session.rss() for session in sessions.values()]
+            rss = None if None in rss else rss
+
+        manager.memory_budget = sum(rss) - 1
+        manager.reap()
+        await asyncio.gather(*[session.stopped() for session in sessions.values()])
+        # with nobody to restart them for, evicted servers are just stopped
+        assert [session.status.value for session in sessions.values()] == [
+            "stopped",
+            "started",
+            "started",
+        ]
+
+        # the most recently used is never stopped
+        manager.memory_budget = 1
+        manager.reap()
+        await asyncio.gather(*[session.stopped() for session in sessions.values()])
+        await assert_status_set(handler, {"stopped", "started"})
+        assert sessions["newest"].status.value == "started"
+    finally:
+        await manager.shutdown()
+
+    assert not any(session.process for session in sessions.values())
+
+
+@pytest.mark.asyncio
+async def test_graceful_shutdown(handlers, jsonrpc_init_msg):
+    """does a server get to shut down, and exit, by itself?"""
+    a_server = "pylsp"
+
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.initialize()
+
+    await ws_handler.open(a_server)
+    session = manager.sessions[a_server]
+    process = session.process
+
+    try:
+        await ws_handler.on_message(jsonrpc_init_msg)
+        await wait_for_response(ws_handler, 0)
+    finally:
+        ws_handler.on_close()
+
+    await asyncio.wait_for(session.stopped(), 20)
+
+    assert process.returncode == 0
+    await assert_status_set(handler, {"stopped"}, a_server)
+
+
+@pytest.mark.asyncio
+async def test_shutdown_escalation(handlers):
+    """is a server which ignores shutdown, exit and SIGTERM killed?"""
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.initialize()
+
+    stubborn = "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN)"
+    session = LanguageServerSession(
+        language_server="stubborn",
+        spec={
+            "argv": [sys.executable, "-c", f"{stubborn}; time.sleep(60)"],
+            "languages": ["python"],
+            "version": 2,
+        },
+        shutdown_timeout=0.5,
+        parent=manager,
+    )
+    session.initialize()
+    process = session.process
+    # give the signal handler time to be installed
+    await asyncio.sleep(0.5)
+
+    await asyncio.wait_for(session.shutdown(), 5)
+
+    assert process.returncode == -signal.SIGKILL
+    assert session.status.value == "stopped"
+
+
+@pytest.mark.asyncio
+async def test_crash_restart(handlers, jsonrpc_init_msg, tmp_path):
+    """is a server which dies restarted, with the state its client expects?"""
+    a_server = "pylsp"
+
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.initialize()
+
+    uri = (tmp_path / "example.py").as_uri()
+    did_open = {
+        "jsonrpc": "2.0",
+        "method": "textDocument/didOpen",
+        "params": {
+            "textDocument": {
+                "uri": uri,
+                "languageId": "python",
+                "version": 1,
+                "text": "import os\nos.",
+            }
+        },
+    }
+    hover = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "textDocument/hover",
+        "params": {
+            "textDocument": {"uri": uri},
+            "position": {"line": 0, "character": 8},
+        },
+    }
+
+    await ws_handler.open(a_server)
+    session = manager.sessions[a_server]
+    session.restart_delay = 0.1
+
+    try:
+        await ws_handler.on_message(jsonrpc_init_msg)
+        await wait_for_response(ws_handler, 0)
+        await ws_handler.on_message(
+            json.dumps({"jsonrpc": "2.0", "method": "initialized", "params": {}})
+        )
+        await ws_handler.on_message(json.dumps(did_open))
+
+        crashed = session.process
+        crashed.kill()
+        await asyncio.wait_for(wait_for_exit(crashed), 5)
+
+        # the restart is pending, or under way
+        await asyncio.sleep(0.01)
+        assert session.status.value == "restarting"
+
+        await ws_handler.on_message(json.dumps(hover))
+        response = await wait_for_response(ws_handler, 1)
+        assert session.process is not crashed
+    finally:
+        ws_handler.on_close()
+        await session.stopped()
+
+    assert "os" in json.dumps(response["result"])
+    assert handler.manager.sessions[a_server].restarts == 1
+    await assert_status_set(handler, {"stopped"}, a_server)
+
+
+@pytest.mark.asyncio
+async def test_crash_loop(handlers):
+    """is a server which keeps crashing eventually left stopped?"""
+    handler, ws_handler = handlers
+    manager = handler.manager
+    manager.initialize()
+
+    session = LanguageServerSession(
+        language_server="crashing",
+        spec={
+            "argv": [sys.executable, "-c", "raise SystemExit(1)"],
+            "languages": ["python"],
+            "version": 2,
+        },
+        restart_delay=0.01,
+        restart_attempts=3,
+        parent=manager,
+    )
+    # a client is connected, but has not yet sent anything
+    session.handlers = {ws_handler}
+
+    for i in range(50):
+        await asyncio.sleep(0.1)
+        if session.status.value == "stopped" and not session._restarting:
+            break
+
+    assert session.restarts == 3
+    session.handlers = set()
@@ -5,7 +5,13 @@ import sys
 import pytest
 from tornado.queues import Queue
 
-from jupyter_lsp.stdio import LspStdIoReader
+from jupyter_lsp.stdio import (
+    LspMessageFramer,
+    LspStdIoPipeReader,
+    LspStdIoPipeWriter,
+    LspStdIoReader,
+    LspStdIoWriter,
+)
 
 WRITER_TEMPLATE = """
 from time import sleep
@@ -73,16 +79,171 @@ async def join_process(process: subprocess.Popen, headstart=1, timeout=1):
     ],
     ids=["short", "long", "intermittent", "intensive-intermittent", "with-excess"],
 )
+@pytest.mark.parametrize(
+    "reader_class", [LspStdIoReader, LspStdIoPipeReader], ids=["polling", "pipe"]
+)
 @pytest.mark.asyncio
-async def test_reader(message, repeats, interval, add_excess, communicator_spawner):
+async def test_reader(
+    message, repeats, interval, add_excess, reader_class, communicator_spawner
+):
     queue = Queue()
 
     process = communicator_spawner.spawn_writer(
         message=message, repeats=repeats, interval=interval, add_excess=add_excess
     )
-    reader = LspStdIoReader(stream=process.stdout, queue=queue)
+    reader = reader_class(stream=process.stdout, queue=queue)
 
     await asyncio.gather(join_process(process, headstart=3, timeout=1), reader.read())
 
     result = queue.get_nowait()
-    assert result == message * repeats
+    # messages are passed on as bytes, without being decoded
+    assert result == (message * repeats).encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "reader_class", [LspStdIoReader, LspStdIoPipeReader], ids=["polling", "pipe"]
+)
+@pytest.mark.asyncio
+async def test_reader_eof(reader_class):
+    """does reading stop when the process exits, without the stream being closed?"""
+    process = subprocess.Popen(
+        [sys.executable, "-c", "pass"], stdout=subprocess.PIPE, bufsize=0
+    )
+    reader = reader_class(stream=process.stdout, queue=Queue())
+
+    try:
+        await asyncio.wait_for(reader.read(), 5)
+    finally:
+        reader.close()
+        process.wait(timeout=5)
+
+
+def frame(message: str) -> bytes:
+    body = message.encode("utf-8")
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 100_000])
+def test_framer(chunk_size):
+    messages = ['{"id": %s, "result": "%s"}' % (i, "ü" * i * 10) for i in range(20)]
+    stream = b"".join(map(frame, messages)) + b"\n" + frame("{}")
+
+    framer = LspMessageFramer()
+    received = []
+
+    for start in range(0, len(stream), chunk_size):
+        framer.feed(stream[start : start + chunk_size])
+        for body in framer:
+            assert isinstance(body, memoryview)
+            received.append(str(body, "utf-8"))
+
+    assert received == messages + ["{}"]
+    assert not framer.buffer[framer._start :]
+
+
+def test_framer_held_view():
+    """a view kept by a consumer does not prevent further reads"""
+    framer = LspMessageFramer()
+    framer.feed(frame("first") + frame("second")[:-3])
+    first, *_ = framer
+    framer.feed(frame("second")[-3:])
+    assert bytes(first) == b"first"
+    framer.feed(frame("third"))
+    assert [bytes(body) for body in framer] == [b"second", b"third"]
+
+
+def test_framer_reuses_buffer():
+    """is the buffer kept, rather than copied, when messages are copied out?"""
+    framer = LspMessageFramer()
+    buffer = framer.buffer
+    received = []
+    for i in range(10):
+        received += framer.messages(frame(f"message {i}") + frame("next")[:5])
+        received += framer.messages(frame("next")[5:])
+    assert framer.buffer is buffer
+    assert received == [
+        body for i in range(10) for body in [f"message {i}".encode(), b"next"]
+    ]
+
+
+ECHO = """
+import os
+
+while True:
+    data = os.read(0, 65536)
+    if not data:
+        break
+    os.write(1, data)
+"""
+
+
+@pytest.mark.parametrize(
+    "reader_class,writer_class",
+    [[LspStdIoReader, LspStdIoWriter], [LspStdIoPipeReader, LspStdIoPipeWriter]],
+    ids=["polling", "pipe"],
+)
+@pytest.mark.asyncio
+async def test_round_trip(reader_class, writer_class):
+    process = subprocess.Popen(
+        [sys.executable, "-u", "-c", ECHO],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        bufsize=0,
+    )
+    to_process, from_process = Queue(), Queue()
+    writer = writer_class(stream=process.stdin, queue=to_process)
+    reader = reader_class(stream=process.stdout, queue=from_process)
+    tasks = [
+        asyncio.ensure_future(writer.write()),
+        asyncio.ensure_future(reader.read()),
+    ]
+
+    messages = ['{"id": %s, "method": "ping"}' % i for i in range(10)]
+
+    try:
+        for message in messages:
+            to_process.put_nowait(message)
+        received = [
+            await asyncio.wait_for(from_process.get(), 5) for message in messages
+        ]
+    finally:
+        [task.cancel() for task in tasks]
+        writer.close()
+        reader.close()
+        process.wait(timeout=5)
+
+    assert received == [message.encode("utf-8") for message in messages]
+    # everything was queued before the writer woke up, so it went out at once
+    assert writer.messages_written == len(messages)
+    assert writer.batches_written == 1
+    assert writer.max_batch_size == len(messages)
+    assert writer.bytes_written == sum(len(frame(message)) for message in messages)
+
+
+@pytest.mark.parametrize(
+    "reader_class", [LspStdIoReader, LspStdIoPipeReader], ids=["polling", "pipe"]
+)
+@pytest.mark.asyncio
+async def test_reader_pause(reader_class):
+    process = subprocess.Popen(
+        [sys.executable, "-u", "-c", ECHO],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        bufsize=0,
+    )
+    queue = Queue()
+    reader = reader_class(stream=process.stdout, queue=queue)
+    reader.pause()
+    task = asyncio.ensure_future(reader.read())
+
+    try:
+        process.stdin.write(frame("paused"))
+        await asyncio.sleep(0.5)
+        assert queue.empty()
+        reader.resume()
+        assert await asyncio.wait_for(queue.get(), 5) == b"paused"
+    finally:
+        task.cancel()
+        reader.close()
+        process.stdin.close()
+        process.wait(timeout=5)
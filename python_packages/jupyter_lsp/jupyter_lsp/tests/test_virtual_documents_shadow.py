@@ -1,4 +1,8 @@
+import asyncio
+import json
 import logging
+import threading
+import time
 from pathlib import Path
 from types import SimpleNamespace
 from typing import List
@@ -7,9 +11,14 @@ import pytest
 
 from jupyter_lsp import LanguageServerManager
 
+from .. import virtual_documents_shadow
+from ..types import ListenerMode, ListenerRegistry, MessageScope
 from ..virtual_documents_shadow import (
+    DiskBackend,
+    DocumentCache,
     EditableFile,
     ShadowFilesystemError,
+    TmpfsBackend,
     extract_or_none,
     setup_shadow_filesystem,
 )
@@ -57,6 +66,55 @@ async def test_apply_change(tmp_path):
     assert editable_file.lines == [""]
 
 
+@pytest.mark.asyncio
+async def test_write(tmp_path):
+    path = tmp_path / "nested" / "test.py"
+    editable_file = EditableFile(path)
+    editable_file.lines = ["a", "b"]
+
+    assert await editable_file.write()
+    assert path.read_text() == "a\nb"
+    # the same lines are not written again, unless the file has gone
+    assert not await editable_file.write()
+    path.unlink()
+    assert await editable_file.write()
+
+    editable_file.lines = ["c"]
+    assert await editable_file.write()
+    assert path.read_text() == "c"
+    # written in place at once, leaving nothing behind
+    assert [p.name for p in path.parent.iterdir()] == ["test.py"]
+
+
+def test_document_cache(tmp_path):
+    cache = DocumentCache(max_documents=2, max_bytes=10)
+
+    def put(uri, *lines):
+        editable_file = EditableFile(tmp_path / uri)
+        editable_file.lines = list(lines)
+        cache.put(uri, editable_file)
+        return editable_file
+
+    a = put("a", "abc")
+    put("b", "de", "f")
+    assert cache.size == 7
+    assert cache.get("a") is a
+
+    # the least recently changed goes first
+    put("c", "g")
+    assert "b" not in cache
+    assert list(cache._files) == ["a", "c"]
+
+    put("a", "abcdef", "ghi")
+    assert "c" not in cache
+    assert cache.size == 10
+
+    # even the latest is forgotten, if it is too big alone
+    put("d", "0123456789", "")
+    assert not len(cache)
+    assert cache.size == 0
+
+
 def test_extract_or_none():
     obj = {"nested": {"value": 1}}
     assert extract_or_none(obj, ["nested"]) == {"value": 1}
@@ -129,6 +187,289 @@ async def test_shadow(shadow_path, message_func, content, expected_content, mana
         assert f.read() == expected_content
 
 
+def range_change(text, line, start, end):
+    return {
+        "range": {
+            "start": {"line": line, "character": start},
+            "end": {"line": line, "character": end},
+        },
+        "text": text,
+    }
+
+
+@pytest.mark.asyncio
+async def test_shadow_cache(shadow_path, manager):
+    """are changes applied to the text in memory, rather than the file?"""
+    shadow = setup_shadow_filesystem(Path(shadow_path).as_uri(), max_documents=1)
+    path_a = Path(shadow_path) / "a.py"
+    path_b = Path(shadow_path) / "b.py"
+
+    def run_shadow(message):
+        return shadow("client", message, "python-lsp-server", manager)
+
+    await run_shadow(did_open(path_a.as_uri(), "a = 1\nb = 2"))
+    # nobody else should write the file, but if they did, it would not be read
+    path_a.write_text("something else")
+    await run_shadow(did_change(path_a.as_uri(), [range_change("c", 1, 0, 1)]))
+    assert path_a.read_text() == "a = 1\nc = 2"
+
+    # another document takes the place of the first, which is read again
+    await run_shadow(did_open(path_b.as_uri(), "c = 4"))
+    path_a.write_text("x = 0")
+    await run_shadow(did_change(path_a.as_uri(), [range_change("y", 0, 0, 1)]))
+    assert path_a.read_text() == "y = 0"
+
+
+@pytest.mark.asyncio
+async def test_shadow_changes(shadow_path, manager):
+    """are all the changes of a didChange applied, in order?"""
+    shadow = setup_shadow_filesystem(Path(shadow_path).as_uri())
+    path = Path(shadow_path) / "test.py"
+
+    def run_shadow(message):
+        return shadow("client", message, "python-lsp-server", manager)
+
+    await run_shadow(did_open(path.as_uri(), "a = 1\nb = 2"))
+    await run_shadow(
+        did_change(
+            path.as_uri(),
+            [
+                range_change("3", 1, 4, 5),
+                range_change("c", 0, 0, 1),
+                range_change("\nd = 4", 1, 5, 5),
+            ],
+        )
+    )
+    assert path.read_text() == "c = 1\nb = 3\nd = 4"
+
+
+@pytest.mark.asyncio
+async def test_shadow_ordering(shadow_path, manager, monkeypatch):
+    """are changes forwarded before they are written, but requests after?"""
+    monkeypatch.setattr(
+        LanguageServerManager,
+        "_listeners",
+        ListenerRegistry({str(scope.value): [] for scope in MessageScope}),
+    )
+    setup_shadow_filesystem(Path(shadow_path).as_uri())
+    modes = [listener.mode for listener in manager._listeners["client"]]
+    assert modes == [ListenerMode.BLOCKING, ListenerMode.CONCURRENT]
+
+    path = Path(shadow_path) / "test.py"
+    uri = path.as_uri()
+
+    def send(message):
+        return manager.wait_for_listeners(
+            MessageScope.CLIENT, json.dumps(message), "python-lsp-server"
+        )
+
+    await send(did_open(uri, "a"))
+    for text in ["ab", "abc", "abcd"]:
+        await send(did_change(uri, [{"text": text}]))
+
+    await send(
+        {
+            "id": 1,
+            "method": "textDocument/hover",
+            "params": {
+                "textDocument": {"uri": uri},
+                "position": {"line": 0, "character": 0},
+            },
+        }
+    )
+    assert path.read_text() == "abcd"
+
+
+@pytest.mark.asyncio
+async def test_shadow_write_delay(shadow_path, manager, monkeypatch):
+    """are changes written together, or when a request needs them?"""
+    monkeypatch.setattr(
+        LanguageServerManager,
+        "_listeners",
+        ListenerRegistry({str(scope.value): [] for scope in MessageScope}),
+    )
+    setup_shadow_filesystem(Path(shadow_path).as_uri(), write_delay=0.2)
+
+    writes = []
+    write = EditableFile.write
+
+    def counting_write(self):
+        writes.append(self.lines)
+        return write(self)
+
+    monkeypatch.setattr(EditableFile, "write", counting_write)
+
+    path = Path(shadow_path) / "test.py"
+    uri = path.as_uri()
+
+    def send(message):
+        return manager.wait_for_listeners(
+            MessageScope.CLIENT, json.dumps(message), "python-lsp-server"
+        )
+
+    await send(did_open(uri, "a"))
+    for text in ["ab", "abc"]:
+        await send(did_change(uri, [{"text": text}]))
+    await asyncio.sleep(0.05)
+    assert not path.exists()
+
+    await asyncio.sleep(0.3)
+    assert path.read_text() == "abc"
+    assert writes == [["abc"]]
+
+    # a request does not wait for the delay
+    await send(did_change(uri, [{"text": "abcd"}]))
+    await send(
+        {
+            "id": 1,
+            "method": "textDocument/hover",
+            "params": {
+                "textDocument": {"uri": uri},
+                "position": {"line": 0, "character": 0},
+            },
+        }
+    )
+    assert path.read_text() == "abcd"
+    assert len(writes) == 2
+
+    await asyncio.sleep(0.3)
+    assert len(writes) == 2
+
+
+@pytest.mark.asyncio
+async def test_shadow_tmpfs_backend(tmp_path, manager, monkeypatch):
+    tmpfs = tmp_path / "shm"
+    tmpfs.mkdir()
+    monkeypatch.setattr(TmpfsBackend, "tmpfs", tmpfs)
+    root = tmp_path / ".virtual_documents"
+    (root / "old").mkdir(parents=True)
+
+    shadow = setup_shadow_filesystem(root.as_uri(), backend="tmpfs")
+    path = root / "test.py"
+    await shadow(
+        "client", did_open(path.as_uri(), "a = 1"), "python-lsp-server", manager
+    )
+
+    assert root.is_symlink()
+    assert path.read_text() == "a = 1"
+    [target] = tmpfs.iterdir()
+    assert [p.name for p in target.iterdir()] == ["test.py"]
+
+    # the link is replaced by a directory on disk again
+    DiskBackend(root).initialize()
+    assert root.is_dir() and not root.is_symlink()
+    assert not list(root.iterdir())
+
+
+def did_close(uri):
+    return {"method": "textDocument/didClose", "params": {"textDocument": {"uri": uri}}}
+
+
+@pytest.mark.asyncio
+async def test_shadow_quota(shadow_path, manager):
+    """are the shadow files of closed documents removed, beyond the quota?"""
+    shadow = setup_shadow_filesystem(Path(shadow_path).as_uri(), max_files=2)
+    paths = {name: Path(shadow_path) / f"{name}.py" for name in "abc"}
+
+    def run_shadow(message):
+        return shadow("client", message, "python-lsp-server", manager)
+
+    for name, path in paths.items():
+        await run_shadow(did_open(path.as_uri(), name))
+    # open documents are never removed
+    assert all(path.exists() for path in paths.values())
+
+    await run_shadow(did_close(paths["a"].as_uri()))
+    await asyncio.sleep(0.05)
+    assert not paths["a"].exists()
+
+    await run_shadow(did_close(paths["b"].as_uri()))
+    await asyncio.sleep(0.05)
+    assert paths["b"].exists()
+
+    # opened again, and no longer the least recently closed
+    await run_shadow(did_open(paths["b"].as_uri(), "b"))
+    await run_shadow(did_open(paths["a"].as_uri(), "a"))
+    await asyncio.sleep(0.05)
+    assert all(path.exists() for path in paths.values())
+
+
+@pytest.mark.asyncio
+async def test_shadow_opened_twice(shadow_path, manager):
+    """is a shadow file kept while another client still has the document open?"""
+    shadow = setup_shadow_filesystem(Path(shadow_path).as_uri(), max_files=1)
+    path, other = Path(shadow_path) / "a.py", Path(shadow_path) / "b.py"
+
+    def run_shadow(message):
+        return shadow("client", message, "python-lsp-server", manager)
+
+    await run_shadow(did_open(path.as_uri(), "a = 1"))
+    await run_shadow(did_open(path.as_uri(), "a = 1"))
+    await run_shadow(did_open(other.as_uri(), "b = 1"))
+
+    await run_shadow(did_close(path.as_uri()))
+    await asyncio.sleep(0.05)
+    assert path.exists()
+    await run_shadow(did_change(path.as_uri(), [range_change("b", 0, 0, 1)]))
+    assert path.read_text() == "b = 1"
+
+    await run_shadow(did_close(path.as_uri()))
+    await asyncio.sleep(0.05)
+    assert not path.exists()
+
+
+class Disconnecting:
+    language_server = "python-lsp-server"
+
+
+@pytest.mark.asyncio
+async def test_shadow_closed_by_disconnect(shadow_path, manager):
+    """are the documents of a websocket which goes away, without closing them,
+    closed, so that their shadow files may be removed?
+    """
+    shadow = setup_shadow_filesystem(Path(shadow_path).as_uri(), max_files=1)
+    path, other = Path(shadow_path) / "a.py", Path(shadow_path) / "b.py"
+    manager.init_sessions()
+    router = manager.sessions["python-lsp-server"].router
+    handler = Disconnecting()
+
+    for message in [did_open(path.as_uri(), "a = 1"), did_open(other.as_uri(), "")]:
+        router.from_client(handler, json.dumps(message), message)
+        await shadow("client", message, "python-lsp-server", manager)
+    assert path.exists()
+
+    manager.unsubscribe(handler)
+    await asyncio.sleep(0.1)
+    assert router.open_documents() == []
+    assert [path.exists(), other.exists()].count(True) == 1
+
+
+@pytest.mark.asyncio
+async def test_shadow_sweep(shadow_path, manager, caplog):
+    shadow = setup_shadow_filesystem(
+        Path(shadow_path).as_uri(), max_disk_bytes=10, sweep_interval=0.05
+    )
+    path_a = Path(shadow_path) / "a.py"
+    path_b = Path(shadow_path) / "b.py"
+
+    def run_shadow(message):
+        return shadow("client", message, "python-lsp-server", manager)
+
+    await run_shadow(did_open(path_a.as_uri(), "12345"))
+    await run_shadow(did_close(path_a.as_uri()))
+    await asyncio.sleep(0.1)
+    assert path_a.exists()
+
+    with caplog.at_level(logging.INFO):
+        await run_shadow(did_open(path_b.as_uri(), "123456"))
+        await asyncio.sleep(0.2)
+    assert not path_a.exists()
+    assert path_b.exists()
+    assert "removed 1 shadow files of closed documents, reclaiming 5 bytes" in (
+        caplog.text
+    )
+
+
 @pytest.mark.asyncio
 async def test_no_shadow_for_well_behaved_server(
     shadow_path,
@@ -225,42 +566,82 @@ async def test_shadow_traversal(shadow_path, manager):
         await run_shadow(did_open(file_beyond_shadow_root_uri, "content"))
 
 
-@pytest.fixture
-def forbidden_shadow_path(tmpdir):
-    path = Path(tmpdir) / "no_permission_dir"
-    path.mkdir()
-    path.chmod(0o000)
-
-    yield path
+@pytest.mark.asyncio
+async def test_io_failure(tmp_path, manager, caplog, monkeypatch):
+    monkeypatch.setattr(virtual_documents_shadow, "INIT_RETRY_DELAY", 0.1)
+    attempts = []
+    initialize = DiskBackend.initialize
 
-    # re-adjust the permissions, see https://github.com/pytest-dev/pytest/issues/7821
-    path.chmod(0o755)
+    def counting_initialize(self):
+        attempts.append(self.root)
+        return initialize(self)
 
+    monkeypatch.setattr(DiskBackend, "initialize", counting_initialize)
 
-@pytest.mark.asyncio
-async def test_io_failure(forbidden_shadow_path, manager, caplog):
-    file_uri = (forbidden_shadow_path / "test.py").as_uri()
+    # a file is in the way of the shadow filesystem
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    root = blocker / "shadow"
+    file_uri = (root / "test.py").as_uri()
 
-    shadow = setup_shadow_filesystem(forbidden_shadow_path.as_uri())
+    shadow = setup_shadow_filesystem(root.as_uri())
 
     def send_change():
         message = did_open(file_uri, "content")
         return shadow("client", message, "python-lsp-server", manager)
 
+    # a warning should be emitted on the first failure
     with caplog.at_level(logging.WARNING):
         assert await send_change() is None
-        assert await send_change() is None
-    # no message should be emitted during the first two attempts
-    assert caplog.text == ""
-
-    # a warning should be emitted on third failure
-    with caplog.at_level(logging.WARNING):
-        assert await send_change() is None
-    assert "initialization of shadow filesystem failed three times" in caplog.text
-    assert "PermissionError" in caplog.text
+    assert "initialization of shadow filesystem failed" in caplog.text
+    assert "NotADirectoryError" in caplog.text
     caplog.clear()
 
-    # no message should be emitted in subsequent attempts
+    # not retried until after a delay, which grows, and without more warnings
     with caplog.at_level(logging.WARNING):
         assert await send_change() is None
+        assert len(attempts) == 1
+        await asyncio.sleep(0.15)
+        assert await send_change() is None
+        assert len(attempts) == 2
+        await asyncio.sleep(0.15)
+        assert await send_change() is None
+        assert len(attempts) == 2
     assert caplog.text == ""
+
+    blocker.unlink()
+    await asyncio.sleep(0.1)
+    assert await send_change() == str(root / "test.py")
+    assert len(attempts) == 3
+
+
+@pytest.mark.asyncio
+async def test_initialize_in_background(shadow_path, manager, monkeypatch):
+    """is a leftover shadow filesystem moved aside, and removed later?"""
+    root = Path(shadow_path)
+    (root / "old" / "deep").mkdir(parents=True)
+    (root / "old" / "deep" / "leftover.py").write_text("")
+    # left by an earlier removal which did not finish
+    (root.parent / f"{root.name}.0123.deleted").mkdir()
+
+    removed = threading.Event()
+    remove = DiskBackend.remove
+
+    def slow_remove(paths):
+        time.sleep(0.2)
+        remove(paths)
+        removed.set()
+
+    monkeypatch.setattr(DiskBackend, "remove", staticmethod(slow_remove))
+
+    shadow = setup_shadow_filesystem(root.as_uri())
+    message = did_open((root / "test.py").as_uri(), "content")
+    started = time.monotonic()
+    await shadow("client", message, "python-lsp-server", manager)
+    assert time.monotonic() - started < 0.2
+
+    assert [p.name for p in root.iterdir()] == ["test.py"]
+    assert len(list(root.parent.glob(f"{root.name}.*.deleted"))) == 2
+
+    assert removed.wait(5)
+    assert not list(root.parent.glob(f"{root.name}.*.deleted"))
@@ -1,25 +1,69 @@
+import hashlib
+import marshal
+from collections import OrderedDict
+
 import traitlets
 
 
 class Schema(traitlets.Any):
-    """any... but validated by a jsonschema.Validator"""
+    """any... but validated by a jsonschema.Validator, or the name of one in
+    ``jupyter_lsp.schema``, which is only made when first needed
+
+    Values which are equal to one already validated are not validated again.
+    """
 
     _validator = None
 
+    #: how many of the values most recently validated are remembered
+    max_validated = 64
+
     def __init__(self, validator, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._validator = validator
+        self._validated: "OrderedDict[bytes, None]" = OrderedDict()
+
+    @property
+    def validator(self):
+        if isinstance(self._validator, str):
+            from . import schema
+
+            self._validator = getattr(schema, self._validator)
+        return self._validator
 
     def validate(self, obj, value):
-        errors = list(self._validator.iter_errors(value))
+        digest = self._digest(value)
+        if digest is not None and digest in self._validated:
+            self._validated.move_to_end(digest)
+            return value
+
+        errors = list(self.validator.iter_errors(value))
         if errors:
             raise traitlets.TraitError(
                 ("""schema errors:\n""" """\t{}\n""" """for:\n""" """{}""").format(
                     "\n\t".join([error.message for error in errors]), value
                 )
             )
+
+        if digest is not None:
+            self._validated[digest] = None
+            while len(self._validated) > self.max_validated:
+                self._validated.popitem(last=False)
         return value
 
+    def _digest(self, value):
+        """a digest of a value, or None, if it is not made of builtin types
+
+        ``marshal`` is several times faster than ``json``, but keeps the order
+        of keys: equal values with keys in another order are validated again.
+        Its version 2 has no references to objects already written, which would
+        depend on what else refers to them.
+        """
+        try:
+            dumped = marshal.dumps(value, 2)
+        except ValueError:
+            return None
+        return hashlib.blake2b(dumped, digest_size=16).digest()
+
 
 class LoadableCallable(traitlets.TraitType):
     """A trait which (maybe) loads a callable."""
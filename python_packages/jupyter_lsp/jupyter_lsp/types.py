@@ -3,7 +3,6 @@
 
 import asyncio
 import enum
-import json
 import pathlib
 import re
 import shutil
@@ -19,7 +18,9 @@ from typing import (
     List,
     Optional,
     Pattern,
+    Set,
     Text,
+    Tuple,
     Union,
     cast,
 )
@@ -35,6 +36,9 @@ from traitlets import List as List_
 from traitlets import Unicode, default
 from traitlets.config import LoggingConfigurable
 
+from .codec import JsonCodec, Message, peek_method
+from .node_modules import NodeModulesIndex
+
 LanguageServerSpec = Dict[Text, Any]
 LanguageServerMessage = Dict[Text, Any]
 KeyedLanguageServerSpecs = Dict[Text, LanguageServerSpec]
@@ -60,6 +64,18 @@ class SessionStatus(enum.Enum):
     STARTED = "started"
     STOPPING = "stopping"
     STOPPED = "stopped"
+    SUSPENDED = "suspended"
+    EVICTED = "evicted"
+    RESTARTING = "restarting"
+
+
+class PrewarmStatus(enum.Enum):
+    """States in which starting a language server ahead of any client can be"""
+
+    PENDING = "pending"
+    WARMING = "warming"
+    WARM = "warm"
+    FAILED = "failed"
 
 
 class MessageScope(enum.Enum):
@@ -70,21 +86,33 @@ class MessageScope(enum.Enum):
     SERVER = "server"
 
 
+class ListenerMode(enum.Enum):
+    """Whether a listener holds back the message it is listening to"""
+
+    #: the message is forwarded once the listener has completed
+    BLOCKING = "blocking"
+    #: the message is forwarded while the listener runs, so it may only observe
+    CONCURRENT = "concurrent"
+
+
 class MessageListener(object):
     """A base listener implementation"""
 
     language_server: Optional[Pattern[Text]] = None
     method: Optional[Pattern[Text]] = None
+    mode: ListenerMode = ListenerMode.BLOCKING
 
     def __init__(
         self,
         listener: "HandlerListenerCallback",
         language_server: Optional[Text],
         method: Optional[Text],
+        mode: Union[ListenerMode, Text] = ListenerMode.BLOCKING,
     ):
         self.listener = listener
         self.language_server = re.compile(language_server) if language_server else None
         self.method = re.compile(method) if method else None
+        self.mode = ListenerMode(mode)
 
     async def __call__(
         self,
@@ -115,13 +143,15 @@ class MessageListener(object):
         `method` is currently the only message content discriminator, but not
         all messages will have a `method`
         """
-        if self.method:
-            method = message.get("method")
+        return self.wants_method(message.get("method"), language_server)
 
+    def wants_method(self, method: Optional[Text], language_server: Text) -> bool:
+        """whether this listener wants messages with a method (or without one)"""
+        if self.method:
             if method is None or re.match(self.method, method) is None:
                 return False
-        return self.language_server is None or re.match(
-            self.language_server, language_server
+        return self.language_server is None or bool(
+            re.match(self.language_server, language_server)
         )
 
     def __repr__(self):
@@ -133,10 +163,61 @@ class MessageListener(object):
         ).format(self=self)
 
 
+class ListenerRegistry(dict):
+    """Listeners keyed by scope, with an index of those which want the messages
+    of each scope, language server and method, kept until the listeners change
+    """
+
+    #: the most entries to keep in the index, e.g. if clients make up methods
+    max_index_size = 4096
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index: Dict[Tuple[Text, Text, Optional[Text]], List[MessageListener]] = {}
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.index.clear()
+
+    def listeners(self, scope: Text, language_server: Text) -> List[MessageListener]:
+        """all of the listeners for a scope, and for all scopes"""
+        listeners = self[scope]
+        if scope != MessageScope.ALL.value:
+            listeners = listeners + self[MessageScope.ALL.value]
+        return [
+            listener
+            for listener in listeners
+            if listener.language_server is None
+            or re.match(listener.language_server, language_server)
+        ]
+
+    def wanting(
+        self, scope: Text, language_server: Text, method: Optional[Text]
+    ) -> List[MessageListener]:
+        """the listeners which want a message"""
+        key = (scope, language_server, method)
+        listeners = self.index.get(key)
+        if listeners is None:
+            if len(self.index) >= self.max_index_size:
+                self.index.clear()
+            listeners = self.index[key] = [
+                listener
+                for listener in self.listeners(scope, language_server)
+                if listener.wants_method(method, language_server)
+            ]
+        return listeners
+
+
 class HasListeners:
-    _listeners = {
-        str(scope.value): [] for scope in MessageScope
-    }  # type: Dict[Text, List[MessageListener]]
+    _listeners = ListenerRegistry(
+        {str(scope.value): [] for scope in MessageScope}
+    )  # type: ListenerRegistry
+
+    #: how messages are parsed for listeners
+    codec: JsonCodec = JsonCodec()
+
+    # concurrent listeners which are still running
+    _listener_tasks: Optional[Set[asyncio.Future]] = None
 
     log: Any = Instance("logging.Logger")
 
@@ -146,16 +227,25 @@ class HasListeners:
         scope: Text,
         language_server: Optional[Text] = None,
         method: Optional[Text] = None,
+        mode: Union[ListenerMode, Text] = ListenerMode.BLOCKING,
     ):
-        """register a listener for language server protocol messages"""
+        """register a listener for language server protocol messages
+
+        A ``blocking`` listener completes before the message is forwarded, while
+        a ``concurrent`` listener only observes it, while it is forwarded.
+        """
 
         def inner(listener: "HandlerListenerCallback") -> "HandlerListenerCallback":
             cls.unregister_message_listener(listener)
             cls._listeners[scope].append(
                 MessageListener(
-                    listener=listener, language_server=language_server, method=method
+                    listener=listener,
+                    language_server=language_server,
+                    method=method,
+                    mode=mode,
                 )
             )
+            cls._listeners.index.clear()
             return listener
 
         return inner
@@ -171,27 +261,72 @@ class HasListeners:
             ]
 
     async def wait_for_listeners(
-        self, scope: MessageScope, message_str: Text, language_server: Text
-    ) -> None:
+        self,
+        scope: MessageScope,
+        message_str: Message,
+        language_server: Text,
+        message: Optional[LanguageServerMessage] = None,
+    ) -> Optional[LanguageServerMessage]:
+        """run the listeners which want a message, returning the message, if it
+        had to be parsed for them (or was already)
+
+        The message is only parsed if some listener wants its method, which is
+        found without parsing it all, where possible.
+        """
         scope_val = str(scope.value)
-        listeners = self._listeners[scope_val] + self._listeners[MessageScope.ALL.value]
 
-        if listeners:
-            message = json.loads(message_str)
+        if message is not None:
+            method = message.get("method")
+        else:
+            peeked, method = peek_method(message_str)
+            if not peeked:
+                if not self._listeners.listeners(scope_val, language_server):
+                    return None
+                message = self.codec.loads(message_str)
+                method = message.get("method")
 
-            futures = [
-                listener(
-                    scope_val,
-                    message=message,
-                    language_server=language_server,
-                    manager=cast("LanguageServerManagerAPI", self),
-                )
-                for listener in listeners
-                if listener.wants(message, language_server)
-            ]
+        listeners = self._listeners.wanting(scope_val, language_server, method)
+
+        if not listeners:
+            return message
+
+        if message is None:
+            message = self.codec.loads(message_str)
+
+        blocking = []
+        concurrent = []
 
-            if futures:
-                await asyncio.gather(*futures)
+        for listener in listeners:
+            future = listener(
+                scope_val,
+                message=message,
+                language_server=language_server,
+                manager=cast("LanguageServerManagerAPI", self),
+            )
+            if listener.mode == ListenerMode.CONCURRENT:
+                concurrent.append(future)
+            else:
+                blocking.append(future)
+
+        if concurrent:
+            self._start_concurrent_listeners(concurrent)
+
+        if blocking:
+            await asyncio.gather(*blocking)
+        elif concurrent:
+            # let the concurrent listeners start before the message is forwarded
+            await asyncio.sleep(0)
+
+        return message
+
+    def _start_concurrent_listeners(self, coroutines: List[Awaitable[None]]) -> None:
+        if self._listener_tasks is None:
+            self._listener_tasks = set()
+        for coroutine in coroutines:
+            task = asyncio.ensure_future(coroutine)
+            # keep a reference, so the task is not garbage collected while running
+            self._listener_tasks.add(task)
+            task.add_done_callback(self._listener_tasks.discard)
 
 
 class LanguageServerManagerAPI(LoggingConfigurable, HasListeners):
@@ -213,17 +348,16 @@ class LanguageServerManagerAPI(LoggingConfigurable, HasListeners):
         help=_("additional absolute paths to seek node_modules first"),
     ).tag(config=True)
 
+    node_modules_index = Instance(
+        NodeModulesIndex,
+        args=(),
+        help=_("the packages in the node_modules of each root, shared by all specs"),
+    )
+
     def find_node_module(self, *path_frag):
         """look through the node_module roots to find the given node module"""
         all_roots = self.extra_node_roots + self.node_roots
-        found = None
-
-        for candidate_root in all_roots:
-            candidate = pathlib.Path(candidate_root, "node_modules", *path_frag)
-            self.log.debug("Checking for %s", candidate)
-            if candidate.exists():
-                found = str(candidate)
-                break
+        found = self.node_modules_index.find(all_roots, *path_frag)
 
         if found is None:  # pragma: no cover
             self.log.debug(
@@ -244,7 +378,9 @@ class LanguageServerManagerAPI(LoggingConfigurable, HasListeners):
     def _npm_prefix(self, npm: Text):
         try:
             return (
-                subprocess.run([npm, "prefix", "-g"], check=True, capture_output=True)
+                subprocess.run(
+                    [npm, "prefix", "-g"], check=True, capture_output=True, timeout=10
+                )
                 .stdout.decode("utf-8")
                 .strip()
             )
@@ -1,19 +1,37 @@
 # flake8: noqa: W503
+import asyncio
+import atexit
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from shutil import rmtree
-from typing import List
+from typing import Dict, List, Optional, Tuple, Type
 
 from tornado.concurrent import run_on_executor
 from tornado.gen import convert_yielded
+from tornado.ioloop import PeriodicCallback
 
+from .flow_control import KeyedQueue
 from .manager import lsp_message_listener
 from .paths import file_uri_to_path, is_relative
-from .types import LanguageServerManagerAPI
+from .rope import Rope
+from .routing import DID_CLOSE, DID_OPEN, document_uri
+from .types import LanguageServerManagerAPI, ListenerMode
 
-# TODO: make configurable
+#: the default number of threads reading, and writing, shadow files
 MAX_WORKERS = 4
 
+#: seconds before initialization of the shadow filesystem is first retried, and
+#: the longest between retries
+INIT_RETRY_DELAY = 1.0
+INIT_RETRY_MAX_DELAY = 300.0
+
 
 def extract_or_none(obj, path):
     for crumb in path:
@@ -27,19 +45,26 @@ def extract_or_none(obj, path):
 class EditableFile:
     executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
-    def __init__(self, path):
+    def __init__(self, path, executor: Optional[ThreadPoolExecutor] = None):
         # Python 3.5 relict:
         self.path = Path(path) if isinstance(path, str) else path
+        if executor is not None:
+            self.executor = executor
+        self.document = Rope()
+        # of the latest change, if the client gave one
+        self.version: Optional[int] = None
+        # digest, and size in bytes, of what was last written
+        self.written: Optional[bytes] = None
+        self.written_size = 0
 
     async def read(self):
         self.lines = await convert_yielded(self.read_lines())
 
     async def write(self):
-        return await convert_yielded(self.write_lines())
+        return await convert_yielded(self.write_lines(self.lines))
 
     @run_on_executor
     def read_lines(self):
-        # empty string required by the assumptions of the gluing algorithm
         lines = [""]
         try:
             # TODO: what to do about bad encoding reads?
@@ -49,53 +74,187 @@ class EditableFile:
         return lines
 
     @run_on_executor
-    def write_lines(self):
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        self.path.write_text("\n".join(self.lines), encoding="utf-8")
+    def write_lines(self, lines: List[str]) -> bool:
+        """write the lines, unless they are what was last written, replacing the
+        file at once so that it is never seen half-written
 
-    @staticmethod
-    def trim(lines: list, character: int, side: int):
-        needs_glue = False
-        if lines:
-            trimmed = lines[side][character:]
-            if lines[side] != trimmed:
-                needs_glue = True
-            lines[side] = trimmed
-        return needs_glue
+        Returns whether the file was written.
+        """
+        data = "\n".join(lines).encode("utf-8")
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if digest == self.written and self.path.exists():
+            return False
 
-    @staticmethod
-    def join(left, right, glue: bool):
-        if not glue:
-            return []
-        return [(left[-1] if left else "") + (right[0] if right else "")]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(temp, 0o644)
+            os.replace(temp, self.path)
+        except BaseException:
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
+        self.written = digest
+        self.written_size = len(data)
+        return True
 
-    def apply_change(self, text: str, start, end):
-        before = self.lines[: start["line"]]
-        after = self.lines[end["line"] :]
+    @property
+    def lines(self) -> List[str]:
+        return list(self.document)
 
-        needs_glue_left = self.trim(lines=before, character=start["character"], side=0)
-        needs_glue_right = self.trim(lines=after, character=end["character"], side=-1)
+    @lines.setter
+    def lines(self, lines: List[str]):
+        self.document = Rope(lines or [""])
 
-        inner = text.split("\n")
+    def apply_change(self, text: str, start, end):
+        self.document.replace(start, end, text)
 
-        self.lines = (
-            before[: -1 if needs_glue_left else None]
-            + self.join(before, inner, needs_glue_left)
-            + inner[1 if needs_glue_left else None : -1 if needs_glue_right else None]
-            + self.join(inner, after, needs_glue_right)
-            + after[1 if needs_glue_right else None :]
-        ) or [""]
+    @property
+    def size(self) -> int:
+        """the number of characters, including line breaks"""
+        return self.document.length
 
     @property
     def full_range(self):
         start = {"line": 0, "character": 0}
         end = {
-            "line": len(self.lines),
-            "character": len(self.lines[-1]) if self.lines else 0,
+            "line": len(self.document),
+            "character": len(self.document.line(len(self.document) - 1)),
         }
         return {"start": start, "end": end}
 
 
+class DocumentCache:
+    """The lines of recently changed shadow files, so that changes can be applied
+    without reading each file again.
+
+    Beyond ``max_documents``, or ``max_bytes`` characters, (either ``0`` for no
+    limit) the least recently changed are forgotten, and are read again on their
+    next change.
+    """
+
+    def __init__(self, max_documents: int = 0, max_bytes: int = 0):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.size = 0
+        # uri: (file, its size when cached), least recently changed first
+        self._files: "OrderedDict[str, Tuple[EditableFile, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, uri) -> bool:
+        return uri in self._files
+
+    def get(self, uri: str) -> Optional[EditableFile]:
+        cached = self._files.get(uri)
+        if cached is None:
+            return None
+        self._files.move_to_end(uri)
+        return cached[0]
+
+    def put(self, uri: str, editable_file: EditableFile) -> None:
+        """keep (or update) a file, as the most recently changed"""
+        self.discard(uri)
+        size = editable_file.size
+        self._files[uri] = (editable_file, size)
+        self.size += size
+        self._evict()
+
+    def discard(self, uri: str) -> None:
+        cached = self._files.pop(uri, None)
+        if cached is not None:
+            self.size -= cached[1]
+
+    def _evict(self) -> None:
+        while self._files and (
+            (self.max_documents and len(self._files) > self.max_documents)
+            or (self.max_bytes and self.size > self.max_bytes)
+        ):
+            _, (_, size) = self._files.popitem(last=False)
+            self.size -= size
+
+
+class ShadowBackend:
+    """Where shadow files are kept, at the path of the virtual documents URI"""
+
+    name = ""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def initialize(self) -> None:
+        """prepare an empty root, before the first shadow file is written"""
+
+
+class DiskBackend(ShadowBackend):
+    """in the virtual documents directory itself"""
+
+    name = "disk"
+
+    def initialize(self):
+        """move aside whatever was left at the root, at once, and remove it in the
+        background, with anything that was left being removed before
+        """
+        doomed = list(self.root.parent.glob(f"{self.root.name}.*.deleted"))
+
+        if self.root.is_symlink():
+            # left by the tmpfs backend
+            target = Path(os.readlink(str(self.root)))
+            self.root.unlink()
+            if target.name.startswith(TmpfsBackend.prefix):
+                doomed.append(target)
+        elif self.root.exists():
+            tombstone = self.root.with_name(
+                f"{self.root.name}.{uuid.uuid4().hex}.deleted"
+            )
+            os.replace(self.root, tombstone)
+            doomed.append(tombstone)
+
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        if doomed:
+            threading.Thread(
+                target=self.remove,
+                args=(doomed,),
+                name="jupyter_lsp_shadow_rm",
+                # whatever is left is removed at the next start
+                daemon=True,
+            ).start()
+
+    @staticmethod
+    def remove(paths: List[Path]) -> None:
+        for path in paths:
+            rmtree(str(path), ignore_errors=True)
+
+
+class TmpfsBackend(DiskBackend):
+    """on a ``tmpfs``, which the virtual documents directory links to, so that
+    writing shadow files does not reach a (maybe networked) disk
+    """
+
+    name = "tmpfs"
+    tmpfs = Path("/dev/shm")
+    prefix = "jupyter-lsp-"
+
+    def initialize(self):
+        target = tempfile.mkdtemp(prefix=self.prefix, dir=str(self.tmpfs))
+        atexit.register(rmtree, target, ignore_errors=True)
+        super().initialize()
+        self.root.rmdir()
+        self.root.symlink_to(target, target_is_directory=True)
+
+
+#: the backends which ``LanguageServerManager.shadow_backend`` may choose
+SHADOW_BACKENDS: Dict[str, Type[ShadowBackend]] = {
+    backend.name: backend for backend in [DiskBackend, TmpfsBackend]
+}
+
+
 WRITE_ONE = ["textDocument/didOpen", "textDocument/didChange", "textDocument/didSave"]
 
 
@@ -103,33 +262,191 @@ class ShadowFilesystemError(ValueError):
     """Error in the shadow file system."""
 
 
-def setup_shadow_filesystem(virtual_documents_uri: str):
+def requires_documents_on_disk(manager, language_server: str) -> bool:
+    """whether a language server reads the shadow files, as found in the spec
+    of all the language servers or, while detection goes on, of those found so far
+    """
+    spec = manager.language_servers.get(language_server)
+    if spec is None:
+        spec = manager.all_language_servers.get(language_server, {})
+    return spec.get("requires_documents_on_disk", True)
+
+
+def setup_shadow_filesystem(
+    virtual_documents_uri: str,
+    max_documents: int = 256,
+    max_bytes: int = 64 * 2**20,
+    write_delay: float = 0,
+    workers: int = MAX_WORKERS,
+    queue: Optional[KeyedQueue] = None,
+    backend: str = DiskBackend.name,
+    max_files: int = 0,
+    max_disk_bytes: int = 0,
+    sweep_interval: float = 0,
+):
+    """Create the listeners which keep shadow files of virtual documents.
+
+    They may be created before the language servers are detected, as whether
+    each needs shadow files is checked for every message.
+
+    The ``backend`` of the virtual documents directory, shared by every language
+    server which reads them, is ``disk`` or ``tmpfs``.
+
+    Beyond ``max_files`` shadow files, or ``max_disk_bytes``, (either ``0`` for
+    no limit) those of the least recently closed documents are removed, after
+    each ``textDocument/didClose``, and every ``sweep_interval`` seconds.
+    """
     if not virtual_documents_uri.startswith("file:/"):
         raise ShadowFilesystemError(  # pragma: no cover
             'Virtual documents URI has to start with "file:/", got '
             + virtual_documents_uri
         )
 
-    initialized = False
-    failures: List[Exception] = []
+    # the initialization of the root, once started, and when it may be retried
+    initializing: Optional[asyncio.Future] = None
+    retry_at = 0.0
+    retry_delay = INIT_RETRY_DELAY
+    documents = DocumentCache(max_documents=max_documents, max_bytes=max_bytes)
 
     shadow_filesystem = Path(file_uri_to_path(virtual_documents_uri))
+    root_backend = SHADOW_BACKENDS[backend](shadow_filesystem)
+
+    executor = ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="jupyter_lsp_shadow"
+    )
+    # updates of each shadow file, in order, which requests that need the file
+    # on disk wait for
+    updates = queue if queue is not None else KeyedQueue(max_keys=max_documents or 256)
+    # uri: the timer for, and file of, a write which is yet to be made, which
+    # gathers all the changes until then
+    scheduled: Dict[str, Tuple[asyncio.TimerHandle, EditableFile]] = {}
+    # uri: the path, and size in bytes, of each shadow file which was written
+    files: Dict[str, Tuple[Path, int]] = {}
+    disk_bytes = 0
+    # uri: how many times a document is open, by any client, for any server
+    opened: Dict[str, int] = {}
+    # uris of documents with shadow files which have been closed, least
+    # recently closed first
+    closed: "OrderedDict[str, None]" = OrderedDict()
+    sweeper: Optional[PeriodicCallback] = None
 
     @lsp_message_listener("client")
+    async def wait_for_shadow_documents(scope, message, language_server, manager):
+        """Hold back a request about a virtual document until its shadow file has
+        been written, as the language server may read it from disk.
+        """
+        if "id" not in message or not (updates or scheduled):
+            return
+
+        uri = document_uri(message)
+        if uri in updates or uri in scheduled:
+            await updates.run(uri, lambda: write_now(uri, manager))
+
+    def schedule_write(uri, editable_file, manager):
+        """write a shadow file after ``write_delay``, with any further changes"""
+        if uri in scheduled:
+            return
+
+        def flush():
+            asyncio.ensure_future(updates.run(uri, lambda: write_now(uri, manager)))
+
+        handle = asyncio.get_running_loop().call_later(write_delay, flush)
+        scheduled[uri] = (handle, editable_file)
+
+    async def write_now(uri, manager):
+        handle, editable_file = scheduled.pop(uri, (None, None))
+        if editable_file is None:
+            return
+        handle.cancel()
+        try:
+            await write(uri, editable_file)
+        except OSError as e:
+            manager.log.warning("[lsp] could not write shadow file %s: %s", uri, e)
+
+    async def write(uri, editable_file):
+        nonlocal disk_bytes
+        await editable_file.write()
+        _, size = files.get(uri, (None, 0))
+        files[uri] = (editable_file.path, editable_file.written_size)
+        disk_bytes += editable_file.written_size - size
+
+    def over_quota() -> bool:
+        return bool(
+            (max_files and len(files) > max_files)
+            or (max_disk_bytes and disk_bytes > max_disk_bytes)
+        )
+
+    async def sweep(manager) -> int:
+        """remove the shadow files of the least recently closed documents, while
+        over the quota
+
+        Returns how many bytes were reclaimed.
+        """
+        removed = reclaimed = 0
+        for uri in list(closed):
+            if not over_quota():
+                break
+            size = await updates.run(uri, lambda uri=uri: remove(uri))
+            if size is not None:
+                removed += 1
+                reclaimed += size
+        if removed:
+            manager.log.info(
+                "[lsp] removed %s shadow files of closed documents, reclaiming %s"
+                " bytes",
+                removed,
+                reclaimed,
+            )
+        return reclaimed
+
+    async def remove(uri) -> Optional[int]:
+        """remove the shadow file of a document, unless it was opened again"""
+        nonlocal disk_bytes
+        if uri not in closed:
+            return None
+        del closed[uri]
+        path, size = files.pop(uri)
+        disk_bytes -= size
+        try:
+            await asyncio.get_running_loop().run_in_executor(executor, path.unlink)
+        except FileNotFoundError:
+            pass
+        return size
+
+    async def close(uri, manager):
+        """write what is left to write, and forget the text of a document, once
+        it has been closed as many times as it was opened
+        """
+        await write_now(uri, manager)
+        if opened.get(uri, 0) > 1:
+            opened[uri] -= 1
+            return
+        opened.pop(uri, None)
+        documents.discard(uri)
+        if uri in files:
+            closed[uri] = None
+            closed.move_to_end(uri)
+            if over_quota():
+                asyncio.ensure_future(sweep(manager))
+
+    @lsp_message_listener("client", mode=ListenerMode.CONCURRENT)
     async def shadow_virtual_documents(scope, message, language_server, manager):
         """Intercept a message with document contents creating a shadow file for it.
 
         Only create the shadow file if the URI matches the virtual documents URI.
         Returns the path on filesystem where the content was stored.
+
+        This runs while the message is forwarded to the language server: updates
+        of each shadow file are applied in order, and only the requests which
+        need it wait for them. With a ``write_delay``, the file is written once
+        for all the changes in that time, or sooner, for such a request.
         """
-        nonlocal initialized
 
         # short-circut if language server does not require documents on disk
-        server_spec = manager.language_servers[language_server]
-        if not server_spec.get("requires_documents_on_disk", True):
+        if not requires_documents_on_disk(manager, language_server):
             return
 
-        if not message.get("method") in WRITE_ONE:
+        if not message.get("method") in WRITE_ONE + [DID_CLOSE]:
             return
 
         document = extract_or_none(message, ["params", "textDocument"])
@@ -145,30 +462,66 @@ def setup_shadow_filesystem(virtual_documents_uri: str):
         if not uri.startswith(virtual_documents_uri):
             return
 
+        return await updates.run(
+            uri, lambda: update_shadow_file(message, document, uri, manager)
+        )
+
+    async def initialize(manager) -> bool:
+        """initialize the root on a thread, once, retrying with backoff on failure
+
+        Returns whether shadow files can be written.
+        """
+        nonlocal initializing, retry_at, retry_delay, sweeper
+
+        if initializing is None:
+            if time.monotonic() < retry_at:
+                return False
+            initializing = asyncio.get_running_loop().run_in_executor(
+                executor, root_backend.initialize
+            )
+
+        attempt = initializing
+        await asyncio.wait([attempt])
+        error = attempt.exception()
+        if error is None:
+            if sweep_interval and sweeper is None:
+                sweeper = PeriodicCallback(
+                    lambda: asyncio.ensure_future(sweep(manager)),
+                    sweep_interval * 1000,
+                )
+                sweeper.start()
+            return True
+
+        if initializing is attempt:
+            initializing = None
+            retry_at = time.monotonic() + retry_delay
+            log = (
+                manager.log.warning
+                if retry_delay == INIT_RETRY_DELAY
+                else manager.log.debug
+            )
+            log(
+                "[lsp] initialization of shadow filesystem failed, retrying in %ss:"
+                " check if the path set by `LanguageServerManager.virtual_documents_dir`"
+                " or `JP_LSP_VIRTUAL_DIR` is correct; if this is happening with a server"
+                " for which you control (or wish to override) jupyter-lsp specification"
+                " you can try switching `requires_documents_on_disk` off. The error was: %r",
+                retry_delay,
+                error,
+            )
+            retry_delay = min(retry_delay * 2, INIT_RETRY_MAX_DELAY)
+        return False
+
+    async def update_shadow_file(message, document, uri, manager):
+        if message["method"] == DID_CLOSE:
+            return await close(uri, manager)
+        if message["method"] == DID_OPEN:
+            opened[uri] = opened.get(uri, 0) + 1
+            closed.pop(uri, None)
+
         # initialization (/any file system operations) delayed until needed
-        if not initialized:
-            if len(failures) == 3:
-                return
-            try:
-                # create if does no exist (so that removal does not raise)
-                shadow_filesystem.mkdir(parents=True, exist_ok=True)
-                # remove with contents
-                rmtree(str(shadow_filesystem))
-                # create again
-                shadow_filesystem.mkdir(parents=True, exist_ok=True)
-            except (OSError, PermissionError, FileNotFoundError) as e:
-                failures.append(e)
-                if len(failures) == 3:
-                    manager.log.warn(
-                        "[lsp] initialization of shadow filesystem failed three times"
-                        " check if the path set by `LanguageServerManager.virtual_documents_dir`"
-                        " or `JP_LSP_VIRTUAL_DIR` is correct; if this is happening with a server"
-                        " for which you control (or wish to override) jupyter-lsp specification"
-                        " you can try switching `requires_documents_on_disk` off. The errors were: %s",
-                        failures,
-                    )
-                return
-            initialized = True
+        if not await initialize(manager):
+            return
 
         path = file_uri_to_path(uri)
         if not is_relative(shadow_filesystem, path):
@@ -176,10 +529,6 @@ def setup_shadow_filesystem(virtual_documents_uri: str):
                 f"Path {path} is not relative to shadow filesystem root"
             )
 
-        editable_file = EditableFile(path)
-
-        await editable_file.read()
-
         text = extract_or_none(document, ["text"])
 
         if text is not None:
@@ -195,17 +544,42 @@ def setup_shadow_filesystem(virtual_documents_uri: str):
                 )
             changes = message["params"]["contentChanges"]
 
-        if len(changes) > 1:
-            manager.log.warn(  # pragma: no cover
-                "LSP warning: up to one change supported for textDocument/didChange"
-            )
+        editable_file = documents.get(uri)
+        if editable_file is None and uri in scheduled:
+            # forgotten, but not yet written
+            editable_file = scheduled[uri][1]
+        if editable_file is None:
+            editable_file = EditableFile(path, executor)
+            # replacing all of the text does not need the old text
+            if not changes or "range" in changes[0]:
+                await editable_file.read()
+
+        version = document.get("version")
+        applied = (
+            message["method"] == "textDocument/didChange"
+            and isinstance(version, int)
+            and isinstance(editable_file.version, int)
+            and version <= editable_file.version
+        )
 
-        for change in changes[:1]:
-            change_range = change.get("range", editable_file.full_range)
-            editable_file.apply_change(change["text"], **change_range)
+        # unless already applied, for another language server
+        if not applied:
+            for change in changes:
+                change_range = change.get("range", editable_file.full_range)
+                editable_file.apply_change(change["text"], **change_range)
 
-        await editable_file.write()
+            if isinstance(version, int):
+                editable_file.version = version
+
+        documents.put(uri, editable_file)
+
+        if write_delay:
+            schedule_write(uri, editable_file, manager)
+        else:
+            await write(uri, editable_file)
 
         return path
 
+    # for whoever waits for the virtual documents directory to exist
+    shadow_virtual_documents.initialize = initialize  # type: ignore[attr-defined]
     return shadow_virtual_documents